@@ -0,0 +1,73 @@
+# On-disk cache of the artifacts built from grammars
+#
+# Entries are directories named by a hash of their content and of the
+# interpreter able to use them (see key). An entry is built in a
+# temporary directory and published with an atomic rename, so many
+# processes may fill the cache at once: the first rename wins, the
+# others drop their copy and use it.
+import hashlib
+import os
+import shutil
+import sys
+import sysconfig
+import tempfile
+import pyrser
+
+
+def directory() -> str:
+    """Root of the cache, $PYRSER_CACHE or ~/.cache/pyrser."""
+    root = os.environ.get('PYRSER_CACHE')
+    if root is None:
+        root = os.path.join(os.environ.get('XDG_CACHE_HOME',
+                                           os.path.expanduser('~/.cache')),
+                            'pyrser')
+    return root
+
+
+def key(*parts: str) -> str:
+    """Hash of parts, the pyrser version and the interpreter ABI."""
+    h = hashlib.sha256()
+    for part in (pyrser.__version__, sys.implementation.cache_tag,
+                 sysconfig.get_config_var('EXT_SUFFIX') or '') + parts:
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def lookup(kind: str, hkey: str) -> str:
+    """Directory of the entry hkey of kind, or None."""
+    path = os.path.join(directory(), kind, hkey)
+    if os.path.isdir(path):
+        return path
+    return None
+
+
+def mkdtemp(kind: str) -> str:
+    """New directory to build an entry of kind, see publish."""
+    path = os.path.join(directory(), kind)
+    os.makedirs(path, exist_ok=True)
+    return tempfile.mkdtemp(prefix='.tmp-', dir=path)
+
+
+def publish(kind: str, hkey: str, tmp: str) -> str:
+    """Move the directory tmp built by mkdtemp to the entry hkey of kind.
+
+    Return the directory of the entry, that may be published by another
+    process first.
+    """
+    path = os.path.join(directory(), kind, hkey)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+        shutil.rmtree(tmp, ignore_errors=True)
+    return path
+
+
+def replace(path: str, data: bytes):
+    """Write data in path, readers see the old or the new file only."""
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
@@ -1,21 +1,30 @@
-# This module is the STUB for converting grammar into a Cython module
+# This module converts the terminal-only subtrees of a grammar into C
+# matchers, compiled by Cython into an extension module.
+#
+# Rules, hooks, captures and directives stay evaluated by the python
+# parser, so ASTs are the ones of the python engine: each terminal-only
+# subtree is replaced by a functors.Native calling its matcher (see
+# install).
+import hashlib
+import importlib
+import itertools
 import os
 import subprocess
 import shutil
+import sys
 from string import Template
 from pyrser.codegen.c import template_cython
+from pyrser import cache
 from pyrser import meta
-from pyrser import fmt
 from pyrser import parsing
 from pyrser.parsing import functors
 from pyrser import grammar
-from pyrser.passes import to_yml
 
 tpl_python = Template(template_cython.c_python)
-tpl_python_attr = Template(template_cython.c_python_attr)
 tpl_setup = Template(template_cython.c_setup)
 tpl_pyx = Template(template_cython.c_pyx)
 tpl_pyx_rules = Template(template_cython.c_pyx_rules)
+tpl_pyx_matcher = Template(template_cython.c_pyx_matcher)
 tpl_pxd = Template(template_cython.c_pxd)
 tpl_pproto = Template(template_cython.c_pproto)
 # C Stub Templates
@@ -23,61 +32,260 @@ tpl_header = Template(template_cython.c_header)
 tpl_file = Template(template_cython.c_file)
 tpl_cproto = Template(template_cython.c_cproto)
 tpl_function = Template(template_cython.c_function)
+tpl_decl = Template(template_cython.c_decl)
+tpl_const_text = Template(template_cython.c_const_text)
 # Primitives Alt/Seq/Rep
-tpl_seqhead = Template(template_cython.c_seqhead)
-tpl_seqfoot = Template(template_cython.c_seqfoot)
 tpl_seq = Template(template_cython.c_seq)
-tpl_althead = Template(template_cython.c_althead)
-tpl_altfoot = Template(template_cython.c_altfoot)
+tpl_alt_head = Template(template_cython.c_alt_head)
 tpl_alt = Template(template_cython.c_alt)
+tpl_alt_last = Template(template_cython.c_alt_last)
 tpl_rep0n = Template(template_cython.c_rep0n)
 tpl_rep1n = Template(template_cython.c_rep1n)
 tpl_repopt = Template(template_cython.c_repopt)
+tpl_rep_not_char = Template(template_cython.c_rep_not_char)
 # Primitives !,~,!!,->
 tpl_neg = Template(template_cython.c_neg)
 tpl_complement = Template(template_cython.c_complement)
 tpl_lookahead = Template(template_cython.c_lookahead)
 tpl_until = Template(template_cython.c_until)
-# Primitives '', ..., ""
+tpl_until_text = Template(template_cython.c_until_text)
+# Primitives '', ..., "", #skipIgnore
 tpl_char = Template(template_cython.c_char)
 tpl_range = Template(template_cython.c_range)
 tpl_text = Template(template_cython.c_text)
+tpl_peek_char = Template(template_cython.c_peek_char)
+tpl_peek_text = Template(template_cython.c_peek_text)
+tpl_until_char = Template(template_cython.c_until_char)
+tpl_skip_ignore = Template(template_cython.c_skip_ignore)
+
 
 def genImport(g: grammar.Grammar, indir='.') -> 'module':
-    generate(p, indir)
+    """Generate the native parser of g in indir and import it."""
+    generate(g, indir)
     lspkg = []
     for p in indir.split(os.sep):
-        if p[0] != '.':
+        if p != '' and p[0] != '.':
             lspkg.append(p)
-    lspkg.append(type(p).__name__.lower())
+    lspkg.append(type(g).__name__.lower())
     pkg_name = '.'.join(lspkg)
     return importlib.import_module(pkg_name)
 
-# Use the Cython stub to translate grammar g into C/Python in the output directory p
+
+# Use the Cython stub to translate grammar g into C/Python in the output
+# directory indir
 def generate(g: grammar.Grammar, indir='.', keep_tmp=False):
+    """Build the native matchers of g in indir.
+
+    indir receives the extension module <Name>_generated and the python
+    module <name> defining the grammar Name like g, with the matchers
+    installed. Hooks are not part of the generated module: to keep them,
+    install the extension module on the grammar class defining them.
+
+    Extension modules are built once by sources, pyrser version and
+    interpreter (see build). With keep_tmp, the sources are kept in
+    indir/<Name>_generated.
+    """
     ctype_name = g.__class__.__name__
-    p = indir + os.sep + ctype_name + '_generated'
     cstub = g.to_cython(ctype_name)
-    os.makedirs(p, exist_ok=True)
-    with open(p + os.sep + 'setup.py', 'w') as f:
-        f.write(str(cstub.setup))
-    with open(p + os.sep + ctype_name + ".pyx", 'w') as f:
-        f.write(str(cstub.pyx))
-    with open(p + os.sep + ctype_name + "_internal.pxd", 'w') as f:
-        f.write(str(cstub.pxd))
-    with open(p + os.sep + ctype_name + "_internal.h", 'w') as f:
-        f.write(str(cstub.cheader))
-    with open(p + os.sep + ctype_name + "_internal.c", 'w') as f:
-        f.write(str(cstub.csource))
-    tmpdir = os.getcwd()
-    os.chdir(p)
-    subprocess.check_call(['python3', 'setup.py', 'build'])
-    subprocess.check_call(['python3', 'setup.py', 'install_lib', '-d', '..'])
-    os.chdir(tmpdir)
-    if not keep_tmp:
-        shutil.rmtree(p)
-    with open(indir + os.sep + ctype_name.lower() + '.py', 'w') as f:
-        f.write(str(cstub.psource))
+    sources = stub_sources(ctype_name, cstub)
+    if keep_tmp:
+        p = indir + os.sep + ctype_name + '_generated'
+        os.makedirs(p, exist_ok=True)
+        for name, source in sources.items():
+            with open(p + os.sep + name, 'w') as f:
+                f.write(source)
+    lib = build(sources)
+    for name in os.listdir(lib):
+        with open(lib + os.sep + name, 'rb') as f:
+            cache.replace(indir + os.sep + name, f.read())
+    cache.replace(indir + os.sep + ctype_name.lower() + '.py',
+                  str(cstub.psource).encode('utf-8'))
+
+
+def stub_sources(ctype_name: str, cstub: 'CStub') -> dict:
+    """Files of the extension module of cstub by names."""
+    return {
+        'setup.py': str(cstub.setup),
+        ctype_name + '_generated.pyx': str(cstub.pyx),
+        ctype_name + '_internal.pxd': str(cstub.pxd),
+        ctype_name + '_internal.h': str(cstub.cheader),
+        ctype_name + '_internal.c': str(cstub.csource),
+    }
+
+
+def build(sources: dict) -> str:
+    """Directory of the extension module built from sources.
+
+    Builds are cached (see pyrser.cache) by a hash of the sources, so a
+    grammar is compiled once for all processes.
+    """
+    hkey = cache.key(*(name + '\n' + sources[name]
+                       for name in sorted(sources)))
+    lib = cache.lookup('native', hkey)
+    if lib is not None:
+        return lib
+    tmp = cache.mkdtemp('native')
+    try:
+        p = tmp + os.sep + 'src'
+        os.makedirs(p)
+        for name, source in sources.items():
+            with open(p + os.sep + name, 'w') as f:
+                f.write(source)
+        subprocess.check_call([sys.executable, 'setup.py', '-q', 'build'],
+                              cwd=p)
+        subprocess.check_call([sys.executable, 'setup.py', '-q',
+                               'install_lib', '-d', '../lib'], cwd=p)
+        lib = cache.publish('native', hkey, tmp + os.sep + 'lib')
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return lib
+
+
+def install(cls: type, module: 'module') -> int:
+    """Replace the terminal-only subtrees of the rules of cls by the
+    matchers of module, built by generate.
+
+    Only the rules defined by cls itself are changed, subtrees without a
+    matcher in module stay as they are. Return the number of subtrees
+    replaced.
+    """
+    rules = cls._rules.maps[0]
+    done = {}
+    count = 0
+    for name, pt in list(rules.items()):
+        if not isinstance(pt, functors.Functor):
+            continue
+        if id(pt) not in done:
+            native = _install(pt, module.matchers)
+            count += native[1]
+            done[id(pt)] = native[0]
+        if done[id(pt)] is not pt:
+            rules[name] = done[id(pt)]
+    return count
+
+
+def _install(pt: functors.Functor, matchers: dict) -> (functors.Functor,
+                                                       int):
+    """pt or the Native replacing it, and the number of replacements."""
+    if _fused(pt):
+        match = matchers.get(matcher_name(pt))
+        if match is not None:
+            return functors.Native(pt, match, ignored(pt)), 1
+    count = 0
+    for attr in ('pt', 'begin', 'end'):
+        sub = getattr(pt, attr, None)
+        if isinstance(sub, functors.Functor):
+            sub, n = _install(sub, matchers)
+            setattr(pt, attr, sub)
+            count += n
+    if hasattr(pt, 'ptlist'):
+        ptlist = []
+        for sub in pt.ptlist:
+            if isinstance(sub, functors.Functor):
+                sub, n = _install(sub, matchers)
+                count += n
+            ptlist.append(sub)
+        pt.ptlist = type(pt.ptlist)(ptlist)
+    return pt, count
+
+
+# functors having a matcher, only the exact classes as subclasses may
+# change their behavior
+_terminals = {functors.Char, functors.Text, functors.Range,
+              functors.PeekChar, functors.PeekText, functors.UntilChar,
+              functors.SkipIgnore}
+_containers = {functors.Seq, functors.Alt, functors.RepOptional,
+               functors.Rep0N, functors.Rep1N, functors.Neg,
+               functors.LookAhead, functors.Complement, functors.Until,
+               functors.Regex}
+
+
+def native(pt) -> bool:
+    """True if pt can be evaluated by a matcher."""
+    kind = type(pt)
+    if kind in (functors.Char, functors.PeekChar, functors.UntilChar):
+        return len(pt.char) == 1
+    if kind is functors.Range:
+        return len(pt.begin) == 1 and len(pt.end) == 1
+    if kind in _terminals:
+        return True
+    if kind not in _containers:
+        return False
+    if hasattr(pt, 'ptlist'):
+        return all(native(sub) for sub in pt.ptlist)
+    return native(pt.pt)
+
+
+def _fused(pt) -> bool:
+    """True if pt is replaced by a matcher, single terminals being as
+    fast in python.
+    """
+    return type(pt) in _containers and native(pt)
+
+
+def subtrees(pt: functors.Functor) -> iter:
+    """The biggest subtrees of pt replaced by a matcher."""
+    todo = [pt]
+    seen = set()
+    while len(todo) > 0:
+        pt = todo.pop()
+        if id(pt) in seen:
+            continue
+        seen.add(id(pt))
+        if _fused(pt):
+            yield pt
+            continue
+        for attr in ('pt', 'begin', 'end'):
+            sub = getattr(pt, attr, None)
+            if isinstance(sub, functors.Functor):
+                todo.append(sub)
+        for sub in reversed(getattr(pt, 'ptlist', ())):
+            if isinstance(sub, functors.Functor):
+                todo.append(sub)
+
+
+def signature(pt) -> str:
+    """Text identifying the behavior of a native subtree."""
+    kind = type(pt)
+    if kind is functors.Regex:
+        return signature(pt.pt)
+    if kind in (functors.Char, functors.PeekChar, functors.UntilChar):
+        return "%s(%r)" % (kind.__name__, pt.char)
+    if kind is functors.Text:
+        return "Text(%r)" % pt.text
+    if kind is functors.Range:
+        return "Range(%r,%r)" % (pt.begin, pt.end)
+    if kind is functors.SkipIgnore:
+        return "SkipIgnore"
+    if hasattr(pt, 'ptlist'):
+        return "%s(%s)" % (kind.__name__,
+                           ','.join(signature(sub) for sub in pt.ptlist))
+    return "%s(%s)" % (kind.__name__, signature(pt.pt))
+
+
+def matcher_name(pt) -> str:
+    return 'm_' + hashlib.sha1(signature(pt).encode('utf-8')).hexdigest()[:16]
+
+
+def ignored(pt) -> bool:
+    """True if pt skips the ignored chars."""
+    if type(pt) is functors.SkipIgnore:
+        return True
+    if hasattr(pt, 'ptlist'):
+        return any(ignored(sub) for sub in pt.ptlist)
+    sub = getattr(pt, 'pt', None)
+    return sub is not None and ignored(sub)
+
+
+def _single(pt):
+    """The functor evaluated by pt, thru the sequences of one functor."""
+    while True:
+        if type(pt) is functors.Regex:
+            pt = pt.pt
+        elif type(pt) is functors.Seq and len(pt.ptlist) == 1:
+            pt = pt.ptlist[0]
+        else:
+            return pt
 
 
 class CStub:
@@ -89,387 +297,322 @@ class CStub:
         self.cheader = None
         self.csource = None
 
+
 class GenState:
+    """Names of the labels, saved positions and constants of a C file."""
     def __init__(self):
-        self._lvlids = [0]
-        self._lvlid = 0
-        self._errids = [0]
-        self._errid = 0
-
-    def newScopeError(self):
-        self._lvlid += 1
-        self._lvlids.append(self._lvlid)
-        self._errid += 1
-        self._errids.append(self._errid)
-
-    def popScopeError(self):
-        self._lvlids.pop()
-        self._errids.pop()
-
-    def newScopeAlt(self):
-        self._lvlids.append(self.lvlid)
-        self._errid += 1
-        self._errids.append(self._errid)
-
-    def popScopeAlt(self):
-        self._lvlids.pop()
-        self._errids.pop()
-
-    @property
-    def lvlid(self):
-        if len(self._lvlids) > 1:
-            return self._lvlids[-1]
-        return 0
-
-    @property
-    def outid(self):
-        return self._lvlids[-2]
-
-    @property
-    def errid(self):
-        if len(self._errids) > 1:
-            return self._errids[-1]
-        return 0
-
-    @property
-    def outerrid(self):
-        return self._errids[-2]
-
-    def __repr__(self):
-        txt = "Lvl: [\n"
-        for l in self._lvlids:
-            txt += str(l) + ",\n"
-        txt += "]\nErr:[\n"
-        for e in self._errids:
-            txt += str(e) + ",\n"
-        txt += "]\n"
-        return txt
+        self._ids = itertools.count()
+        self._texts = {}
+        # constants of the file
+        self.consts = []
+        # saved positions of the current matcher
+        self.decls = []
+
+    def label(self) -> str:
+        return "l%d" % next(self._ids)
+
+    def var(self) -> str:
+        var = "v%d" % next(self._ids)
+        self.decls.append(var)
+        return var
+
+    def text(self, text: str) -> str:
+        """Name of the constants of text."""
+        if text not in self._texts:
+            name = "t%d" % len(self._texts)
+            chars = ', '.join(str(ord(c)) for c in text) or '0'
+            latin1 = 'NULL'
+            if all(ord(c) < 256 for c in text):
+                latin1 = '"%s"' % ''.join('\\%03o' % ord(c) for c in text)
+            self.consts.append(tpl_const_text.substitute(
+                name=name,
+                chars=chars,
+                latin1=latin1
+            ))
+            self._texts[text] = name
+        return self._texts[text]
+
 
 @meta.add_method(parsing.Parser)
 def to_cython(self, ctype_name: str) -> CStub:
     cstub = CStub()
     # SETUP GENERATION
-    cstub.setup = fmt.end('', [])
-    cstub.setup.lsdata.append(tpl_setup.substitute(
-        ctn=ctype_name,
-    ))
+    cstub.setup = tpl_setup.substitute(ctn=ctype_name)
     # CSOURCE GENERATION
-    pyattr = fmt.end('', [])
-    pyxprotos = fmt.end('', [])
-    pprotos = fmt.end('', [])
-    cprotos = fmt.end('', [])
-    gram = fmt.end('//---\n', [])
-    gram.lsdata.append(tpl_file.substitute(ctn=ctype_name))
-    for k, v in self.__class__._rules.items():
-        try:
-            if isinstance(v, parsing.Functor):
-                genstate = GenState()
-                fun_name = k.replace('.', '_')
-                #
-                if not isinstance(v, functors.Seq):
-                    v = functors.Seq(v)
-                rule_code = v.to_cython(genstate)
-                content = tpl_function.substitute(
-                    ctn=ctype_name,
-                    rule=fun_name,
-                    code=fmt.tab([rule_code]),
-                    lvlid=genstate.lvlid,
-                    errid=genstate.errid
-                )
-                rule = fmt.sep(
-                               '\n',
-                               [
-                                "//--- %s" % k,
-                                content
-                               ]
-                )
-                pyattr.lsdata.append(tpl_python_attr.substitute(
-                    rule=fun_name
-                ))
-                pprotos.lsdata.append(tpl_pproto.substitute(
-                    ctn=ctype_name,
-                    rule=fun_name
-                ))
-                cprotos.lsdata.append(tpl_cproto.substitute(
-                    ctn=ctype_name,
-                    rule=fun_name
-                ))
-                pyxprotos.lsdata.append(tpl_pyx_rules.substitute(
-                    ctn=ctype_name,
-                    rule=fun_name
-                ))
-                gram.lsdata.append(rule)
-        except:
-            #print("Can't Transform %s = %s" % (k, to_yml.to_yml(v)))
-            pass
-    cstub.csource = gram
+    genstate = GenState()
+    pyxprotos = []
+    pyxmatchers = []
+    pprotos = []
+    cprotos = []
+    functions = []
+    names = set()
+    for pt in self.__class__._rules.maps[0].values():
+        if not isinstance(pt, functors.Functor):
+            continue
+        for sub in subtrees(pt):
+            name = matcher_name(sub)
+            if name in names:
+                continue
+            names.add(name)
+            genstate.decls = []
+            fail = genstate.label()
+            code = sub.to_cython(genstate, fail)
+            functions.append(tpl_function.substitute(
+                ctn=ctype_name,
+                name=name,
+                decls=''.join(tpl_decl.substitute(var=var)
+                              for var in genstate.decls),
+                code=code,
+                fail=fail
+            ))
+            cprotos.append(tpl_cproto.substitute(ctn=ctype_name, name=name))
+            pprotos.append(tpl_pproto.substitute(ctn=ctype_name, name=name))
+            pyxprotos.append(tpl_pyx_rules.substitute(
+                ctn=ctype_name,
+                name=name
+            ))
+            pyxmatchers.append(tpl_pyx_matcher.substitute(name=name))
+    cstub.csource = '\n'.join([tpl_file.substitute(ctn=ctype_name)]
+                              + genstate.consts + functions)
     # PYTHON GENERATION
-    cstub.psource = fmt.end('', [])
-    cstub.psource.lsdata.append(tpl_python.substitute(
+    cstub.psource = tpl_python.substitute(
         ctn=ctype_name,
-        rules_attr=str(pyattr)
-    ))
+        entry=repr(self.entry),
+        grammar=repr(self.grammar)
+    )
     # CHEADER GENERATION
-    cstub.cheader = fmt.end('', [])
-    cstub.cheader.lsdata.append(tpl_header.substitute(
+    cstub.cheader = tpl_header.substitute(
         ctn=ctype_name,
-        cfunctions_proto=str(cprotos)
-    ))
+        cfunctions_proto=''.join(cprotos)
+    )
     # PXD GENERATION
-    cstub.pxd = fmt.end('', [])
-    cstub.pxd.lsdata.append(tpl_pxd.substitute(
+    cstub.pxd = tpl_pxd.substitute(
         ctn=ctype_name,
-        pfunctions_proto=str(pprotos)
-    ))
+        pfunctions_proto=''.join(pprotos)
+    )
     # PYX GENERATION
-    cstub.pyx = fmt.end('', [])
-    cstub.pyx.lsdata.append(tpl_pyx.substitute(
+    cstub.pyx = tpl_pyx.substitute(
         ctn=ctype_name,
-        rfunctions_proto=str(pyxprotos)
-    ))
+        rfunctions_proto=''.join(pyxprotos),
+        matchers=''.join(pyxmatchers)
+    )
     return cstub
 
-@meta.add_method(functors.SkipIgnore)
-def to_cython(self, genstate) -> fmt.indentable:
-    """
-    TODO: A quite important part of C transform... rethink directive/decoration/etc...
-    """
-    return '\n'
 
-@meta.add_method(functors.Rule)
-def to_cython(self, genstate) -> fmt.indentable:
-    return '\n'
+@meta.add_method(functors.SkipIgnore)
+def to_cython(self, genstate: GenState, fail: str) -> str:
+    return tpl_skip_ignore.substitute()
 
-@meta.add_method(functors.Hook)
-def to_cython(self, genstate) -> fmt.indentable:
-    return '\n'
 
 @meta.add_method(functors.PeekText)
-def to_cython(self, genstate) -> fmt.indentable:
-    raise TypeError("functors.PeekText don't have to be in a PTree for Cythonization")
+def to_cython(self, genstate: GenState, fail: str) -> str:
+    return tpl_peek_text.substitute(
+        text=genstate.text(self.char),
+        length=len(self.char),
+        fail=fail
+    )
+
 
 @meta.add_method(functors.PeekChar)
-def to_cython(self, genstate) -> fmt.indentable:
-    raise TypeError("functors.PeekChar don't have to be in a PTree for Cythonization")
+def to_cython(self, genstate: GenState, fail: str) -> str:
+    return tpl_peek_char.substitute(char=ord(self.char), fail=fail)
+
 
 @meta.add_method(functors.Range)
-def to_cython(self, genstate) -> fmt.indentable:
+def to_cython(self, genstate: GenState, fail: str) -> str:
     return tpl_range.substitute(
-        char_begin=self.begin,
-        char_end=self.end,
-        lvlid=genstate.lvlid,
-        errid=genstate.errid
+        char_begin=ord(self.begin),
+        char_end=ord(self.end),
+        fail=fail
     )
 
+
 @meta.add_method(functors.Text)
-def to_cython(self, genstate) -> fmt.indentable:
+def to_cython(self, genstate: GenState, fail: str) -> str:
     return tpl_text.substitute(
-        text=self.text,
-        lvlid=genstate.lvlid,
-        errid=genstate.errid
+        text=genstate.text(self.text),
+        length=len(self.text),
+        fail=fail
     )
 
-@meta.add_method(functors.Char)
-def to_cython(self, genstate) -> fmt.indentable:
-    return tpl_char.substitute(
-        char=self.char,
-        lvlid=genstate.lvlid,
-        errid=genstate.errid
-    )
 
-@meta.add_method(functors.Scope)
-def to_cython(self, genstate) -> fmt.indentable:
-    raise TypeError("functors.Scope don't have to be in a PTree for Cythonization")
+@meta.add_method(functors.Char)
+def to_cython(self, genstate: GenState, fail: str) -> str:
+    return tpl_char.substitute(char=ord(self.char), fail=fail)
 
-@meta.add_method(functors.Directive)
-def to_cython(self, genstate) -> fmt.indentable:
-    return '\n'
 
-@meta.add_method(functors.Capture)
-def to_cython(self, genstate) -> fmt.indentable:
-    return '\n'
+@meta.add_method(functors.UntilChar)
+def to_cython(self, genstate: GenState, fail: str) -> str:
+    return tpl_until_char.substitute(
+        save=genstate.var(),
+        char=ord(self.char),
+        inhibitor=ord('\\'),
+        fail=fail
+    )
 
-@meta.add_method(functors.DeclNode)
-def to_cython(self, genstate) -> fmt.indentable:
-    return '\n'
 
-@meta.add_method(functors.Bind)
-def to_cython(self, genstate) -> fmt.indentable:
-    return '\n'
+@meta.add_method(functors.Regex)
+def to_cython(self, genstate: GenState, fail: str) -> str:
+    return self.pt.to_cython(genstate, fail)
 
-@meta.add_method(functors.Error)
-def to_cython(self, genstate) -> fmt.indentable:
-    raise TypeError("functors.Error don't have to be in a PTree for Cythonization")
 
-# concatenate all IR of a seq
+# concatenate all matchers of a seq
 @meta.add_method(functors.Seq)
-def to_cython(self, genstate) -> fmt.indentable:
-    seqs = fmt.tab([])
-    genstate.newScopeError()
-    seqs.lsdata.append(tpl_seqhead.substitute(
-        lvlid=genstate.lvlid,
-        outid=genstate.outid
-    ))
-    for s in self.ptlist:
-        content = tpl_seq.substitute(code=s.to_cython(genstate))
-        seqs.lsdata.append(content)
-    seqs.lsdata.append(tpl_seqfoot.substitute(
-        lvlid=genstate.lvlid,
-        outid=genstate.outid,
-        errid=genstate.errid,
-        outerrid=genstate.outerrid
-    ))
-    genstate.popScopeError()
-    return seqs
+def to_cython(self, genstate: GenState, fail: str) -> str:
+    restore = genstate.label()
+    return tpl_seq.substitute(
+        save=genstate.var(),
+        code=''.join(pt.to_cython(genstate, restore) for pt in self.ptlist),
+        restore=restore,
+        end=genstate.label(),
+        fail=fail
+    )
+
 
 @meta.add_method(functors.Alt)
-def to_cython(self, genstate) -> fmt.indentable:
-    alts = fmt.tab([])
-    genstate.newScopeError()
-    alts.lsdata.append(tpl_althead.substitute(
-        lvlid=genstate.lvlid,
-        outid=genstate.outid
-    ))
-    for s in self.ptlist:
-        if not isinstance(s, functors.Seq):
-            s = functors.Seq(s)
-        genstate.newScopeAlt()
-        content = tpl_alt.substitute(
-            code=s.to_cython(genstate),
-            lvlid=genstate.lvlid,
-            outid=genstate.outid,
-            errid=genstate.errid,
-            outerrid=genstate.outerrid
-        )
-        alts.lsdata.append(content)
-        genstate.popScopeAlt()
-    alts.lsdata.append(tpl_altfoot.substitute(
-        lvlid=genstate.lvlid,
-        outid=genstate.outid,
-        errid=genstate.errid,
-        outerrid=genstate.outerrid
+def to_cython(self, genstate: GenState, fail: str) -> str:
+    save = genstate.var()
+    end = genstate.label()
+    alts = [tpl_alt_head.substitute(save=save)]
+    for pt in self.ptlist[:-1]:
+        nxt = genstate.label()
+        alts.append(tpl_alt.substitute(
+            code=pt.to_cython(genstate, nxt),
+            end=end,
+            next=nxt,
+            save=save
+        ))
+    restore = genstate.label()
+    alts.append(tpl_alt_last.substitute(
+        code=self.ptlist[-1].to_cython(genstate, restore),
+        end=end,
+        restore=restore,
+        save=save,
+        fail=fail
     ))
-    genstate.popScopeError()
-    return alts
+    return ''.join(alts)
+
 
 @meta.add_method(functors.Complement)
-def to_cython(self, genstate) -> fmt.indentable:
-    rule = self.pt
-    if not isinstance(rule, functors.Seq):
-        rule = functors.Seq(rule)
-    genstate.newScopeError()
-    source = fmt.tab([rule.to_cython(genstate)])
-    res = tpl_complement.substitute(
-        code=self.pt.to_cython(genstate),
-        lvlid=genstate.lvlid,
-        outid=genstate.outid,
-        errid=genstate.errid,
-        outerrid=genstate.outerrid
+def to_cython(self, genstate: GenState, fail: str) -> str:
+    step = genstate.label()
+    return tpl_complement.substitute(
+        save=genstate.var(),
+        code=self.pt.to_cython(genstate, step),
+        step=step,
+        fail=fail
     )
-    genstate.popScopeError()
-    return res
+
 
 @meta.add_method(functors.LookAhead)
-def to_cython(self, genstate) -> fmt.indentable:
-    rule = self.pt
-    if not isinstance(rule, functors.Seq):
-        rule = functors.Seq(rule)
-    genstate.newScopeError()
-    source = fmt.tab([rule.to_cython(genstate)])
-    res = tpl_lookahead.substitute(
-        code=self.pt.to_cython(genstate),
-        lvlid=genstate.lvlid,
-        outid=genstate.outid,
-        errid=genstate.errid,
-        outerrid=genstate.outerrid
+def to_cython(self, genstate: GenState, fail: str) -> str:
+    restore = genstate.label()
+    return tpl_lookahead.substitute(
+        save=genstate.var(),
+        code=self.pt.to_cython(genstate, restore),
+        restore=restore,
+        end=genstate.label(),
+        fail=fail
     )
-    genstate.popScopeError()
-    return res
+
 
 @meta.add_method(functors.Neg)
-def to_cython(self, genstate) -> fmt.indentable:
-    rule = self.pt
-    if not isinstance(rule, functors.Seq):
-        rule = functors.Seq(rule)
-    genstate.newScopeError()
-    source = fmt.tab([rule.to_cython(genstate)])
-    res = tpl_neg.substitute(
-        code=self.pt.to_cython(genstate),
-        lvlid=genstate.lvlid,
-        outid=genstate.outid,
-        errid=genstate.errid,
-        outerrid=genstate.outerrid
+def to_cython(self, genstate: GenState, fail: str) -> str:
+    end = genstate.label()
+    return tpl_neg.substitute(
+        save=genstate.var(),
+        code=self.pt.to_cython(genstate, end),
+        end=end,
+        fail=fail
     )
-    genstate.popScopeError()
-    return res
+
 
 @meta.add_method(functors.Until)
-def to_cython(self, genstate) -> fmt.indentable:
-    rule = self.pt
-    if not isinstance(rule, functors.Seq):
-        rule = functors.Seq(rule)
-    genstate.newScopeError()
-    source = fmt.tab([rule.to_cython(genstate)])
-    res = tpl_until.substitute(
-        code=self.pt.to_cython(genstate),
-        lvlid=genstate.lvlid,
-        outid=genstate.outid,
-        errid=genstate.errid,
-        outerrid=genstate.outerrid
+def to_cython(self, genstate: GenState, fail: str) -> str:
+    pt = _single(self.pt)
+    if type(pt) is functors.Char:
+        # memchr of the char
+        return tpl_until_text.substitute(
+            save=genstate.var(),
+            find="find_char(s, p, %d)" % ord(pt.char),
+            length=1,
+            fail=fail
+        )
+    if type(pt) is functors.Text and pt.text != "":
+        # memchr of the first char then memcmp of the text
+        text = genstate.text(pt.text)
+        return tpl_until_text.substitute(
+            save=genstate.var(),
+            find="find_text(s, p, %s, %s_l1, %d)" % (text, text,
+                                                     len(pt.text)),
+            length=len(pt.text),
+            fail=fail
+        )
+    step = genstate.label()
+    return tpl_until.substitute(
+        save=genstate.var(),
+        loop=genstate.label(),
+        code=self.pt.to_cython(genstate, step),
+        step=step,
+        eof=genstate.label(),
+        end=genstate.label(),
+        fail=fail
     )
-    genstate.popScopeError()
-    return res
 
-@meta.add_method(functors.UntilChar)
-def to_cython(self, genstate) -> fmt.indentable:
-    raise TypeError("functors.UntilChar don't have to be in a PTree for Cythonization")
+
+def _not_char(pt) -> functors.Char:
+    """The Char c of a ~'c' repeated, or None."""
+    pt = _single(pt)
+    if type(pt) is functors.Complement:
+        pt = _single(pt.pt)
+        if type(pt) is functors.Char:
+            return pt
+    return None
+
 
 @meta.add_method(functors.RepOptional)
-def to_cython(self, genstate) -> fmt.indentable:
-    repn = self.pt
-    if not isinstance(repn, functors.Seq):
-        repn = functors.Seq(repn)
-    genstate.newScopeError()
-    source = fmt.tab([repn.to_cython(genstate)])
-    res = tpl_repopt.substitute(
-        code=self.pt.to_cython(genstate),
-        lvlid=genstate.lvlid,
-        outid=genstate.outid,
-        errid=genstate.errid,
+def to_cython(self, genstate: GenState, fail: str) -> str:
+    end = genstate.label()
+    return tpl_repopt.substitute(
+        code=self.pt.to_cython(genstate, end),
+        end=end
     )
-    genstate.popScopeError()
-    return res
+
 
 @meta.add_method(functors.Rep0N)
-def to_cython(self, genstate) -> fmt.indentable:
-    repn = self.pt
-    if not isinstance(repn, functors.Seq):
-        repn = functors.Seq(repn)
-    genstate.newScopeError()
-    source = fmt.tab([repn.to_cython(genstate)])
-    res = tpl_rep0n.substitute(
-        code=str(source),
-        lvlid=genstate.lvlid,
-        outid=genstate.outid,
-        errid=genstate.errid,
-        outerrid=genstate.outerrid
+def to_cython(self, genstate: GenState, fail: str) -> str:
+    char = _not_char(self.pt)
+    if char is not None:
+        return tpl_rep_not_char.substitute(
+            save=genstate.var(),
+            char=ord(char.char),
+            min=0,
+            fail=fail
+        )
+    end = genstate.label()
+    return tpl_rep0n.substitute(
+        loop=genstate.label(),
+        code=self.pt.to_cython(genstate, end),
+        end=end
     )
-    genstate.popScopeError()
-    return res
+
 
 @meta.add_method(functors.Rep1N)
-def to_cython(self, genstate) -> fmt.indentable:
-    repn = self.pt
-    if not isinstance(repn, functors.Seq):
-        repn = functors.Seq(repn)
-    genstate.newScopeError()
-    source = fmt.tab([repn.to_cython(genstate)])
-    res = tpl_rep1n.substitute(
-        code=str(source),
-        lvlid=genstate.lvlid,
-        outid=genstate.outid,
-        errid=genstate.errid,
-        outerrid=genstate.outerrid
+def to_cython(self, genstate: GenState, fail: str) -> str:
+    char = _not_char(self.pt)
+    if char is not None:
+        return tpl_rep_not_char.substitute(
+            save=genstate.var(),
+            char=ord(char.char),
+            min=1,
+            fail=fail
+        )
+    end = genstate.label()
+    return tpl_rep1n.substitute(
+        save=genstate.var(),
+        count=genstate.var(),
+        loop=genstate.label(),
+        code=self.pt.to_cython(genstate, end),
+        end=end,
+        fail=fail
     )
-    genstate.popScopeError()
-    return res
@@ -1,228 +1,313 @@
 # Raw C Templates
 # Note:
-# To avoid the handling of an internal state for the status of the last evaluation
-# we just follow positionnal convention inside C templates
-# after a ${code} or at the end of a primitive template your last evaluation IS TRUE
-# FALSE on last evaluation lands into the nearest error_${errid} label
+# A matcher follows the python functors: the cursor is the local p and
+# each primitive falls thru its code when it matches, or goes to the
+# label ${fail} leaving p where the python functor leaves the cursor.
+# The deepest position readed and the last ignored position are updated
+# like the python parser does.
 
 # Header
 c_header = """// This FILE is Generated DO NOT EDIT
+#include <Python.h>
+
 typedef struct
 {
-    char *_stream;
-} ${ctn};
+    const void  *data;
+    int         kind;
+    Py_ssize_t  len;
+    Py_ssize_t  maxpos;
+    Py_ssize_t  ignore_pos;
+    int         last_ignore;
+    int         ignore;
+} ${ctn}_state;
+
+typedef int (*${ctn}_matcher)(${ctn}_state *, Py_ssize_t *);
 
-${ctn}  *${ctn}_new(char *content);
-void    ${ctn}_clean(${ctn} *);
+int     ${ctn}_init(${ctn}_state *s, PyObject *content);
 ${cfunctions_proto}
 """
 
-# Base template for a Rule proto as a C Function
+# Base template for a matcher proto as a C Function
 c_cproto = """\
-int    read_${rule}(${ctn} *_self);
+int     ${ctn}_${name}(${ctn}_state *s, Py_ssize_t *pos);
 """
 
 # Source code STUB
 c_file = """// This FILE is Generated DO NOT EDIT
-#include <stdlib.h>
-#include <stdio.h>
+#include <string.h>
 #include "${ctn}_internal.h"
 
-#define TRUE    1
-#define FALSE   0
+#if defined(__GNUC__)
+#pragma GCC diagnostic ignored "-Wunused-label"
+#pragma GCC diagnostic ignored "-Wunused-variable"
+#pragma GCC diagnostic ignored "-Wunused-function"
+#endif
+
+typedef ${ctn}_state state;
 
-${ctn}     *${ctn}_new(char *content)
+#define READ(s, i)  PyUnicode_READ((s)->kind, (s)->data, (i))
+#define BUMP(s, p)  if ((p) > (s)->maxpos) (s)->maxpos = (p)
+#define IGNORE_BLANKS   1
+
+int     ${ctn}_init(state *s, PyObject *content)
 {
-    ${ctn} *self = calloc(1, sizeof(${ctn}));
-    self->_stream = content;
-    return self;
+#if PY_VERSION_HEX < 0x030C0000
+    if (PyUnicode_READY(content) < 0)
+        return -1;
+#endif
+    s->data = PyUnicode_DATA(content);
+    s->kind = PyUnicode_KIND(content);
+    s->len = PyUnicode_GET_LENGTH(content);
+    return 0;
 }
 
-void            ${ctn}_clean(${ctn} *_self)
+// text u of n chars at p, l1 is its latin-1 encoding or NULL
+static int  text_at(const state *s, Py_ssize_t p, const Py_UCS4 *u,
+                    const char *l1, Py_ssize_t n)
 {
-    free(_self);
+    Py_ssize_t  i;
+
+    if (s->len - p < n)
+        return 0;
+    if (s->kind == PyUnicode_1BYTE_KIND)
+        return l1 != NULL
+            && memcmp((const char *) s->data + p, l1, n) == 0;
+    for (i = 0; i < n; i += 1)
+        if (READ(s, p + i) != u[i])
+            return 0;
+    return 1;
 }
-"""
 
-# Base template for a Rule as a C Function
-c_function = """\
-int     read_${rule}(${ctn} *_self)
+// index of the first c from p, or -1
+static Py_ssize_t   find_char(const state *s, Py_ssize_t p, Py_UCS4 c)
 {
-    char *_tmp${lvlid} = _self->_stream;
-    ${code}
-    _self->_stream = _tmp${lvlid};
-    return TRUE;
-    error_${errid}:
-        __attribute__ ((__unused__))
-        return FALSE;
+    const char  *found;
+
+    if (p >= s->len)
+        return -1;
+    if (s->kind == PyUnicode_1BYTE_KIND)
+    {
+        if (c > 0xff)
+            return -1;
+        found = memchr((const char *) s->data + p, (int) c, s->len - p);
+        return found == NULL ? -1 : found - (const char *) s->data;
+    }
+    for (; p < s->len; p += 1)
+        if (READ(s, p) == c)
+            return p;
+    return -1;
 }
-"""
 
-# === SEQ ===
-# header for Sequences
-c_seqhead = """\
+// index of the first text u of n chars from p, or -1
+static Py_ssize_t   find_text(const state *s, Py_ssize_t p,
+                              const Py_UCS4 *u, const char *l1, Py_ssize_t n)
+{
+    while (p <= s->len - n)
     {
-        char *_tmp${lvlid} = _tmp${outid};
+        p = find_char(s, p, u[0]);
+        if (p < 0)
+            return -1;
+        if (text_at(s, p, u, l1, n))
+            return p;
+        p += 1;
+    }
+    return -1;
+}
+
+// index of the first c or inhibitor from p, or -1
+static Py_ssize_t   find_until(const state *s, Py_ssize_t p, Py_UCS4 c,
+                               Py_UCS4 inhibitor)
+{
+    Py_ssize_t  stop;
+    Py_ssize_t  found;
+
+    found = find_char(s, p, c);
+    stop = found < 0 ? s->len : found;
+    for (; p < stop; p += 1)
+        if (READ(s, p) == inhibitor)
+            return p;
+    return found;
+}
+
+static int  is_blank(Py_UCS4 c)
+{
+    return c == ' ' || c == '\\t' || c == '\\v' || c == '\\f'
+        || c == '\\r' || c == '\\n';
+}
 """
 
-# code for each sequence
-c_seq = """\
-        ${code}
+# Text constants, u is the text, l1 its latin-1 encoding or NULL
+c_const_text = """\
+static const Py_UCS4    ${name}[] = {${chars}};
+static const char       *${name}_l1 = ${latin1};
 """
 
-# footer for Sequences
-c_seqfoot = """\
-    //seqfoot
-        goto end_${errid};
-        error_${errid}: __attribute__ ((__unused__))
-            goto error_${outerrid};
-        end_${errid}: __attribute__ ((__unused__))
-            _tmp${outid} = _tmp${lvlid};
-    }\
+# Base template for a matcher as a C Function
+c_function = """\
+int     ${ctn}_${name}(state *s, Py_ssize_t *pos)
+{
+    Py_ssize_t  p = *pos;
+${decls}
+${code}
+    *pos = p;
+    return 1;
+    ${fail}:
+        *pos = p;
+        return 0;
+}
 """
 
-# ===
+# Declaration of the saved positions of a matcher
+c_decl = """\
+    Py_ssize_t  ${var};
+"""
+
+# === SEQ ===
+c_seq = """\
+    ${save} = p;
+${code}
+    goto ${end};
+    ${restore}:
+        p = ${save};
+        goto ${fail};
+    ${end}: ;
+"""
 
 # === ALT ===
-# header for Alternatives
-c_althead = """\
-    {
-        char *_tmp${lvlid} = _tmp${outid};
+c_alt_head = """\
+    ${save} = p;
 """
 
-# Code for each Alternative
+# code for each alternative but the last
 c_alt = """\
-    //alt
-        ${code}
-        // ALT
-        goto end_${outerrid};
-        error_${errid}: __attribute__ ((__unused__))
-        _tmp${lvlid} = _tmp${outid};
+${code}
+    goto ${end};
+    ${next}:
+        p = ${save};
 """
 
-# footer for Alternatives
-c_altfoot = """\
-    //altfoot
-        // for the last alternative reach end_... as else of if statement
-        if (_tmp${lvlid} == _tmp${outid})
-        {   goto error_${outerrid};}
-        end_${errid}: __attribute__ ((__unused__))
-            _tmp${outid} = _tmp${lvlid};
-    }\
+c_alt_last = """\
+${code}
+    goto ${end};
+    ${restore}:
+        p = ${save};
+        goto ${fail};
+    ${end}: ;
 """
-# ===
 
 # === REPEATERS ===
-# rep0n
+c_repopt = """\
+${code}
+    ${end}: ;
+"""
+
 c_rep0n = """\
-    {
-        char *_tmp${lvlid} = _tmp${outid};
-        char *__tmp = _tmp${lvlid};
-        while (TRUE)
-        {
-            ${code}
-            // REP0N
-            _tmp${outid} = _tmp${lvlid};
-            continue;
-            error_${errid}: __attribute__ ((__unused__))
-                break;
-        }
-        // error if not consume
-        if (_tmp${lvlid} == __tmp)
-        {   goto error_${outerrid};}
-    }\
+    ${loop}:
+${code}
+        goto ${loop};
+    ${end}: ;
 """
 
-# rep1n
 c_rep1n = """\
-    {
-        char *_tmp${lvlid} = _tmp${outid};
-        int _cpt = 0;
-        while (TRUE)
+    ${save} = p;
+    ${count} = 0;
+    ${loop}:
+${code}
+        ${count} = 1;
+        goto ${loop};
+    ${end}:
+        if (!${count})
         {
-            ${code}
-            _tmp${outid} = _tmp${lvlid};
-            _cpt += 1;
-            continue;
-            error_${errid}: __attribute__ ((__unused__))
-                break;
+            p = ${save};
+            goto ${fail};
         }
-        // error if not one match
-        if (_cpt == 0)
-        {   goto error_${outerrid};}
-    }\
 """
 
-# repopt
-c_repopt = """\
+# [~'c']* and [~'c']+ stop at the next c
+c_rep_not_char = """\
+    ${save} = find_char(s, p, ${char});
+    if (${save} < 0)
+    {
+        if (${min} && p >= s->len)
+            goto ${fail};
+        p = s->len;
+        BUMP(s, p);
+    }
+    else
     {
-        char *_tmp${lvlid} = _tmp${outid};
-        ${code}
-        _tmp${outid} = _tmp${lvlid};
-        error_${errid}: __attribute__ ((__unused__))
-        //semicolon to avoid "error: label at end of compound statement"
-        ;
-    }\
+        BUMP(s, ${save} + 1);
+        if (${min} && ${save} == p)
+            goto ${fail};
+        p = ${save};
+    }
 """
-# ===
 
 # === !,~,!!,-> ===
 c_neg = """\
-    {
-        char *_tmp${lvlid} = _tmp${outid};
-        ${code}
-        goto error_${outerrid};
-        error_${errid}: __attribute__ ((__unused__))
-        // semicolon to avoid "error: label at end of compound statement"
-        ;
-    }\
+    ${save} = p;
+${code}
+    p = ${save};
+    goto ${fail};
+    ${end}: ;
+"""
+
+c_lookahead = """\
+    ${save} = p;
+${code}
+    p = ${save};
+    goto ${end};
+    ${restore}:
+        p = ${save};
+        goto ${fail};
+    ${end}: ;
 """
 
 c_complement = """\
-    {
-        // complement
-        char *_tmp${lvlid} = _tmp${outid};
-        ${code}
-        goto error_${outerrid};
-        error_${errid}: __attribute__ ((__unused__))
-            if (*_tmp${outid} != 0)
-            {   _tmp${outid} += 1;}
-            else
-            {   goto error_${outerrid};}
-    }\
+    if (p >= s->len)
+        goto ${fail};
+    ${save} = p;
+${code}
+    p = ${save};
+    goto ${fail};
+    ${step}:
+        if (p < s->len)
+            p += 1;
+        BUMP(s, p);
 """
 
-c_lookahead = """
-    {
-        char *_tmp${lvlid} = _tmp${outid};
-        ${code}
-        goto nothing_${errid};
-        error_${errid}: __attribute__ ((__unused__))
-            goto error_${outerrid};
-        nothing_${errid}: __attribute__ ((__unused__))
-        // semicolon to avoid "error: label at end of compound statement"
-        ;
-    }\
+c_until = """\
+    ${save} = p;
+    ${loop}:
+        if (p >= s->len)
+            goto ${eof};
+${code}
+        goto ${end};
+    ${step}:
+        if (p < s->len)
+            p += 1;
+        BUMP(s, p);
+        goto ${loop};
+    ${eof}:
+        p = ${save};
+        if (p > s->ignore_pos)
+            p = s->ignore_pos;
+        goto ${fail};
+    ${end}: ;
 """
 
-c_until = """
+# ->'c' and ->"text" stop after the next occurence
+c_until_text = """\
+    ${save} = p < s->len ? ${find} : -1;
+    if (${save} < 0)
     {
-        char *_tmp${lvlid};
-        char *__tmpreset = _tmp${outid};
-        while (TRUE)
-        {
-            _tmp${lvlid} = _tmp${outid};
-            ${code}
-            break;
-            error_${errid}: __attribute__ ((__unused__))
-                if (*_tmp${lvlid} == 0)
-                {
-                    _tmp${outid} = __tmpreset;
-                    goto error_${outerrid};
-                }
-                _tmp${outid} += 1;
-        }
+        if (p < s->len)
+            BUMP(s, s->len);
+        if (p > s->ignore_pos)
+            p = s->ignore_pos;
+        goto ${fail};
     }
+    p = ${save} + ${length};
+    BUMP(s, p);
 """
 
 # ===
@@ -230,30 +315,76 @@ c_until = """
 # === BASE PRIMITIVE ===
 # Base template for read a Char
 c_char = """\
-    if (*_tmp${lvlid} != '${char}')
-    {   goto error_${errid};}
-    _tmp${lvlid} += 1;\
+    if (p >= s->len || READ(s, p) != ${char})
+        goto ${fail};
+    p += 1;
+    BUMP(s, p);
 """
 
 # Base template for read a Range
 c_range = """\
-    if (*_tmp${lvlid} < '${char_begin}' || *_tmp${lvlid} > '${char_end}')
-    {   goto error_${errid};}
-    _tmp${lvlid} += 1;\
+    if (p >= s->len || READ(s, p) < ${char_begin}
+            || READ(s, p) > ${char_end})
+        goto ${fail};
+    p += 1;
+    BUMP(s, p);
 """
 
 # Base template for read a Text
 c_text = """\
+    if (p >= s->len || !text_at(s, p, ${text}, ${text}_l1, ${length}))
+        goto ${fail};
+    p += ${length};
+    BUMP(s, p);
+"""
+
+c_peek_char = """\
+    if (p >= s->len || READ(s, p) != ${char})
+        goto ${fail};
+"""
+
+c_peek_text = """\
+    if (!text_at(s, p, ${text}, ${text}_l1, ${length}))
+        goto ${fail};
+"""
+
+# read_until, an inhibitor escapes the next char
+c_until_char = """\
+    if (p >= s->len)
+        goto ${fail};
+    ${save} = p;
+    for (;;)
     {
-        char *_text = "${text}";
-        char *__tmp = _tmp${lvlid};
-        while (*_text != 0)
+        ${save} = find_until(s, ${save}, ${char}, ${inhibitor});
+        if (${save} < 0)
+            break;
+        if (READ(s, ${save}) == ${inhibitor})
         {
-            if (*__tmp != *_text)
-            {   goto error_${errid};}
-            __tmp += 1;
-            _text += 1;
+            ${save} += 2;
+            if (${save} >= s->len)
+                break;
         }
-        _tmp${lvlid} = __tmp;
-    }\
+        if (READ(s, ${save}) == ${char})
+            break;
+        ${save} += 1;
+    }
+    if (${save} < 0 || ${save} >= s->len || READ(s, ${save}) != ${char})
+    {
+        BUMP(s, s->len);
+        goto ${fail};
+    }
+    p = ${save} + 1;
+    BUMP(s, p);
+"""
+
+# Skip the ignored chars
+c_skip_ignore = """\
+    if (s->ignore == IGNORE_BLANKS)
+    {
+        while (p < s->len && is_blank(READ(s, p)))
+            p += 1;
+        BUMP(s, p);
+    }
+    s->last_ignore = (p != s->ignore_pos);
+    s->ignore_pos = p;
 """
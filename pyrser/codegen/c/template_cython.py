@@ -2,87 +2,88 @@
 from pyrser.codegen.c.template_c import *
 
 # Python Source
-c_python = """
+c_python = """# This FILE is Generated DO NOT EDIT
 from pyrser import grammar
-from pyrser.parsing.base import MetaBasicParser
-from ${ctn}_generated import ${ctn} as BaseCython
-
-class BasePython(BaseCython, metaclass=MetaBasicParser):
-    _rules = {
-        ${rules_attr}
-    }
-    def __init__(self, content: str='', stream_name: str=''):
-        # the __cinit__ of BaseCython is *implicitly* called!
-        # this is hard to find and is not a bug... it's feature
-        pass
-
-class ${ctn}(BasePython, grammar.Grammar):
-    def __init__(self, content: str='', stream_name: str=None):
-        BasePython.__init__(self, content, stream_name)
-"""
+from pyrser.codegen.c import cython
+import ${ctn}_generated
+
+
+class ${ctn}(grammar.Grammar):
+    entry = ${entry}
+    grammar = ${grammar}
 
-# Python Attr
-c_python_attr = """
-        '${rule}': BaseCython.${rule},
+
+cython.install(${ctn}, ${ctn}_generated)
 """
 
 # SETUP HEADER
 c_setup = """
-from distutils.core import setup
-from distutils.extension import Extension
-from Cython.Distutils import build_ext
+from setuptools import setup
+from setuptools.extension import Extension
+from Cython.Build import cythonize
 
-${ctn}_generated = Extension("${ctn}_generated", ["${ctn}_internal.c", "${ctn}.pyx"])
+${ctn}_generated = Extension(
+    "${ctn}_generated",
+    ["${ctn}_internal.c", "${ctn}_generated.pyx"]
+)
 
 setup(
-    cmdclass = {'build_ext': build_ext},
-    ext_modules = [${ctn}_generated]
+    ext_modules=cythonize([${ctn}_generated], language_level=3)
 )
 """
 
 # PYX HEADER
-c_pyx = """
-cimport ${ctn}_internal
-
-cdef class ${ctn}:
-    # wrap it for python
-    cdef ${ctn}_internal.${ctn}     *_inst
-    cdef bytes                      _content
-    cdef bytes                      _stream_name
-    def __cinit__(self, content='', stream_name=''):
-        # encode in utf-8 for easiest parsing
-        self._stream_name = stream_name.encode('UTF-8')
-        self._content = content.encode('UTF-8')
-        # instanciate internal
-        self._inst = ${ctn}_internal.${ctn}_new(self._content)
-        if self._inst is NULL:
-            raise MemoryError()
-
-    def __dealloc(self):
-        print("DEALLOC")
-        if self._inst is not NULL:
-            ${ctn}_internal.${ctn}_clean(self._inst)
+c_pyx = """# This FILE is Generated DO NOT EDIT
+cimport ${ctn}_internal as internal
+
+
+cdef tuple _match(internal.${ctn}_matcher matcher, str content,
+                  Py_ssize_t index, int ignore, Py_ssize_t last_ignore_index,
+                  bint last_ignore, Py_ssize_t maxindex):
+    cdef internal.${ctn}_state s
+    internal.${ctn}_init(&s, content)
+    s.ignore = ignore
+    s.ignore_pos = last_ignore_index
+    s.last_ignore = last_ignore
+    s.maxpos = maxindex
+    res = matcher(&s, &index) != 0
+    return (res, index, s.maxpos, s.ignore_pos, s.last_ignore != 0)
+
 ${rfunctions_proto}
+
+# matchers by signature of the subtrees (see cython.signature)
+matchers = {
+${matchers}
+}
 """
 
 # PYX RULES
 c_pyx_rules = """
-    def ${rule}(self):
-        return ${ctn}_internal.read_${rule}(self._inst)
+def ${name}(str content, Py_ssize_t index, int ignore,
+        Py_ssize_t last_ignore_index, bint last_ignore, Py_ssize_t maxindex):
+    return _match(internal.${ctn}_${name}, content, index, ignore,
+                  last_ignore_index, last_ignore, maxindex)
+"""
+
+# PYX MATCHERS
+c_pyx_matcher = """\
+    '${name}': ${name},
 """
 
 # PXD HEADER
 c_pxd = """
 cdef extern from "${ctn}_internal.h":
-    ctypedef struct ${ctn}:
-        pass
-    ${ctn}      *${ctn}_new(char *)
-    void        ${ctn}_clean(${ctn} *)
-    # convert int to boolean use bint
-    ${pfunctions_proto}
+    ctypedef struct ${ctn}_state:
+        Py_ssize_t  maxpos
+        Py_ssize_t  ignore_pos
+        int         last_ignore
+        int         ignore
+    ctypedef int (*${ctn}_matcher)(${ctn}_state *, Py_ssize_t *)
+    int ${ctn}_init(${ctn}_state *, object) except -1
+${pfunctions_proto}
 """
 
-# Base template for a Rule proto as a Python Function
-c_pproto = """
-    bint    read_${rule}(${ctn} *_self)
+# Base template for a matcher proto as a Cython Function
+c_pproto = """\
+    int ${ctn}_${name}(${ctn}_state *, Py_ssize_t *)
 """
@@ -1,7 +1,11 @@
+from pyrser.directives.budget import Budget
 from pyrser.directives.ignore import Ignore
 from pyrser.directives.trace import Trace
+from pyrser.directives.profile import Profile
 
 __all__ = [
+    'Budget',
     'Ignore',
+    'Profile',
     'Trace',
 ]
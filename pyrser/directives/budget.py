@@ -0,0 +1,69 @@
+import time
+from pyrser import error, parsing
+
+
+class Budget(parsing.DecoratorWrapper):
+    """Abort a parse exceeding one of its limits
+
+    steps is the number of functors called, deadline the seconds since
+    start, backtrack the number of stream positions saved at once (nested
+    alternatives, repetitions and lookaheads able to rewind) and memo the
+    number of packrat cache entries. None disables a limit.
+
+    An exceeded limit raises the parser Diagnostic, located on the current
+    position and naming the rule being evaluated.
+    """
+    def __init__(self, steps: int=None, deadline: float=None,
+                 backtrack: int=None, memo: int=None):
+        self.max_steps = steps
+        self.deadline = deadline
+        self.max_backtrack = backtrack
+        self.max_memo = memo
+        self.start()
+
+    def start(self):
+        """Reset the counters, a Budget is started by each parse."""
+        self.steps = 0
+        self.rules = []
+        if self.deadline is not None:
+            self.expires = time.perf_counter() + self.deadline
+        else:
+            self.expires = None
+
+    def _exceeded(self, parser: parsing.BasicParser, what: str):
+        if len(self.rules) > 0:
+            rule = self.rules[-1]
+        else:
+            rule = parser._lastRule
+        parser.diagnostic.notify(
+            error.Severity.ERROR,
+            "Parse budget exceeded: %s in '%s'" % (what, rule),
+            error.LocationInfo.from_stream(parser._stream, is_error=True)
+        )
+        raise parser.diagnostic
+
+    def begin(self, parser: parsing.BasicParser, pt: parsing.Functor):
+        self.steps += 1
+        if isinstance(pt, parsing.Rule):
+            self.rules.append(pt.name)
+        if self.max_steps is not None and self.steps > self.max_steps:
+            self._exceeded(parser, "more than %d steps" % self.max_steps)
+        if self.expires is not None and time.perf_counter() > self.expires:
+            self._exceeded(parser, "deadline of %gs" % self.deadline)
+        stream = parser._stream
+        if (self.max_backtrack is not None
+                and len(stream._contexts) > self.max_backtrack):
+            self._exceeded(
+                parser,
+                "more than %d backtrack points" % self.max_backtrack)
+        if (self.max_memo is not None and stream.memo is not None
+                and len(stream.memo) > self.max_memo):
+            self._exceeded(parser,
+                           "more than %d memo entries" % self.max_memo)
+        return True
+
+    def end(self,
+            result: bool, parser: parsing.BasicParser, pt: parsing.Functor):
+        if isinstance(pt, parsing.Rule):
+            self.rules.pop()
+        return True
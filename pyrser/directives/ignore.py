@@ -1,29 +1,23 @@
+import re
+
 from pyrser import meta, parsing
 
 
+_re_cxx = re.compile(r"(?:[ \t\v\f\r\n]+|//[^\n]*\n?|/\*[\s\S]*?\*/)*")
+
+
 @meta.rule(parsing.Parser, "Base.ignore_cxx")
 def ignore_cxx(self) -> bool:
     """Consume comments and whitespace characters."""
-    self._stream.save_context()
-    while not self.read_eof():
-        idxref = self._stream.index
-        if self._stream.peek_char in " \t\v\f\r\n":
-            while (not self.read_eof()
-                    and self._stream.peek_char in " \t\v\f\r\n"):
-                self._stream.incpos()
-        if self.peek_text("//"):
-            while not self.read_eof() and not self.peek_char("\n"):
-                self._stream.incpos()
-            if not self.read_char("\n") and self.read_eof():
-                return self._stream.validate_context()
-        if self.peek_text("/*"):
-            while not self.read_eof() and not self.peek_text("*/"):
-                self._stream.incpos()
-            if not self.read_text("*/") and self.read_eof():
-                return self._stream.restore_context()
-        if idxref == self._stream.index:
-            break
-    return self._stream.validate_context()
+    stream = self._stream
+    end = _re_cxx.match(stream._content, stream.index).end()
+    if stream._content.startswith("/*", end):
+        # unterminated comment, the failed read went thru the whole stream
+        cursor = stream._cursor
+        cursor._maxindex = max(cursor._maxindex, stream.eos_index)
+        return False
+    stream.incpos(end - stream.index)
+    return True
 
 
 @meta.directive("ignore")
@@ -0,0 +1,163 @@
+import json
+import time
+from pyrser import meta, parsing
+
+
+class RuleStats:
+    """Counters of the evaluations of one rule"""
+
+    fields = ('calls', 'successes', 'failures', 'total_time', 'self_time',
+              'consumed', 'backtracks', 'memo_hits', 'memo_misses')
+
+    def __init__(self):
+        for field in self.fields:
+            setattr(self, field, 0)
+
+    @property
+    def memo_ratio(self) -> float:
+        """Part of the memoized evaluations found in the cache"""
+        lookups = self.memo_hits + self.memo_misses
+        if lookups == 0:
+            return 0.0
+        return self.memo_hits / lookups
+
+    def to_dict(self) -> dict:
+        res = {field: getattr(self, field) for field in self.fields}
+        res['memo_ratio'] = self.memo_ratio
+        return res
+
+
+class Report:
+    """Statistics of the rules evaluated by a parser.
+
+    Times are in seconds. The self time of a rule excludes the time
+    spent in the rules it called. consumed is the number of characters
+    read by its successful evaluations, backtracks the number of
+    alternatives and repetitions that failed and rewound the stream
+    directly in the rule.
+    """
+    def __init__(self):
+        self.rules = {}
+
+    def stats(self, name: str) -> RuleStats:
+        if name not in self.rules:
+            self.rules[name] = RuleStats()
+        return self.rules[name]
+
+    def sorted(self, key: str='total_time') -> [(str, RuleStats)]:
+        """Rules by decreasing key, or by name if key is 'name'."""
+        if key == 'name':
+            return sorted(self.rules.items())
+        return sorted(self.rules.items(),
+                      key=lambda item: (-getattr(item[1], key), item[0]))
+
+    def to_json(self, key: str='total_time') -> str:
+        return json.dumps(
+            [dict(rule=name, **stats.to_dict())
+             for name, stats in self.sorted(key)],
+            indent=2
+        )
+
+    def to_text(self, key: str='total_time') -> str:
+        lines = ["%-30s %8s %8s %8s %10s %10s %9s %9s %6s" % (
+            'rule', 'calls', 'success', 'failure', 'total(ms)', 'self(ms)',
+            'consumed', 'backtrack', 'memo%')]
+        for name, s in self.sorted(key):
+            lines.append("%-30s %8d %8d %8d %10.3f %10.3f %9d %9d %6.1f" % (
+                name, s.calls, s.successes, s.failures, s.total_time * 1e3,
+                s.self_time * 1e3, s.consumed, s.backtracks,
+                s.memo_ratio * 100))
+        return '\n'.join(lines) + '\n'
+
+    def __str__(self) -> str:
+        return self.to_text()
+
+
+_rewinding = (parsing.Alt, parsing.Rep0N, parsing.Rep1N, parsing.RepOptional)
+
+
+def _memo_hits(parser: parsing.BasicParser) -> int:
+    memo = parser._stream.memo
+    if memo is None:
+        return 0
+    return memo.hits
+
+
+@meta.decorator("profile")
+class Profile(parsing.DecoratorWrapper):
+    """Collect statistics of the rules evaluated in parser.profile
+
+    Profile calls nested in another are ignored.
+    """
+    def __init__(self):
+        self.active = None
+        # functors being called
+        self.calls = []
+        # evaluations of rules being called:
+        # [name, start time, start index, time in subrules, nested call,
+        #  memo hits at start]
+        self.frames = []
+        # number of frames of each rule, a recursive call is not counted
+        # again in the total time
+        self.depths = {}
+
+    def _is_active(self, parser: parsing.BasicParser) -> bool:
+        if self.active is None:
+            first = next(d for d in parser._decorators
+                         if isinstance(d, Profile))
+            self.active = first is self
+            if self.active and parser.profile is None:
+                parser.profile = Report()
+        return self.active
+
+    def _open(self, parser: parsing.BasicParser, name: str):
+        self.depths[name] = self.depths.get(name, 0) + 1
+        self.frames.append([name, time.perf_counter(), parser._stream.index,
+                            0.0, False, _memo_hits(parser)])
+
+    def begin(self, parser: parsing.BasicParser, pt: parsing.Functor):
+        if not self._is_active(parser):
+            return True
+        if len(self.frames) > 0:
+            self.frames[-1][4] = True
+        self.calls.append(pt)
+        if isinstance(pt, parsing.Rule):
+            self._open(parser, pt.name)
+        elif len(self.calls) == 1:
+            # the rule in which the profile begins
+            self._open(parser, parser._lastRule)
+        return True
+
+    def end(self,
+            result: bool, parser: parsing.BasicParser, pt: parsing.Functor):
+        if not self._is_active(parser):
+            return True
+        self.calls.pop()
+        if isinstance(pt, parsing.Rule) or len(self.calls) == 0:
+            name, start, index, subtime, nested, memo = self.frames.pop()
+            elapsed = time.perf_counter() - start
+            stats = parser.profile.stats(name)
+            stats.calls += 1
+            self.depths[name] -= 1
+            if self.depths[name] == 0:
+                stats.total_time += elapsed
+            stats.self_time += elapsed - subtime
+            if result is not False:
+                stats.successes += 1
+                stats.consumed += max(0, parser._stream.index - index)
+            else:
+                stats.failures += 1
+            if (isinstance(pt, parsing.Rule) and parser.packrat
+                    and parser.memoizable(parser.tables().rules.get(pt.name))):
+                # a cached result is replayed without calling the rule
+                if not nested and _memo_hits(parser) > memo:
+                    stats.memo_hits += 1
+                else:
+                    stats.memo_misses += 1
+            if len(self.frames) > 0:
+                self.frames[-1][3] += elapsed
+        if (result is False and len(self.calls) > 0
+                and isinstance(self.calls[-1], _rewinding)
+                and len(self.frames) > 0):
+            parser.profile.stats(self.frames[-1][0]).backtracks += 1
+        return True
@@ -1,7 +1,10 @@
+import types
+
 from pyrser import parsing
 from pyrser import meta
 from pyrser import error
 from pyrser.directives import ignore
+from pyrser.passes import link
 
 
 class EBNF(parsing.Parser):
@@ -20,6 +23,15 @@ class EBNF(parsing.Parser):
         TODO: could be done in the rules property of parsing.BasicParser???
         """
         res = None
+        # look names up in the flat tables of the DSL, linked again only
+        # when rules or hooks were registered since (see Grammar.link)
+        cls = self.__class__
+        generation = cls.tables().generation
+        links = cls.__dict__.get('_links')
+        if links is None or links.generation != generation:
+            links = link.link(cls, generation)
+            cls._links = links
+        self._links = links
         try:
             res = self.eval_rule('bnf_dsl')
             if not res:
@@ -43,12 +55,15 @@ class EBNF(parsing.Parser):
         print("USE rules PROPERTY")
         return self._rules
 
-    def __init__(self, content='', sname=None):
+    @classmethod
+    def bootstrap(cls) -> bool:
         """
         Define the DSL parser.
+
+        Called once when the module is imported: all instances share the
+        rules, so parsing a grammar doesn't add a map to the chain of rules.
         """
-        super().__init__(content, sname)
-        self.set_rules({
+        cls.set_rules({
             #
             # bnf_dsl = [ @ignore("C/C++") bnf_stmts ]
             # //todo: bnf_dsl = [ @ignore("C/C++") [bnf_stmts] eof ]
@@ -59,7 +74,7 @@ class EBNF(parsing.Parser):
                 parsing.Directive(ignore.Ignore(),
                                   [("C/C++", str)],
                                   lambda parser:
-                                  self.__class__._rules['bnf_stmts'](parser)),
+                                  type(parser)._rules['bnf_stmts'](parser)),
             ),
 
             #
@@ -482,6 +497,13 @@ class EBNF(parsing.Parser):
                 ),
             ),
         })
+        # freeze them in a parent map, the child keeps meta.rule working
+        frozen = types.MappingProxyType(dict(cls._rules.maps[0]))
+        cls._rules = cls._rules.parents.new_child(frozen).new_child()
+        return True
+
+
+EBNF.bootstrap()
 
 # Hooks part
 # ----------
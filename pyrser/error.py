@@ -27,11 +27,8 @@ class LocationInfo:
             tmpf.write(stream._content)
             tmpf.close()
             atexit.register(os.remove, stream._name)
-        loc = LocationInfo(
-            stream._name,
-            stream._cursor.lineno,
-            stream._cursor.col_offset
-        )
+        pos = stream._cursor.position
+        loc = LocationInfo(stream._name, pos.lineno, pos.col_offset)
         return loc
 
     @staticmethod
@@ -42,11 +39,8 @@ class LocationInfo:
             tmpf.write(stream._content)
             tmpf.close()
             atexit.register(os.remove, stream._name)
-        loc = LocationInfo(
-            stream._name,
-            stream._cursor._maxline,
-            stream._cursor._maxcol
-        )
+        pos = stream._cursor.max_readed_position
+        loc = LocationInfo(stream._name, pos.lineno, pos.col_offset)
         return loc
 
     @staticmethod
@@ -1,8 +1,90 @@
+from pyrser import cache
 from pyrser import dsl
 from pyrser import parsing
 from pyrser import meta
 from pyrser import error
-from collections import ChainMap
+from pyrser.directives.budget import Budget
+from pyrser.directives.profile import Profile, Report
+from pyrser.parsing import machine
+from pyrser.passes import link
+from pyrser.passes import to_python
+from pyrser.passes import topython
+from pyrser.passes import to_regex
+from collections import ChainMap, OrderedDict
+import functools
+import os
+import pickle
+
+
+def _rules_key(dsl_parser: type, text: str, sname: str) -> str:
+    """Key of the rules of a grammar text in the cache, or None."""
+    if not isinstance(text, str) or not isinstance(dsl_parser, type):
+        return None
+    # directives are instanciated by names
+    directives = sorted("%s=%s.%s" % (name, d.__module__, d.__qualname__)
+                        for name, d in meta._directives.items())
+    return cache.key('rules', dsl_parser.__module__, dsl_parser.__qualname__,
+                     ','.join(directives), sname or '', text)
+
+
+def dsl_rules(dsl_parser: type, text: str, sname: str=None,
+              use_cache: bool=True) -> dict:
+    """Rules parsed from a grammar text, with fused terminals.
+
+    With use_cache, rules are kept in the on-disk cache (see pyrser.cache)
+    by text, source name, DSL parser and pyrser version, and loaded by
+    later processes instead of parsing the text again.
+    """
+    hkey = None
+    if use_cache:
+        hkey = _rules_key(dsl_parser, text, sname)
+    if hkey is not None:
+        path = cache.lookup('rules', hkey)
+        if path is not None:
+            try:
+                with open(os.path.join(path, 'rules.pickle'), 'rb') as f:
+                    return pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError,
+                    AttributeError, ImportError):
+                # parse the text again
+                pass
+    rules = dsl_parser(text, sname).get_rules()
+    if not rules:
+        return rules
+    for rule_name, rule_pt in rules.items():
+        rules[rule_name] = to_regex.fuse_terminals(rule_pt)
+    if hkey is not None:
+        _store_rules(hkey, rules)
+    return rules
+
+
+def _store_rules(hkey: str, rules: dict):
+    try:
+        data = pickle.dumps(rules, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        # local hooks or directives, rules are parsed at each run
+        return
+    try:
+        tmp = cache.mkdtemp('rules')
+        with open(os.path.join(tmp, 'rules.pickle'), 'wb') as f:
+            f.write(data)
+        cache.publish('rules', hkey, tmp)
+    except OSError:
+        # the cache is not writable
+        pass
+
+
+def _aggregate(chain: ChainMap, bases: tuple, attr: str) -> ChainMap:
+    """Chain the maps of chain then of the attr chain of each base.
+
+    A map shared by several chains is kept at its first place.
+    """
+    maps = {}
+    for chainmap in (chain,) + tuple(getattr(b, attr) for b in bases
+                                     if hasattr(b, attr)):
+        for m in chainmap.maps:
+            maps.setdefault(id(m), m)
+    return type(chain)(*maps.values())
 
 
 class MetaGrammar(parsing.MetaBasicParser):
@@ -28,7 +110,8 @@ class MetaGrammar(parsing.MetaBasicParser):
                 sname = None
                 if 'source' in namespace and namespace['source'] is not None:
                     sname = namespace['source']
-                rules = cls.dsl_parser(namespace['grammar'], sname).get_rules()
+                rules = dsl_rules(cls.dsl_parser, namespace['grammar'],
+                                  sname, cls.cache_rules)
                 if not rules:
                     return rules
                 # namespace rules with module/classe name
@@ -46,36 +129,12 @@ class MetaGrammar(parsing.MetaBasicParser):
                 cls._hooks.update(namespace['_hooks'])
         # Manage Aggregation
         if len(bases) > 1:
-            aggreg_rules = ChainMap()
-            aggreg_hooks = ChainMap()
-            for subgrammar in bases:
-                if hasattr(subgrammar, '_rules'):
-                    aggreg_rules = ChainMap(*(aggreg_rules.maps
-                                            + subgrammar._rules.maps))
-                if hasattr(subgrammar, '_hooks'):
-                    aggreg_hooks = ChainMap(*(aggreg_hooks.maps
-                                            + subgrammar._hooks.maps))
             # aggregate at toplevel the branch grammar
-            cls._rules = ChainMap(*(cls._rules.maps + aggreg_rules.maps))
-            cls._hooks = ChainMap(*(cls._hooks.maps + aggreg_hooks.maps))
-            # clean redondant in chain for rules
-            orderedunique_rules = []
-            tocpy_rules = set([id(_) for _ in cls._rules.maps])
-            for ch in cls._rules.maps:
-                idch = id(ch)
-                if idch in tocpy_rules:
-                    orderedunique_rules.append(ch)
-                    tocpy_rules.remove(idch)
-            cls._rules = ChainMap(*orderedunique_rules)
-            # clean redondant in chain for hooks
-            orderedunique_hooks = []
-            tocpy_hooks = set([id(_) for _ in cls._hooks.maps])
-            for ch in cls._hooks.maps:
-                idch = id(ch)
-                if idch in tocpy_hooks:
-                    orderedunique_hooks.append(ch)
-                    tocpy_hooks.remove(idch)
-            cls._hooks = ChainMap(*orderedunique_hooks)
+            cls._rules = _aggregate(cls._rules, bases, '_rules')
+            cls._hooks = _aggregate(cls._hooks, bases, '_hooks')
+        # flat tables of the rules and hooks, looked up while parsing
+        if issubclass(cls, parsing.BasicParser):
+            cls.tables()
         return cls
 
 
@@ -93,6 +152,53 @@ class Grammar(parsing.Parser, metaclass=MetaGrammar):
     entry = None
     # DSL parsing class
     dsl_parser = dsl.EBNF
+    # Keep the rules parsed from the grammar text in the on-disk cache
+    # (see pyrser.cache, $PYRSER_CACHE or ~/.cache/pyrser)
+    cache_rules = False
+
+    @classmethod
+    def compile(cls) -> bool:
+        """
+        Lower all rules of the grammar into python functions.
+
+        Compiled rules give the same results than interpreted ones but
+        avoid the generic functor dispatch. Interpreted rules are still
+        used while a decorator (like @trace) is active.
+        """
+        cls._compiled = to_python.compile_rules(cls._rules)
+        return True
+
+    @classmethod
+    def write_module(cls, filename: str) -> bool:
+        """
+        Write the grammar as a python module compiled ahead of time.
+
+        Importing the module defines a grammar with the same bases, name,
+        rules, hooks and class attributes, without parsing the grammar
+        text nor lowering rules again (see passes.topython). Hooks and
+        methods must be importable functions: importing them from the
+        module of the grammar runs its class statement, which parses the
+        grammar text there.
+        """
+        topython.write(cls, filename)
+        return True
+
+    @classmethod
+    def link(cls) -> link.Links:
+        """
+        Resolve the rules and hooks called by the grammar.
+
+        Names are looked up once in flat tables instead of thru the
+        inherited chains at each call. Unknown rules and hooks are
+        reported by raising a Diagnostic. The tables are built again
+        when rules or hooks were registered since.
+        """
+        generation = cls.tables().generation
+        links = cls.__dict__.get('_links')
+        if links is None or links.generation != generation:
+            links = link.link(cls, generation)
+            cls._links = links
+        return links
 
     def after_parse(self, node: parsing.Node) -> parsing.Node:
         """
@@ -100,12 +206,56 @@ class Grammar(parsing.Parser, metaclass=MetaGrammar):
         """
         return node
 
-    def _do_parse(self, entry: str) -> parsing.Node:
+    def _do_parse(self, entry: str, profile: bool=False,
+                  budget: Budget=None) -> parsing.Node:
+        if not self._link_parse():
+            return self
+        decorators = []
+        if budget is not None:
+            budget.start()
+            decorators.append(budget)
+        if profile:
+            self.profile = Report()
+            decorators.append(Profile())
+        if len(decorators) == 0:
+            return self._end_parse(self._eval_entry(entry))
+        for decorator in decorators:
+            self.push_decorator(decorator)
+        try:
+            res = self._eval_entry(entry)
+        finally:
+            for decorator in decorators:
+                self.pop_decorator()
+        return self._end_parse(res)
+
+    def _link_parse(self) -> bool:
+        """Link the grammar, unknown names are reported like parse errors"""
+        self.diagnostic = error.Diagnostic()
+        try:
+            self._links = self.link()
+        except error.Diagnostic as d:
+            self.diagnostic = d
+            if self.raise_diagnostic:
+                raise self.diagnostic
+            return False
+        return True
+
+    def _eval_entry(self, entry: str) -> parsing.Node:
         res = None
         self.diagnostic = error.Diagnostic()
+        # drop scopes left by a previous parse aborted by an exception
+        self._frames.clear()
+        ignores = list(self._ignores)
+        contexts = len(self._stream._contexts)
         try:
-            res = self.eval_rule(entry)
+            if self.stackless and not self._decorators:
+                res = machine.run(self, entry)
+            else:
+                res = self.eval_rule(entry)
         except error.Diagnostic as d:
+            # the directives and alternatives aborted didn't pop their state
+            self._ignores[:] = ignores
+            del self._stream._contexts[contexts:]
             # User put an error rule
             d.notify(
                 error.Severity.ERROR,
@@ -116,6 +266,9 @@ class Grammar(parsing.Parser, metaclass=MetaGrammar):
                 )
             )
             self.diagnostic = d
+        return res
+
+    def _end_parse(self, res: parsing.Node) -> parsing.Node:
         if not res:
             # we fail to parse, but error is not set on the last rule
             self.diagnostic.notify(
@@ -137,8 +290,15 @@ class Grammar(parsing.Parser, metaclass=MetaGrammar):
         # all is ok
         return self.after_parse(res)
 
-    def parse(self, source: str=None, entry: str=None) -> parsing.Node:
-        """Parse source using the grammar"""
+    def parse(self, source: str=None, entry: str=None,
+              profile: bool=False, budget: Budget=None) -> parsing.Node:
+        """Parse source using the grammar
+
+        With profile, statistics of the evaluated rules are collected
+        in self.profile (see directives.profile.Report).
+        With budget, the parse fails once one of its limits is exceeded
+        (see directives.budget.Budget).
+        """
         self.from_string = True
         if source is not None:
             self.parsed_stream(source)
@@ -147,9 +307,10 @@ class Grammar(parsing.Parser, metaclass=MetaGrammar):
         if entry is None:
             raise ValueError("No entry rule name defined for {}".format(
                 self.__class__.__name__))
-        return self._do_parse(entry)
+        return self._do_parse(entry, profile, budget)
 
-    def parse_file(self, filename: str, entry: str=None) -> parsing.Node:
+    def parse_file(self, filename: str, entry: str=None,
+                   profile: bool=False, budget: Budget=None) -> parsing.Node:
         """Parse filename using the grammar"""
         self.from_string = False
         import os.path
@@ -162,11 +323,109 @@ class Grammar(parsing.Parser, metaclass=MetaGrammar):
         if entry is None:
             raise ValueError("No entry rule name defined for {}".format(
                 self.__class__.__name__))
-        return self._do_parse(entry)
+        return self._do_parse(entry, profile, budget)
+
+    def parse_many(self, sources: iter, entry: str=None,
+                   budget: Budget=None) -> iter:
+        """Parse each source of sources, yield each result
+
+        The parser, its stacks and its linked tables are reused from a
+        document to the next: only the stream, the caches of tags, the
+        last ignored position and the ignore conventions are reset. A
+        failed document yields the parser, with its diagnostic, when
+        raise_diagnostic is False; the next documents are parsed anyway.
+        """
+        self.from_string = True
+        if entry is None:
+            entry = self.entry
+        if entry is None:
+            raise ValueError("No entry rule name defined for {}".format(
+                self.__class__.__name__))
+        self._streams.append(self._stream)
+        # a document failing in @ignore leaves its convention pushed
+        ignores = list(self._ignores)
+        try:
+            for source in sources:
+                self._streams[-1] = parsing.Stream(source)
+                self._ignores[:] = ignores
+                self.tag_cache.clear()
+                self.id_cache.clear()
+                self._lastIgnoreIndex = 0
+                self._lastIgnore = False
+                yield self._do_parse(entry, False, budget)
+        finally:
+            self._ignores[:] = ignores
+            self.pop_stream()
+
+    def iter_parse_file(self, filename: str, entry: str=None,
+                        chunk_size: int=65536) -> iter:
+        """Parse filename as a sequence of entry, yield each result
+
+        The file is read by chunks and the text of a record is dropped
+        once parsed, so memory depends on the size of the records, not
+        of the file. A record is parsed again on a bigger window when it
+        reads too close to the end of the read chunks: the hooks run by
+        the first parse are run again. The window keeps its size for the
+        next records, so this only happens while it grows to fit the
+        biggest records. A search (->) only looks in the window, failing
+        thru its end doesn't grow it. Iteration stops at end of file, or
+        after yielding the parser if a record fails and raise_diagnostic
+        is False.
+        """
+        self.from_string = False
+        if entry is None:
+            entry = self.entry
+        if entry is None:
+            raise ValueError("No entry rule name defined for {}".format(
+                self.__class__.__name__))
+        if not self._link_parse():
+            yield self
+            return
+        margin = chunk_size // 2
+        # text read ahead of a record before parsing it
+        size = chunk_size
+        with open(filename, 'r') as f:
+            stream = parsing.ChunkedStream(
+                iter(functools.partial(f.read, chunk_size), ""),
+                os.path.abspath(filename)
+            )
+            self._streams.append(stream)
+            try:
+                while True:
+                    if stream.index >= chunk_size:
+                        stream.discard()
+                    # tags of previous records point to dropped text
+                    self.tag_cache.clear()
+                    self.id_cache.clear()
+                    if not stream.fill(stream.index + 1):
+                        return
+                    start = stream.index
+                    while True:
+                        stream.fill(start + size)
+                        stream._cursor._maxindex = start
+                        res = self._eval_entry(entry)
+                        if not stream.truncates(margin):
+                            break
+                        # parse the record again on a bigger window
+                        stream._cursor._index = start
+                        size *= 2
+                    res = self._end_parse(res)
+                    yield res
+                    if res is self:
+                        return
+            finally:
+                self._streams.pop()
 
 
 generated_class = 0
 
+#: Maximum number of grammars kept by from_string and from_file
+generated_size = 128
+
+#: Grammars built by from_string and from_file, by (text, entry, source,
+#: bases), in LRU order
+_generated = OrderedDict()
+
 
 def build_grammar(inherit: tuple, scope: dict) -> Grammar:
     global generated_class
@@ -175,13 +434,37 @@ def build_grammar(inherit: tuple, scope: dict) -> Grammar:
     return type(class_name, inherit, scope)
 
 
+def cached_grammar(inherit: tuple, scope: dict) -> Grammar:
+    """
+    Build a grammar like build_grammar, once for the same scope and bases
+
+    The generated_size grammars used last are kept, the others are
+    released from the registry of parsers.
+    """
+    key = (scope['grammar'], scope['entry'], scope.get('source'), inherit)
+    cls = _generated.get(key)
+    if cls is not None:
+        _generated.move_to_end(key)
+        return cls
+    cls = build_grammar(inherit, scope)
+    if not isinstance(cls, type):
+        return cls
+    _generated[key] = cls
+    while len(_generated) > generated_size:
+        _, old = _generated.popitem(last=False)
+        registry = parsing.base._MetaBasicParser
+        if registry.get(old.__name__) is old:
+            del registry[old.__name__]
+    return cls
+
+
 def from_string(bnf: str, entry=None, *optional_inherit) -> Grammar:
     """
     Create a Grammar from a string
     """
     inherit = [Grammar] + list(optional_inherit)
     scope = {'grammar': bnf, 'entry': entry}
-    return build_grammar(tuple(inherit), scope)
+    return cached_grammar(tuple(inherit), scope)
 
 
 def from_file(fn: str, entry=None, *optional_inherit) -> Grammar:
@@ -195,5 +478,5 @@ def from_file(fn: str, entry=None, *optional_inherit) -> Grammar:
         f.close()
         inherit = [Grammar] + list(optional_inherit)
         scope = {'grammar': bnf, 'entry': entry, 'source': fn}
-        return build_grammar(tuple(inherit), scope)
+        return cached_grammar(tuple(inherit), scope)
     raise Exception("File not Found!")
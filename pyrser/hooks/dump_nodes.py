@@ -5,7 +5,7 @@ from pyrser.parsing.base import BasicParser
 @meta.hook(BasicParser, "dump_nodes")
 def dump_nodes(self):
     """
-    Dump tag,rule,id and value cache. For debug.
+    Dump tag,rule and id caches. For debug.
 
     example::
 
@@ -28,9 +28,6 @@ def dump_nodes(self):
             if k in self.tag_cache:
                 tag = self.tag_cache[k]
                 txt += " tag <%s>" % tag
-                k = "%d:%d" % (tag._begin, tag._end)
-                if k in self._stream.value_cache:
-                    txt += " cache <%s>" % self._stream.value_cache[k]
             print(txt)
     except Exception as err:
         print("RECV Exception %s" % err)
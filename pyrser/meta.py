@@ -100,6 +100,57 @@ def checktypes(func):
     return wrapper
 
 
+class Registry(dict):
+    """Map of registered names, counting the registrations done in it."""
+    count = 0
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.count += 1
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.count += 1
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, value=None):
+        if key not in self:
+            self[key] = value
+        return self[key]
+
+    def pop(self, *args):
+        self.count += 1
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self.count += 1
+        return dict.popitem(self)
+
+    def clear(self):
+        self.count += 1
+        dict.clear(self)
+
+
+class Registries(collections.ChainMap):
+    """ChainMap of the registries of a parser class and of its parents."""
+
+    def new_child(self, m=None):
+        if m is None:
+            m = Registry()
+        return super().new_child(m)
+
+
+def generation(*chains) -> int:
+    """Number of registrations done in the maps of chains, to know when
+    tables built from them are outdated.
+    """
+    return sum(getattr(m, 'count', 0) for chain in chains
+               for m in chain.maps)
+
+
 # TODO: could be better in a tool module?
 #: Addtototo
 def set_one(chainmap, thing_name, callobject):
@@ -217,5 +268,6 @@ def decorator(directname=None):
             directname = f.__name__
         f.ns_name = directname
         set_one(class_deco_list, directname, f)
+        return f
 
     return wrapper
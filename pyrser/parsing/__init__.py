@@ -10,10 +10,12 @@ from pyrser.parsing.functors import Directive2
 from pyrser.parsing.functors import Decorator, DecoratorWrapper
 from pyrser.parsing.functors import Alt, Seq
 from pyrser.parsing.functors import Rep0N, Rep1N, RepOptional
+from pyrser.parsing.functors import Regex, Native
 from pyrser.parsing.functors import Capture, Scope, Bind, DeclNode
 from pyrser.parsing.functors import Error
 from pyrser.parsing.base import BasicParser, Parser, MetaBasicParser
-from pyrser.parsing.stream import Stream
+from pyrser.parsing.stream import Stream, ChunkedStream
+from pyrser.parsing.sampler import Sampler
 from pyrser.parsing import ir
 
 
@@ -24,6 +26,7 @@ __all__ = [
     'Call',
     'CallTrue',
     'Capture',
+    'ChunkedStream',
     'Char',
     'Complement',
     'DeclNode',
@@ -37,16 +40,19 @@ __all__ = [
     'Hook',
     'LookAhead',
     'MetaBasicParser',
+    'Native',
     'Neg',
     'Node',
     'Parser',
     'PeekChar',
     'PeekText',
     'Range',
+    'Regex',
     'Rule',
     'Rep0N',
     'Rep1N',
     'RepOptional',
+    'Sampler',
     'Scope',
     'Seq',
     'SkipIgnore',
@@ -1,16 +1,37 @@
 import collections
+import copy
 import os
+import re
+import types
 
 from pyrser import meta
 from pyrser import error
 from pyrser.parsing.stream import Stream
 from pyrser.parsing.stream import Tag
 from pyrser.parsing.node import Node
+from pyrser.parsing.memo import Memo
+from pyrser.parsing.frames import Frames, FrameMap
 
 # TODO: ensure unicity of names
 #: Module variable to store meta class instance by classname
 _MetaBasicParser = {}
 
+#: Module variable to store parsers with active decorators, each parser
+#: stores its own in _decorators (see functors.Decorator)
+_decorated = set()
+
+#: Flat read-only tables of the rules and hooks of a parser class, built
+#: at their meta.generation (see BasicParser.tables). cache holds what is
+#: derived from the tables, like the dispatch tables of alternatives.
+Tables = collections.namedtuple('Tables', 'rules hooks generation cache')
+
+_re_blanks = re.compile(r"[ \t\v\f\r\n]*")
+# ascii runs, other chars are read with str.isdigit and str.isalpha
+_re_integer = re.compile(r"[0-9]+")
+_re_identifier = re.compile(r"[A-Za-z_][0-9A-Za-z_]*")
+#: Module variable to store read_until patterns by (char, inhibitor)
+_re_until = {}
+
 
 class MetaBasicParser(type):
     """Metaclass for all parser."""
@@ -54,8 +75,19 @@ class BasicParser(metaclass=MetaBasicParser):
 
     """
 
-    _rules = collections.ChainMap()
-    _hooks = collections.ChainMap()
+    _rules = meta.Registries()
+    _hooks = meta.Registries()
+    #: Memoize rule results by stream position (packrat parsing)
+    packrat = False
+    #: Maximum number of memoized results kept per stream
+    packrat_size = 4096
+    #: Memoize rules running hooks too, their hooks are not run again
+    #: when their result is replayed (see memoizable)
+    packrat_hooks = False
+    #: Rules lowered into python functions (see grammar.Grammar.compile)
+    _compiled = None
+    #: Evaluate parses without recursion (see parsing.machine)
+    stackless = False
 
     def __init__(
             self,
@@ -65,8 +97,13 @@ class BasicParser(metaclass=MetaBasicParser):
     ):
         self._ignores = [BasicParser.ignore_blanks]
         self._streams = [Stream(content, stream_name)]
-        self.rule_nodes = None
-        self.push_rule_nodes()
+        self._frames = Frames()
+        self.rule_nodes = FrameMap(self._frames)
+        self.tag_cache = FrameMap(self._frames)
+        self.id_cache = FrameMap(self._frames)
+        self._links = None
+        self._decorators = []
+        self.profile = None
         self._lastIgnoreIndex = 0
         self._lastIgnore = False
         self._lastRule = ""
@@ -93,21 +130,12 @@ class BasicParser(metaclass=MetaBasicParser):
 
     def push_rule_nodes(self) -> bool:
         """Push context variable to store rule nodes."""
-        if self.rule_nodes is None:
-            self.rule_nodes = collections.ChainMap()
-            self.tag_cache = collections.ChainMap()
-            self.id_cache = collections.ChainMap()
-        else:
-            self.rule_nodes = self.rule_nodes.new_child()
-            self.tag_cache = self.tag_cache.new_child()
-            self.id_cache = self.id_cache.new_child()
+        self._frames.push()
         return True
 
     def pop_rule_nodes(self) -> bool:
         """Pop context variable that store rule nodes"""
-        self.rule_nodes = self.rule_nodes.parents
-        self.tag_cache = self.tag_cache.parents
-        self.id_cache = self.id_cache.parents
+        self._frames.pop()
         return True
 
     def value(self, n: Node) -> str:
@@ -120,12 +148,7 @@ class BasicParser(metaclass=MetaBasicParser):
         tag_cache = self.tag_cache
         if name not in tag_cache:
             raise Exception("Incoherent tag cache")
-        tag = tag_cache[name]
-        k = "%d:%d" % (tag._begin, tag._end)
-        valcache = self._streams[-1].value_cache
-        if k not in valcache:
-            valcache[k] = str(tag)
-        return valcache[k]
+        return str(tag_cache[name])
 
 ### STREAM
 
@@ -136,10 +159,9 @@ class BasicParser(metaclass=MetaBasicParser):
         """
         self._streams.append(Stream(content, name))
 
-    def pop_stream(self):
+    def pop_stream(self) -> Stream:
         """Pop the last Stream pushed on to the parser stack."""
-        s = self._streams.pop()
-        self.clean_tmp(s)
+        return self._streams.pop()
 
 ### VARIABLE PRIMITIVES
 
@@ -163,6 +185,41 @@ class BasicParser(metaclass=MetaBasicParser):
 
 ####
 
+    @classmethod
+    def tables(cls) -> Tables:
+        """
+        Return the rules and hooks of the class in flat read-only tables
+
+        A name is found in the table as thru the chains of rules and
+        hooks, overloads included. The tables are built again when rules
+        or hooks were registered since.
+        """
+        tables = cls.__dict__.get('_tables')
+        generation = meta.generation(cls._rules, cls._hooks)
+        if tables is None or tables.generation != generation:
+            tables = Tables(types.MappingProxyType(dict(cls._rules)),
+                            types.MappingProxyType(dict(cls._hooks)),
+                            generation, {})
+            cls._tables = tables
+        return tables
+
+    def memoizable(self, rule) -> bool:
+        """
+        Return True if results of rule can be replayed from the packrat
+        cache, ie. its evaluation runs no hook and binds no node outside
+        of its own (see passes.link.effects), or packrat_hooks is set.
+        """
+        if self.packrat_hooks:
+            return True
+        tables = self._links
+        if tables is None:
+            tables = self.tables()
+        cache = tables.cache
+        if 'effects' not in cache:
+            from pyrser.passes import link
+            cache['effects'] = link.effects(tables.rules)
+        return rule not in cache['effects']
+
     @classmethod
     def set_rules(cls, rules: dict) -> bool:
         """
@@ -207,8 +264,12 @@ class BasicParser(metaclass=MetaBasicParser):
         """Evaluate a rule by name."""
         # context created by caller
         self.rule_nodes['_'] = Node()
+        if self._links is not None:
+            rules = self._links.rules
+        else:
+            rules = self.tables().rules
         # TODO: other behavior for  empty rules?
-        if name not in self.__class__._rules:
+        if name not in rules:
             self.diagnostic.notify(
                 error.Severity.ERROR,
                 "Unknown rule : %s" % name,
@@ -216,16 +277,56 @@ class BasicParser(metaclass=MetaBasicParser):
             )
             raise self.diagnostic
         self._lastRule = name
-        rule_to_eval = self.__class__._rules[name]
-        # TODO: add packrat cache here, same rule - same pos == same res
+        rule_to_eval = rules[name]
+        memo = self.packrat and self.memoizable(rule_to_eval)
+        if self._compiled is not None and not self._decorators:
+            rule_to_eval = self._compiled.get(rule_to_eval, rule_to_eval)
+        if memo:
+            return self._eval_memo_rule(rule_to_eval)
         res = rule_to_eval(self)
         if res:
             res = self.rule_nodes['_']
         return res
 
+    def _eval_memo_rule(self, rule_to_eval) -> Node:
+        """Evaluate a rule thru the packrat cache of the current stream.
+
+        Same rule at same position with the same ignore convention gives
+        the same result, so we replay the result node and the stream
+        state left by the first evaluation. The hooks of the callers can
+        change the node they get, so the cache keeps its own copy and
+        each replay gets a new one.
+        """
+        stream = self._stream
+        memo = stream.memo
+        if memo is None:
+            memo = stream.memo = Memo(self.packrat_size)
+        ignore = self._ignores[-1] if len(self._ignores) > 0 else None
+        key = (rule_to_eval, stream.index, ignore)
+        entry = memo.get(key)
+        if entry is not None:
+            (res, index, self._lastIgnoreIndex, self._lastIgnore,
+             self._lastRule) = entry
+            stream._cursor.index = index
+            if res:
+                res = copy.copy(res)
+                self.rule_nodes['_'] = res
+            return res
+        res = rule_to_eval(self)
+        if res:
+            res = self.rule_nodes['_']
+        memo.set(key, (res and copy.copy(res), stream._cursor.index,
+                       self._lastIgnoreIndex, self._lastIgnore,
+                       self._lastRule))
+        return res
+
     def eval_hook(self, name: str, ctx: list) -> Node:
         """Evaluate the hook by its name"""
-        if name not in self.__class__._hooks:
+        if self._links is not None:
+            hooks = self._links.hooks
+        else:
+            hooks = self.tables().hooks
+        if name not in hooks:
             # TODO: don't always throw error, could have return True by default
             self.diagnostic.notify(
                 error.Severity.ERROR,
@@ -234,7 +335,7 @@ class BasicParser(metaclass=MetaBasicParser):
             )
             raise self.diagnostic
         self._lastRule = '#' + name
-        return self.__class__._hooks[name](self, *ctx)
+        return hooks[name](self, *ctx)
 
 ### PARSING PRIMITIVES
 
@@ -271,17 +372,28 @@ class BasicParser(metaclass=MetaBasicParser):
         """
         if self.read_eof():
             return False
-        self._stream.save_context()
-        while not self.read_eof():
-            if self._stream.peek_char == inhibitor:
+        key = (c, inhibitor)
+        if key not in _re_until:
+            _re_until[key] = re.compile("[%s]" % re.escape(c + inhibitor))
+        search = _re_until[key].search
+        content = self._stream._content
+        eos = self._stream.eos_index
+        idx = self._stream.index
+        while True:
+            m = search(content, idx)
+            if m is None:
+                break
+            idx = m.start()
+            if content[idx] == inhibitor:
                 # Delete inhibitor and inhibited character
-                self._stream.incpos()
-                self._stream.incpos()
-            if self._stream.peek_char == c:
-                self._stream.incpos()
-                return self._stream.validate_context()
-            self._stream.incpos()
-        return self._stream.restore_context()
+                idx += 2
+                if idx >= eos:
+                    break
+            if content[idx] == c:
+                self._stream.incpos(idx + 1 - self._stream.index)
+                return True
+            idx += 1
+        return self._stream.search_failed(self._stream._cursor._maxindex)
 
     def read_until_eof(self) -> bool:
         """Consume all the stream. Same as EOF in BNF."""
@@ -315,8 +427,7 @@ class BasicParser(metaclass=MetaBasicParser):
         """
         if self.read_eof():
             return False
-        c = self._stream.peek_char
-        if begin <= c <= end:
+        if begin <= self._stream.peek_char <= end:
             self._stream.incpos()
             return True
         return False
@@ -331,13 +442,10 @@ class BasicParser(metaclass=MetaBasicParser):
 
     def ignore_blanks(self) -> bool:
         """Consume whitespace characters."""
-        self._stream.save_context()
-        if not self.read_eof() and self._stream.peek_char in " \t\v\f\r\n":
-            while (not self.read_eof()
-                   and self._stream.peek_char in " \t\v\f\r\n"):
-                self._stream.incpos()
-            return self._stream.validate_context()
-        return self._stream.validate_context()
+        stream = self._stream
+        end = _re_blanks.match(stream._content, stream.index).end()
+        stream.incpos(end - stream.index)
+        return True
 
     def push_ignore(self, ignoreConvention) -> bool:
         """Set the ignore convention"""
@@ -349,6 +457,19 @@ class BasicParser(metaclass=MetaBasicParser):
         self._ignores.pop()
         return True
 
+    def push_decorator(self, decorator) -> bool:
+        """Call the decorator around each functor called by the parser"""
+        self._decorators.append(decorator)
+        _decorated.add(self)
+        return True
+
+    def pop_decorator(self) -> bool:
+        """Remove the last decorator"""
+        self._decorators.pop()
+        if not self._decorators:
+            _decorated.discard(self)
+        return True
+
     def skip_ignore(self) -> bool:
         if len(self._ignores) > 0:
             self._ignores[-1](self)
@@ -365,6 +486,22 @@ class BasicParser(metaclass=MetaBasicParser):
         return True
 
 
+#: Module variable to store ignore conventions as regex (see functors.Regex)
+ignore_regex = {
+    None: "",
+    BasicParser.ignore_null: "",
+    BasicParser.ignore_blanks: _re_blanks.pattern,
+}
+
+#: Module variable to store ignore conventions known by native matchers
+#: (see functors.Native)
+ignore_native = {
+    None: 0,
+    BasicParser.ignore_null: 0,
+    BasicParser.ignore_blanks: 1,
+}
+
+
 class Parser(BasicParser):
     """An ascii parsing primitive library."""
     pass
@@ -386,12 +523,10 @@ def bind(self, dst: str, src: Node) -> bool:
 
     """
 
-    for m in self.rule_nodes.maps:
-        for k, v in m.items():
-            if k == dst:
-                m[k] = src
-                return True
-    raise Exception('%s not found' % dst)
+    if dst not in self.rule_nodes:
+        raise Exception('%s not found' % dst)
+    self.rule_nodes.rebind(dst, src)
+    return True
 
 
 @meta.rule(BasicParser, "Base.read_char")
@@ -432,19 +567,21 @@ def read_integer(self) -> bool:
         ]
 
     """
-    if self.read_eof():
+    stream = self._stream
+    content = stream._content
+    index = stream.index
+    eos = stream.eos_index
+    m = _re_integer.match(content, index)
+    if m is not None and (m.end() == eos or content[m.end()] < '\x80'):
+        end = m.end()
+    elif index < eos and content[index].isdigit():
+        end = index + 1
+        while end < eos and content[end].isdigit():
+            end += 1
+    else:
         return False
-    self._stream.save_context()
-    c = self._stream.peek_char
-    if c.isdigit():
-            self._stream.incpos()
-            while not self.read_eof():
-                c = self._stream.peek_char
-                if not c.isdigit():
-                    break
-                self._stream.incpos()
-            return self._stream.validate_context()
-    return self._stream.restore_context()
+    stream.incpos(end - index)
+    return True
 
 
 # `Base.id`
@@ -458,19 +595,22 @@ def read_identifier(self) -> bool:
         ]
 
     """
-    if self.read_eof():
+    stream = self._stream
+    content = stream._content
+    index = stream.index
+    eos = stream.eos_index
+    m = _re_identifier.match(content, index)
+    if m is not None and (m.end() == eos or content[m.end()] < '\x80'):
+        end = m.end()
+    elif index < eos and (content[index].isalpha() or content[index] == '_'):
+        end = index + 1
+        while end < eos and (content[end].isalpha() or content[end].isdigit()
+                             or content[end] == '_'):
+            end += 1
+    else:
         return False
-    self._stream.save_context()
-    c = self._stream.peek_char
-    if c.isalpha() or c == '_':
-            self._stream.incpos()
-            while not self.read_eof():
-                c = self._stream.peek_char
-                if not (c.isalpha() or c.isdigit() or c == '_'):
-                    break
-                self._stream.incpos()
-            return self._stream.validate_context()
-    return self._stream.restore_context()
+    stream.incpos(end - index)
+    return True
 
 
 @meta.rule(Parser, "Base.string")
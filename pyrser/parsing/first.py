@@ -0,0 +1,274 @@
+import collections
+import string
+
+from pyrser import meta
+from pyrser.parsing import base
+from pyrser.parsing import functors
+
+"""What a functor does at a char it can't start with.
+
+chars is the set of ASCII chars the functor could start with, including
+chars skipped by the ignore convention before reading anything.
+At any other char, the functor doesn't read anything: it succeeds if
+nullable, else it fails.
+skips is the number of ignore convention calls done there (2 for more),
+rule the last rule entered there (or None).
+"""
+First = collections.namedtuple('First', 'chars nullable skips rule')
+
+BLANKS = frozenset(" \t\v\f\r\n")
+ASCII = tuple(chr(c) for c in range(128))
+
+#: First of rules written in python
+_primitives = {
+    base.read_eof: First(frozenset(), False, 0, None),
+    base.read_eol: First(frozenset("\r\n"), False, 0, None),
+    base.read_integer: First(frozenset(string.digits), False, 0, None),
+    base.read_identifier: First(
+        frozenset(string.ascii_letters + "_"), False, 0, None),
+    base.read_cstring: First(frozenset('"'), False, 0, None),
+    base.read_cchar: First(frozenset("'"), False, 0, None),
+    base.scope_nodes: First(frozenset(), True, 0, None),
+}
+
+
+def ignored_chars(ignore) -> frozenset:
+    """ASCII chars skipped by an ignore convention, None if unknown."""
+    if ignore is None or ignore is base.BasicParser.ignore_null:
+        return frozenset()
+    if ignore is base.BasicParser.ignore_blanks:
+        return BLANKS
+    if ignore is getattr(base.Parser, 'ignore_cxx', None):
+        return BLANKS | frozenset("/")
+    return None
+
+
+class Analysis:
+    """Compute First of functors for a parser class."""
+    def __init__(self, cls: type, ignored: frozenset):
+        self.table = cls.tables().rules
+        self.ignored = ignored
+        self.rules = {}
+        self.visiting = set()
+
+    def rule(self, name: str) -> First:
+        key = (name, self.ignored)
+        if key not in self.rules:
+            if key in self.visiting or name not in self.table:
+                # left recursion, or error raised by eval_rule
+                return None
+            self.visiting.add(key)
+            pt = self.table[name]
+            if isinstance(pt, functors.Functor):
+                res = pt.first(self)
+            else:
+                res = _primitives.get(pt)
+            self.visiting.discard(key)
+            if res is not None:
+                res = res._replace(rule=res.rule or name)
+            self.rules[key] = res
+        return self.rules[key]
+
+
+class Skipped(functors.Functor):
+    """Stand for an alternative that can't match at the current char.
+
+    Leave the parser like the failed alternative would have.
+    """
+    def __init__(self, skips: int, rule: str):
+        functors.Functor.__init__(self)
+        self.skips = skips
+        self.rule = rule
+
+    def do_call(self, parser: base.BasicParser) -> bool:
+        if self.skips > 0:
+            index = parser._stream.index
+            parser._lastIgnore = (self.skips == 1
+                                  and index != parser._lastIgnoreIndex)
+            parser._lastIgnoreIndex = index
+        if self.rule is not None:
+            parser._lastRule = self.rule
+        return False
+
+
+def _chars(chars: str) -> frozenset:
+    return frozenset(c for c in chars if c < '\x80')
+
+
+def _then(first: First, nxt: First) -> First:
+    """Effects of first followed by nxt at a char they can't start with."""
+    return First(first.chars | nxt.chars, nxt.nullable,
+                 min(2, first.skips + nxt.skips), nxt.rule or first.rule)
+
+
+@meta.add_method(functors.Functor)
+def first(self, ctx: Analysis) -> First:
+    """First of the functor, None if unknown."""
+    return None
+
+
+@meta.add_method(functors.SkipIgnore)
+def first(self, ctx: Analysis) -> First:
+    return First(ctx.ignored, True, 1, None)
+
+
+@meta.add_method(functors.Char)
+def first(self, ctx: Analysis) -> First:
+    return First(_chars(self.char), False, 0, None)
+
+
+@meta.add_method(functors.PeekChar)
+def first(self, ctx: Analysis) -> First:
+    return First(_chars(self.char), False, 0, None)
+
+
+@meta.add_method(functors.Text)
+def first(self, ctx: Analysis) -> First:
+    return First(_chars(self.text[:1]), self.text == "", 0, None)
+
+
+@meta.add_method(functors.PeekText)
+def first(self, ctx: Analysis) -> First:
+    return First(_chars(self.char[:1]), self.char == "", 0, None)
+
+
+@meta.add_method(functors.Range)
+def first(self, ctx: Analysis) -> First:
+    if len(self.begin) != 1 or len(self.end) != 1:
+        return None
+    chars = (c for c in ASCII if self.begin <= c <= self.end)
+    return First(frozenset(chars), False, 0, None)
+
+
+@meta.add_method(functors.Seq)
+def first(self, ctx: Analysis) -> First:
+    res = First(frozenset(), True, 0, None)
+    for pt in self.ptlist:
+        f = pt.first(ctx)
+        if f is None:
+            return None
+        res = _then(res, f)
+        if not res.nullable:
+            break
+    return res
+
+
+@meta.add_method(functors.Alt)
+def first(self, ctx: Analysis) -> First:
+    # all alternatives are tried until a nullable one
+    res = First(frozenset(), False, 0, None)
+    chars = frozenset()
+    for pt in self.ptlist:
+        f = pt.first(ctx)
+        if f is None:
+            return None
+        chars |= f.chars
+        if not res.nullable:
+            res = _then(res, f)
+    return res._replace(chars=chars)
+
+
+@meta.add_method(functors.RepOptional)
+def first(self, ctx: Analysis) -> First:
+    f = self.pt.first(ctx)
+    return f and f._replace(nullable=True)
+
+
+@meta.add_method(functors.Rep0N)
+def first(self, ctx: Analysis) -> First:
+    f = self.pt.first(ctx)
+    return f and f._replace(nullable=True)
+
+
+@meta.add_method(functors.Rep1N)
+def first(self, ctx: Analysis) -> First:
+    return self.pt.first(ctx)
+
+
+@meta.add_method(functors.Regex)
+def first(self, ctx: Analysis) -> First:
+    return self.pt.first(ctx)
+
+
+@meta.add_method(functors.Native)
+def first(self, ctx: Analysis) -> First:
+    return self.pt.first(ctx)
+
+
+@meta.add_method(functors.Capture)
+def first(self, ctx: Analysis) -> First:
+    return self.pt.first(ctx)
+
+
+@meta.add_method(functors.Bind)
+def first(self, ctx: Analysis) -> First:
+    f = self.pt.first(ctx)
+    # binding an empty match could change nodes outside of the alternative
+    if f is None or f.nullable:
+        return None
+    return f
+
+
+@meta.add_method(functors.DeclNode)
+def first(self, ctx: Analysis) -> First:
+    return First(frozenset(), True, 0, None)
+
+
+@meta.add_method(functors.Rule)
+def first(self, ctx: Analysis) -> First:
+    return ctx.rule(self.name)
+
+
+@meta.add_method(functors.Directive)
+def first(self, ctx: Analysis) -> First:
+    from pyrser.directives import ignore
+    if not isinstance(self.directive, ignore.Ignore) or len(self.param) != 1:
+        return None
+    ignored = {
+        "null": frozenset(),
+        "blanks": BLANKS,
+        "C/C++": BLANKS | frozenset("/"),
+    }.get(self.param[0][0])
+    if ignored is None:
+        return None
+    outer = ctx.ignored
+    ctx.ignored = ignored
+    try:
+        return self.pt.first(ctx)
+    finally:
+        ctx.ignored = outer
+
+
+def dispatch_table(alt: functors.Alt, cls: type, ignore) -> dict:
+    """Alternatives of alt to try by current char, None if all are always
+    tried (see functors.Alt.dispatch).
+
+    Each value is a tuple of alternative indexes and Skipped functors,
+    or None to try all alternatives for this char.
+    """
+    ignored = ignored_chars(ignore)
+    if ignored is None:
+        return None
+    ctx = Analysis(cls, ignored)
+    firsts = [pt.first(ctx) for pt in alt.ptlist]
+    table = {}
+    for c in ASCII:
+        steps = []
+        skipped = None
+        for i, f in enumerate(firsts):
+            if f is None or f.nullable or c in f.chars:
+                if skipped is not None and (skipped.skips or skipped.rule):
+                    steps.append(Skipped(skipped.skips, skipped.rule))
+                skipped = None
+                steps.append(i)
+            elif skipped is None:
+                skipped = f
+            else:
+                skipped = _then(skipped, f)
+        if skipped is not None and (skipped.skips or skipped.rule):
+            steps.append(Skipped(skipped.skips, skipped.rule))
+        if steps != list(range(len(firsts))):
+            table[c] = tuple(steps)
+    if len(table) == 0:
+        return None
+    return table
@@ -0,0 +1,105 @@
+import collections.abc
+
+
+class Frames:
+    """A stack of scopes shared by some FrameMap.
+
+    Bindings are made in place and recorded on a trail, so push is O(1)
+    and pop only undoes the bindings of the popped scope.
+    """
+    def __init__(self):
+        self.level = 0
+        self._marks = []
+        self._trail = []
+
+    def push(self):
+        """Open a new scope in all maps."""
+        self._marks.append(len(self._trail))
+        self.level += 1
+
+    def pop(self):
+        """Close the last scope, undoing its bindings in all maps."""
+        mark = self._marks.pop()
+        self.level -= 1
+        trail = self._trail
+        while len(trail) > mark:
+            fmap, key, value, level = trail.pop()
+            fmap._restore(key, value, level)
+
+    def clear(self):
+        """Drop all scopes and bindings, keeping the allocated stacks."""
+        while len(self._marks) > 0:
+            self.pop()
+        self.level = 0
+
+
+_unbound = object()
+
+
+class FrameMap(collections.abc.MutableMapping):
+    """A mapping with lexical scoping thru a shared Frames.
+
+    Behave like a ChainMap where the innermost scope is the last pushed
+    one, but lookups don't depend of the number of scopes.
+    """
+    def __init__(self, frames: Frames):
+        self._frames = frames
+        self._values = {}
+        self._levels = {}
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self._values
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __repr__(self) -> str:
+        return "FrameMap(%r)" % self._values
+
+    def __setitem__(self, key, value):
+        level = self._levels.get(key)
+        current = self._frames.level
+        if level != current:
+            # shadow the outer binding until the end of the scope
+            self._frames._trail.append(
+                (self, key, self._values.get(key, _unbound), level))
+            self._levels[key] = current
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        """Remove key from the innermost scope, like ChainMap."""
+        if self._levels.get(key) != self._frames.level:
+            raise KeyError(key)
+        trail = self._frames._trail
+        for i in range(len(trail) - 1, -1, -1):
+            fmap, k, value, level = trail[i]
+            if fmap is self and k == key:
+                del trail[i]
+                self._restore(key, value, level)
+                return
+
+    def _restore(self, key, value, level):
+        if value is _unbound:
+            del self._values[key]
+            del self._levels[key]
+        else:
+            self._values[key] = value
+            self._levels[key] = level
+
+    def rebind(self, key, value):
+        """Change the value of key in the scope where it is bound."""
+        if key not in self._values:
+            raise KeyError(key)
+        self._values[key] = value
+
+    def clear(self):
+        """Remove all keys of the innermost scope, like ChainMap."""
+        current = self._frames.level
+        for key in [k for k, l in self._levels.items() if l == current]:
+            del self[key]
@@ -1,14 +1,14 @@
+import functools
 import inspect
+import re
 import types
 from pyrser import meta, error
-from pyrser.parsing.base import BasicParser
+from pyrser.parsing.base import BasicParser, _decorated, ignore_regex
+from pyrser.parsing.base import ignore_native
 from pyrser.parsing.node import Node
 from pyrser.parsing.stream import Tag
 
 
-_decorators = []
-
-
 class Functor:
     """ Dummy Base class for all parse tree classes.
 
@@ -21,15 +21,20 @@ class Functor:
         pass
 
     def __call__(self, parser: BasicParser) -> Node:
-        global _decorators
+        if _decorated and parser in _decorated:
+            return self.decorated_call(parser)
+        return self.do_call(parser)
+
+    def decorated_call(self, parser: BasicParser) -> Node:
+        decorators = parser._decorators
         # call the begin methods in order
-        for i in range(0, len(_decorators)):
-            _decorators[i].begin(parser, self)
+        for i in range(0, len(decorators)):
+            decorators[i].begin(parser, self)
         # forward the call to the functor
         res = self.do_call(parser)
         # call the end methods in reverse order
-        for i in range(len(_decorators) - 1, -1, -1):
-            _decorators[i].end(res, parser, self)
+        for i in range(len(decorators) - 1, -1, -1):
+            decorators[i].end(res, parser, self)
         return res
 
 
@@ -262,6 +267,7 @@ class Until(Functor):
                 self.pt.ptlist.pop()
 
     def do_call(self, parser: BasicParser) -> bool:
+        maxindex = parser._stream._cursor._maxindex
         parser._stream.save_context()
         while not parser.read_eof():
             res = self.pt(parser)
@@ -270,7 +276,7 @@ class Until(Functor):
             parser._stream.incpos()
         parser._stream.restore_context()
         parser.undo_last_ignore()
-        return False
+        return parser._stream.search_failed(maxindex)
 
 
 class Call(Functor):
@@ -365,11 +371,44 @@ class Alt(Functor):
     def __init__(self, *ptlist: Seq):
         Functor.__init__(self)
         self.ptlist = ptlist
+        self._dispatch = all(isinstance(pt, Functor) for pt in ptlist)
 
     def __getitem__(self, idx) -> Functor:
         return self.ptlist[idx]
 
+    def dispatch(self, parser: BasicParser) -> tuple:
+        """Alternatives to try at the current char, None for all of them.
+
+        See first.dispatch_table.
+        """
+        if not self._dispatch or parser._decorators:
+            return None
+        ignore = None
+        if len(parser._ignores) > 0:
+            ignore = parser._ignores[-1]
+        # tables are kept with the rules they are computed from
+        links = parser._links
+        if links is not None:
+            cache = links.cache
+        else:
+            cache = parser.tables().cache
+        key = (self, ignore)
+        if key not in cache:
+            from pyrser.parsing import first
+            cache[key] = first.dispatch_table(self, parser.__class__, ignore)
+        table = cache[key]
+        if table is None:
+            return None
+        stream = parser._stream
+        index = stream._cursor._index
+        if index == stream._len:
+            return None
+        return table.get(stream._content[index])
+
     def do_call(self, parser: BasicParser) -> Node:
+        steps = self.dispatch(parser)
+        if steps is not None:
+            return self.try_steps(parser, steps, self.ptlist)
         # save result of current rule
         parser.push_rule_nodes()
         for pt in self.ptlist:
@@ -386,6 +425,26 @@ class Alt(Functor):
         parser.pop_rule_nodes()
         return False
 
+    def try_steps(self, parser: BasicParser, steps: tuple,
+                  branches: tuple) -> Node:
+        """Try the alternatives given by dispatch."""
+        parser.push_rule_nodes()
+        for step in steps:
+            if type(step) is int:
+                step = branches[step]
+            parser._stream.save_context()
+            parser.push_rule_nodes()
+            res = step(parser)
+            if res:
+                parser.pop_rule_nodes()
+                parser.pop_rule_nodes()
+                parser._stream.validate_context()
+                return res
+            parser.pop_rule_nodes()
+            parser._stream.restore_context()
+        parser.pop_rule_nodes()
+        return False
+
 
 class RepOptional(Functor):
     """ []? bnf primitive as a functor. """
@@ -447,6 +506,105 @@ class Rep1N(Functor):
         return parser._stream.restore_context()
 
 
+class Regex(Functor):
+    """ A terminal-only subtree matched by one regular expression.
+
+    Each IGNORE mark of the pattern stands for the current ignore
+    convention. With an ignore convention that isn't in ignore_regex,
+    the original subtree pt is called instead.
+    """
+
+    IGNORE = "(?#ignore)"
+
+    def __init__(self, pt: Functor, pattern: str):
+        Functor.__init__(self)
+        self.pt = pt
+        self.pattern = pattern
+        self.ignored = Regex.IGNORE in pattern
+        self._regex = {}
+        if not self.ignored:
+            self.regex = re.compile(pattern)
+
+    def compile(self, ignore) -> 're.Pattern':
+        """The regex for an ignore convention, or None."""
+        if ignore not in self._regex:
+            regex = None
+            if ignore in ignore_regex:
+                parts = self.pattern.split(Regex.IGNORE)
+                pattern = parts[0]
+                for i, part in enumerate(parts[1:]):
+                    if ignore_regex[ignore] != "":
+                        pattern += atomic(ignore_regex[ignore], "i%d" % i)
+                    pattern += part
+                regex = re.compile(pattern)
+            self._regex[ignore] = regex
+        return self._regex[ignore]
+
+    def do_call(self, parser: BasicParser) -> bool:
+        stream = parser._stream
+        index = stream.index
+        if not self.ignored:
+            m = self.regex.match(stream._content, index)
+            if m is None:
+                return False
+            stream.incpos(m.end() - index)
+            return True
+        ignore = None
+        if len(parser._ignores) > 0:
+            ignore = parser._ignores[-1]
+        regex = self.compile(ignore)
+        if regex is not None:
+            m = regex.match(stream._content, index)
+            # repeated sequences leave the cursor after an ignore
+            if m is not None and m.end() != index:
+                stream.incpos(m.end() - index)
+                parser._lastIgnore = False
+                parser._lastIgnoreIndex = stream.index
+                return True
+        return self.pt(parser)
+
+
+class Native(Functor):
+    """ A terminal-only subtree matched by a compiled function.
+
+    match(content, index, ignore, last_ignore_index, last_ignore, maxindex)
+    gives (res, index, maxindex, last_ignore_index, last_ignore) as pt
+    would leave them, ignore being the code of the current ignore
+    convention in ignore_native (see codegen.c.cython). With an ignore
+    convention that isn't in ignore_native, pt is called instead.
+    """
+
+    def __init__(self, pt: Functor, match, ignored: bool):
+        Functor.__init__(self)
+        self.pt = pt
+        self.match = match
+        self.ignored = ignored
+
+    def do_call(self, parser: BasicParser) -> bool:
+        ignore = 0
+        if self.ignored:
+            convention = None
+            if len(parser._ignores) > 0:
+                convention = parser._ignores[-1]
+            if convention not in ignore_native:
+                return self.pt(parser)
+            ignore = ignore_native[convention]
+        cursor = parser._stream._cursor
+        (res, cursor._index, cursor._maxindex, parser._lastIgnoreIndex,
+         parser._lastIgnore) = self.match(
+            parser._stream._content, cursor._index, ignore,
+            parser._lastIgnoreIndex, parser._lastIgnore, cursor._maxindex)
+        return res
+
+
+def atomic(pattern: str, name: str) -> str:
+    """Match pattern without backtracking into it, as PEG does.
+
+    name must be an unique group name in the final regex.
+    """
+    return "(?=(?P<%s>%s))(?P=%s)" % (name, pattern, name)
+
+
 class Error(Functor):
     """ Raise an error. """
 
@@ -488,6 +646,9 @@ class Hook(Functor, Leaf):
             if type(t) is not type:
                 raise TypeError("Must be pair of value and type (i.e: int, "
                                 "str, Node)")
+            if t is not Node and type(v) is not t:
+                raise TypeError("Type mismatch expected {} got {}".format(
+                    t, type(v)))
         self.param = param
 
     def do_call(self, parser: BasicParser) -> bool:
@@ -505,14 +666,56 @@ class Hook(Functor, Leaf):
                     )
                     raise parser.diagnostic
                 valueparam.append(parser.rule_nodes[v])
-            elif type(v) is t:
-                valueparam.append(v)
             else:
-                raise TypeError("Type mismatch expected {} got {}".format(
-                    t, type(v)))
+                valueparam.append(v)
         return parser.eval_hook(self.name, valueparam)
 
 
+@functools.lru_cache(maxsize=None)
+def _param_specs(f, skip: int) -> tuple:
+    """Annotation and presence of a default of the parameters of f.
+
+    The skip first parameters are ignored.
+    """
+    params = list(inspect.signature(f).parameters.values())[skip:]
+    return tuple((p.annotation, p.default is not inspect.Parameter.empty)
+                 for p in params)
+
+
+def _check_params(name: str, method: str, specs: tuple, params: list):
+    """Raise if params don't match the specs of a method."""
+    for idx, (annotation, has_default) in enumerate(specs):
+        if idx >= len(params) and not has_default:
+            raise RuntimeError("{}: No parameter given to {}"
+                               " method for argument {}, expected {}".
+                               format(name, method, idx, annotation))
+        elif idx < len(params) and not isinstance(params[idx], annotation):
+            raise TypeError(
+                "{}: Wrong parameter in {} method parameter {} "
+                "expected {} got {}".format(
+                    name, method, idx, type(params[idx]), annotation))
+
+
+def _static_values(param: [(object, type)]) -> list:
+    """Values of the parameters of a directive, None if some are nodes.
+
+    Raise on malformed parameters or type mismatch.
+    """
+    values = []
+    for v, t in param:
+        if type(t) is not type:
+            raise TypeError(
+                "Must be pair of value and type (i.e: int, str, Node)")
+        if t is Node:
+            values = None
+        elif type(v) is not t:
+            raise TypeError(
+                "Type mismatch expected {} got {}".format(t, type(v)))
+        elif values is not None:
+            values.append(v)
+    return values
+
+
 class MetaDirectiveWrapper(type):
     """ metaclass of all DirectiveWrapper subclasses.
     ensure that begin and end exists in subclasses as method
@@ -544,45 +747,10 @@ class DirectiveWrapper(Functor, metaclass=MetaDirectiveWrapper):
         if (not hasattr(self.__class__, 'begin') or
                 not hasattr(self.__class__, 'end')):
             return False
-        sbegin = inspect.signature(self.begin)
-        send = inspect.signature(self.end)
-
-        idx = 0
-        for param in list(sbegin.parameters.values())[1:]:
-            if idx >= len(params) and param.default is inspect.Parameter.empty:
-                raise RuntimeError("{}: No parameter given to begin"
-                                   " method for argument {}, expected {}".
-                                   format(
-                                       self.__class__.__name__,
-                                       idx, param.annotation))
-            elif (idx < len(params)
-                  and not isinstance(params[idx], param.annotation)):
-                raise TypeError(
-                    "{}: Wrong parameter in begin method parameter {} "
-                    "expected {} got {}".format(
-                        self.__class__.__name__,
-                        idx, type(params[idx]),
-                        param.annotation))
-            idx += 1
-
-        idx = 0
-        for param in list(send.parameters.values())[1:]:
-            if idx >= len(params) and param.default is inspect.Parameter.empty:
-                raise RuntimeError("{}: No parameter given to end"
-                                   " method for argument {}, expected {}".
-                                   format(
-                                       self.__class__.__name__,
-                                       idx, param.annotation))
-            elif (idx < len(params)
-                  and not isinstance(params[idx], param.annotation)):
-                raise TypeError(
-                    "{}: Wrong parameter in end method parameter {} "
-                    "expected {} got {}".format(
-                        self.__class__.__name__,
-                        idx, type(params[idx]),
-                        param.annotation))
-            idx += 1
-
+        _check_params(self.__class__.__name__, 'begin',
+                      _param_specs(self.__class__.begin, 2), params)
+        _check_params(self.__class__.__name__, 'end',
+                      _param_specs(self.__class__.end, 2), params)
         return True
 
     def begin(self):
@@ -601,24 +769,23 @@ class Directive(Functor):
         self.directive = directive
         self.pt = pt
         # compose the list of value param, check type
-        for v, t in param:
-            if type(t) is not type:
-                raise TypeError(
-                    "Must be pair of value and type (i.e: int, str, Node)")
+        self.values = _static_values(param)
         self.param = param
+        # without nodes, parameters are checked once
+        if self.values is not None:
+            self.directive.checkParam(self.values)
 
     def do_call(self, parser: BasicParser) -> Node:
-        valueparam = []
-        for v, t in self.param:
-            if t is Node:
-                valueparam.append(parser.rule_nodes[v])
-            elif type(v) is t:
-                valueparam.append(v)
-            else:
-                raise TypeError(
-                    "Type mismatch expected {} got {}".format(t, type(v)))
-        if not self.directive.checkParam(valueparam):
-            return False
+        valueparam = self.values
+        if valueparam is None:
+            valueparam = []
+            for v, t in self.param:
+                if t is Node:
+                    valueparam.append(parser.rule_nodes[v])
+                else:
+                    valueparam.append(v)
+            if not self.directive.checkParam(valueparam):
+                return False
         if not self.directive.begin(parser, *valueparam):
             return False
         res = self.pt(parser)
@@ -663,58 +830,42 @@ class Decorator(Functor):
         self.decorator_class = decoratorClass
         self.pt = pt
         # compose the list of value param, check type
-        for v, t in param:
-            if type(t) is not type:
-                raise TypeError(
-                    "Must be pair of value and type (i.e: int, str, Node)")
+        self.values = _static_values(param)
         self.param = param
+        # without nodes, parameters are checked once
+        if self.values is not None:
+            self.checkParam(decoratorClass, self.values)
 
     def checkParam(self, the_class: type, params: list) -> bool:
-        sinit = inspect.signature(the_class.__init__)
-
-        idx = 0
-        for param in list(sinit.parameters.values())[1:]:
-            if idx >= len(params) and param.default is inspect.Parameter.empty:
-                raise RuntimeError("{}: No parameter given to begin"
-                                   " method for argument {}, expected {}".
-                                   format(
-                                       the_class.__name__,
-                                       idx, param.annotation))
-            elif (idx < len(params)
-                  and not isinstance(params[idx], param.annotation)):
-                raise TypeError(
-                    "{}: Wrong parameter in begin method parameter {} "
-                    "expected {} got {}".format(
-                        the_class.__name__,
-                        idx, type(params[idx]),
-                        param.annotation))
-            idx += 1
-
+        _check_params(the_class.__name__, 'begin',
+                      _param_specs(the_class.__init__, 1), params)
         return True
 
     def do_call(self, parser: BasicParser) -> Node:
         """
             The Decorator call is the one that actually pushes/pops
-            the decorator in the active decorators list (parsing._decorators)
-        """
-        valueparam = []
-        for v, t in self.param:
-            if t is Node:
-                valueparam.append(parser.rule_nodes[v])
-            elif type(v) is t:
-                valueparam.append(v)
-            else:
-                raise TypeError(
-                    "Type mismatch expected {} got {}".format(t, type(v)))
+            the decorator in the active decorators list of the parser
 
-        if not self.checkParam(self.decorator_class, valueparam):
-            return False
+            A decorator instance lives for one call (a Trace writes
+            its whole output file for it).
+        """
+        valueparam = self.values
+        if valueparam is None:
+            valueparam = []
+            for v, t in self.param:
+                if t is Node:
+                    valueparam.append(parser.rule_nodes[v])
+                else:
+                    valueparam.append(v)
+            if not self.checkParam(self.decorator_class, valueparam):
+                return False
 
         decorator = self.decorator_class(*valueparam)
 
-        global _decorators
-        _decorators.append(decorator)
-        res = self.pt(parser)
-        _decorators.pop()
+        parser.push_decorator(decorator)
+        try:
+            res = self.pt(parser)
+        finally:
+            parser.pop_decorator()
 
         return res
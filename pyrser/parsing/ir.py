@@ -1,71 +1,303 @@
 # IR allow to represent algorithmic bricks of PEG parsing
+#
+# Each brick matches (returns a true value) or fails like the functors it
+# comes from (see passes.to_ir), but the stream contexts and the end of
+# stream checks are explicit, so passes can remove the useless ones (see
+# passes.optimize) before a backend emits code for them.
+import copy
+
 
 class IR:
-    """ Base class for Internal Representation of algorithmic bricks. """
+    """ Base class for Internal Representation of algorithmic bricks.
+
+    fields are the parameters of the constructor, children the fields
+    holding bricks and childlists the fields holding lists of bricks.
+    """
+    fields = ()
+    children = ()
+    childlists = ()
+
+    def __eq__(self, other) -> bool:
+        return (type(self) is type(other)
+                and all(getattr(self, f) == getattr(other, f)
+                        for f in self.fields))
+
+    __hash__ = object.__hash__
+
+    def __repr__(self) -> str:
+        return "%s(%s)" % (type(self).__name__,
+                           ", ".join(repr(getattr(self, f))
+                                     for f in self.fields))
+
+    def map(self, fn) -> 'IR':
+        """Replace each sub brick by fn(brick), return self."""
+        for name in self.children:
+            setattr(self, name, fn(getattr(self, name)))
+        for name in self.childlists:
+            setattr(self, name, [fn(sub) for sub in getattr(self, name)])
+        return self
+
+    def copy(self) -> 'IR':
+        """Copy the brick and its sub bricks, other fields are shared."""
+        return copy.copy(self).map(lambda sub: sub.copy())
+
+    def walk(self) -> iter:
+        """The brick and all its sub bricks."""
+        todo = [self]
+        while len(todo) > 0:
+            node = todo.pop()
+            yield node
+            for name in node.children:
+                todo.append(getattr(node, name))
+            for name in node.childlists:
+                todo.extend(reversed(getattr(node, name)))
 
 
 class Grammar(IR):
     """Abstraction of a whole grammar."""
+    fields = ('name', 'rules')
 
     def __init__(self, name: str):
         self.name = name
         self.rules = []
 
+
 class Rule(IR):
     """Abstraction of a target function. """
-    
-    def __init__(self, name: str):
+    fields = ('name', 'block')
+    children = ('block',)
+
+    def __init__(self, name: str, block: IR=None):
         self.name = name
-        self.block = None
+        self.block = block
+
 
 class Block(IR):
-    
+    """Match all bricks in order, fail at the first failing one.
+
+    The stream is not rewound on failure. The result is True.
+    """
+    fields = ('lsexpr',)
+    childlists = ('lsexpr',)
+
     def __init__(self, lsexpr: list):
         if not isinstance(lsexpr, list):
             raise TypeError("Take only a list")
         self.lsexpr = lsexpr
 
-class CallRule(IR):
-    pass
 
+class SaveCtx(IR):
+    """Temporary save the current parsing context around block.
+
+    The context is validated if block matches and restored if it fails.
+    The result is True.
+    """
+    fields = ('block',)
+    children = ('block',)
+
+    def __init__(self, block: IR):
+        self.block = block
 
-class GetC(IR):
-    pass
 
-class IncPos(IR):
-    pass
+class RestoreCtx(IR):
+    """Restore the context saved before block, whatever its result."""
+    fields = ('block',)
+    children = ('block',)
+
+    def __init__(self, block: IR):
+        self.block = block
+
+
+class ReturnOnEof(IR):
+    """Fail if less than length characters are left.
+
+    block is a run of terminals matching length characters. Backends
+    only check the end of stream once for all of them, and evaluate them
+    with their own checks when they are known to fail (for the deepest
+    position readed).
+    """
+    fields = ('length', 'block')
+    children = ('block',)
+
+    def __init__(self, length: int, block: IR):
+        self.length = length
+        self.block = block
+
+
+class SkipIgnore(IR):
+    """Skip the characters of the current ignore convention.
+
+    null is True when the convention is known to be ignore_null, then
+    nothing is skipped.
+    """
+    fields = ('null',)
+
+    def __init__(self, null: bool=False):
+        self.null = null
+
 
 class EqualBlock(IR):
-    
-    def __init__(self, v: str):
+    """Match the text value, fail at end of stream.
+
+    value can be the concatenation of several texts, cuts are the end
+    of each of them. On failure the deepest position readed is the end
+    of the last matching one.
+    """
+    fields = ('value', 'cuts')
+
+    def __init__(self, v: str, cuts: tuple=None):
         self.value = v
-        self.block = None
+        if cuts is None:
+            cuts = (len(v),)
+        self.cuts = cuts
+
 
 class RangeBlock(IR):
-    pass
+    """Match one character between begin and end."""
+    fields = ('begin', 'end')
+
+    def __init__(self, begin: str, end: str):
+        self.begin = begin
+        self.end = end
+
+
+class CallRule(IR):
+    """Evaluate a rule by name."""
+    fields = ('name',)
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+class InlineRule(IR):
+    """Evaluate the block of a rule in place of calling it.
+
+    Only for rules without nodes, the result is a new Node.
+    """
+    fields = ('name', 'block')
+    children = ('block',)
+
+    def __init__(self, name: str, block: IR):
+        self.name = name
+        self.block = block
+
+
+class Call(IR):
+    """Evaluate a functor without lowering (hooks, peeks, regexes...)."""
+    fields = ('functor',)
+
+    def __init__(self, functor):
+        self.functor = functor
+
+
+class Alt(IR):
+    """Try each brick of lsexpr until one matches.
+
+    functor is the functors.Alt giving the order of the alternatives
+    to try at the current char, indexes the index of each brick in
+    functor.ptlist (alternatives never tried are removed).
+    """
+    fields = ('functor', 'lsexpr', 'indexes')
+    childlists = ('lsexpr',)
+
+    def __init__(self, functor, lsexpr: list, indexes: tuple=None):
+        self.functor = functor
+        self.lsexpr = lsexpr
+        if indexes is None:
+            indexes = tuple(range(len(lsexpr)))
+        self.indexes = indexes
+
+
+class RepOptional(IR):
+    """Match block once or not, always match."""
+    fields = ('block',)
+    children = ('block',)
+
+    def __init__(self, block: IR):
+        self.block = block
+
+
+class Rep0N(IR):
+    """Match block while it matches, always match."""
+    fields = ('block',)
+    children = ('block',)
+
+    def __init__(self, block: IR):
+        self.block = block
+
+
+class Rep1N(IR):
+    """Match block while it matches, at least once."""
+    fields = ('block',)
+    children = ('block',)
+
+    def __init__(self, block: IR):
+        self.block = block
+
+
+class Neg(IR):
+    """Match without moving if block fails."""
+    fields = ('block',)
+    children = ('block',)
+
+    def __init__(self, block: IR):
+        self.block = block
+
+
+class Complement(IR):
+    """Match one character if block fails."""
+    fields = ('block',)
+    children = ('block',)
+
+    def __init__(self, block: IR):
+        self.block = block
+
 
 class WhileEofBlock(IR):
-    """ """
-    pass
+    """Step characters until block matches, fail at end of stream."""
+    fields = ('block',)
+    children = ('block',)
 
+    def __init__(self, block: IR):
+        self.block = block
 
-class ReturnOnEof(IR):
-    """If we reach the EOF, we abort parsing directly."""
-    pass
 
+class Capture(IR):
+    """Name the node and the text matched by block."""
+    fields = ('tagname', 'block')
+    children = ('block',)
 
-class SaveCtx(IR):
-    """Temporary save the current parsing context."""
-    pass
+    def __init__(self, tagname: str, block: IR):
+        self.tagname = tagname
+        self.block = block
+
+
+class Bind(IR):
+    """Bind the node matched by block to a name."""
+    fields = ('tagname', 'block')
+    children = ('block',)
+
+    def __init__(self, tagname: str, block: IR):
+        self.tagname = tagname
+        self.block = block
+
+
+class Scope(IR):
+    """Match begin, block then end, the result is the one of block."""
+    fields = ('begin', 'block', 'end')
+    children = ('begin', 'block', 'end')
+
+    def __init__(self, begin: IR, block: IR, end: IR):
+        self.begin = begin
+        self.block = block
+        self.end = end
 
-class RestoreCtx(IR):
-    """Restore previous parsing context."""
-    pass
 
-class ValidateCtx(IR):
-    """Validate current parsing context."""
-    pass
+class Directive(IR):
+    """Match block between the begin and end of a functors.Directive."""
+    fields = ('functor', 'block')
+    children = ('block',)
 
-class Return(IR):
-    """Abstraction of a return statement. return the last boolean state."""
-    pass
+    def __init__(self, functor, block: IR):
+        self.functor = functor
+        self.block = block
@@ -0,0 +1,690 @@
+"""Evaluate rules without recursion.
+
+Each rule tree is converted to IR, optimized (see passes.optimize) and
+lowered once into a flat program where every brick is given the
+instruction to go to on success and the one to go to on failure, the
+result of the last brick being kept in a register. Called rules,
+alternatives being tried and saved results are kept in heap stacks:
+nesting is only limited by memory and no python frame is created by
+level.
+
+Functors without a lowering (hooks, regexes, decorators, ...) are
+called as usual, a Decorator evaluates its subtree recursively.
+"""
+import copy
+
+from pyrser import error
+from pyrser.parsing import functors
+from pyrser.parsing import ir
+from pyrser.parsing.memo import Memo
+from pyrser.parsing.node import Node
+
+
+# An instruction is a tuple (opcode, a, b, c), by decreasing frequency.
+SKIP = 0            # skip ignored chars, goto a
+CALL = 1            # res = a(parser), goto b if res else c
+SAVE = 2            # save stream context, goto a
+VALIDATE = 3        # drop saved context, res = True, goto a
+RESTORE = 4         # restore saved context, res = False, goto a
+RULE = 5            # call rule a, then goto b if res else c
+RETURN = 6          # end of the current rule
+ALT_NEXT = 7        # try next alternative, goto branch a[i] or b
+ALT_FAIL = 8        # alternative failed, goto a
+ALT_OK = 9          # alternative matched, goto a
+ALT = 10            # start alternatives of Alt a (all are b), goto c
+TRUE = 11           # res = True, goto a
+FAIL = 12           # res = False, goto a
+PUSH_NODES = 13     # push rule nodes, goto a
+POP_NODES = 14      # pop rule nodes, goto a
+REP = 15            # no repetition matched yet, goto a
+REP_AGAIN = 16      # a repetition matched, goto a
+REP_END = 17        # goto a if matched once else restore, goto b
+RESTORE_RES = 18    # restore saved context, goto a if res else b
+IF_EOF = 19         # goto a at end of stream else b
+INCPOS = 20         # step next char, goto a
+DO = 21             # a(parser), goto b
+PUSH_RES = 22       # save res, goto a
+POP_RES = 23        # restore res, goto a if res else b
+DROP_RES = 24       # forget saved res, res = False, goto a
+CAPTURE = 25        # begin tag a, goto b, goto c if it fails
+CAPTURE_END = 26    # end tag a, goto b if res else c
+BIND = 27           # bind res to a, goto b
+DIRECTIVE = 28      # begin Directive a, goto b, goto c if it fails
+DIRECTIVE_END = 29  # end Directive a, goto b if res else c
+ENTER = 30          # call rule a without new rule nodes, then halt
+HALT = 31           # return res
+SKIP_NULL = 32      # skip nothing with the ignore_null convention, goto a
+TEXT = 33           # read text a, goto b if matched else c
+TEXTS = 34          # read merged texts a = (text, prefixes), goto b or c
+RANGE = 35          # read a char in a = (begin, end), goto b or c
+RANGE_UNCHECKED = 36    # same, not at end of stream
+GUARD = 37          # goto b if a chars are left else c
+LAST_RULE = 38      # set the last rule to a, goto b
+NEW_NODE = 39       # res = new Node, goto a
+
+
+class Label:
+    """A jump target, resolved when the program is complete."""
+    __slots__ = ('pc',)
+
+    def __init__(self):
+        self.pc = None
+
+
+#: Target of the instruction following the emitted one
+NEXT = Label()
+
+
+class Assembler:
+    """Build the program of a rule tree."""
+    def __init__(self):
+        self.code = []
+
+    def place(self, label: Label):
+        """The next emitted instruction is the target of label."""
+        label.pc = len(self.code)
+
+    def emit(self, op: int, a=None, b=None, c=None):
+        self.code.append((op, a, b, c))
+
+    def finish(self) -> tuple:
+        def resolve(pc, arg):
+            if arg is NEXT:
+                return pc + 1
+            if isinstance(arg, Label):
+                return arg.pc
+            if (type(arg) is tuple
+                    and any(isinstance(label, Label) for label in arg)):
+                return tuple(label.pc if label is not None else None
+                             for label in arg)
+            return arg
+        return tuple(tuple(resolve(pc, arg) for arg in ins)
+                     for pc, ins in enumerate(self.code))
+
+
+def _save_maxindex(parser):
+    stream = parser._stream
+    stream._contexts.append(stream._cursor._maxindex)
+
+
+def _search_failed(parser):
+    parser.undo_last_ignore()
+    stream = parser._stream
+    stream.search_failed(stream._contexts.pop())
+
+
+def _sets_true(node: ir.IR) -> bool:
+    """True if the instructions of node leave res to True on success."""
+    return isinstance(node, (ir.SkipIgnore, ir.EqualBlock, ir.RangeBlock,
+                             ir.SaveCtx, ir.Block, ir.ReturnOnEof))
+
+
+def lower(asm: Assembler, node: ir.IR, ok: Label, ko: Label,
+          checked: bool=True):
+    """Emit the instructions evaluating node, going to ok or ko after.
+
+    With checked False, the end of stream is known to be far enough for
+    the terminals of node (see ir.ReturnOnEof).
+    """
+    kind = type(node)
+    if kind is ir.SkipIgnore:
+        asm.emit(SKIP_NULL if node.null else SKIP, ok)
+    elif kind is ir.EqualBlock:
+        if len(node.cuts) > 1:
+            # prefixes of the merged texts, longest first
+            prefixes = tuple(node.value[:cut]
+                             for cut in reversed(node.cuts[:-1]))
+            asm.emit(TEXTS, (node.value, prefixes), ok, ko)
+        elif node.value == "":
+            asm.emit(CALL, _read_empty, ok, ko)
+        else:
+            asm.emit(TEXT, node.value, ok, ko)
+    elif kind is ir.RangeBlock:
+        asm.emit(RANGE if checked else RANGE_UNCHECKED,
+                 (node.begin, node.end), ok, ko)
+    elif kind is ir.Block:
+        if len(node.lsexpr) == 0:
+            asm.emit(TRUE, ok)
+            return
+        for sub in node.lsexpr[:-1]:
+            nxt = Label()
+            lower(asm, sub, nxt, ko, checked)
+            asm.place(nxt)
+        last = node.lsexpr[-1]
+        if _sets_true(last):
+            lower(asm, last, ok, ko, checked)
+        else:
+            nxt = Label()
+            lower(asm, last, nxt, ko, checked)
+            asm.place(nxt)
+            asm.emit(TRUE, ok)
+    elif kind is ir.SaveCtx:
+        fail = Label()
+        done = Label()
+        asm.emit(SAVE, NEXT)
+        lower(asm, node.block, done, fail, checked)
+        asm.place(done)
+        asm.emit(VALIDATE, ok)
+        asm.place(fail)
+        asm.emit(RESTORE, ko)
+    elif kind is ir.ReturnOnEof:
+        fast = Label()
+        slow = Label()
+        asm.emit(GUARD, node.length, fast, slow)
+        asm.place(fast)
+        lower(asm, node.block, ok, ko, False)
+        asm.place(slow)
+        lower(asm, node.block, ok, ko, checked)
+    elif kind is ir.Alt:
+        nxt = Label()
+        # branches by index in the ptlist of the functor, None if removed
+        branches = [None] * len(node.functor.ptlist)
+        for index in node.indexes:
+            branches[index] = Label()
+        branches = tuple(branches)
+        matched = Label()
+        failed = Label()
+        asm.emit(ALT, node.functor, node.indexes, nxt)
+        asm.place(nxt)
+        asm.emit(ALT_NEXT, branches, ko)
+        for sub, index in zip(node.lsexpr, node.indexes):
+            asm.place(branches[index])
+            lower(asm, sub, matched, failed, checked)
+        asm.place(failed)
+        asm.emit(ALT_FAIL, nxt)
+        asm.place(matched)
+        asm.emit(ALT_OK, ok)
+    elif kind is ir.CallRule:
+        asm.emit(RULE, node.name, ok, ko)
+    elif kind is ir.InlineRule:
+        done = Label()
+        asm.emit(LAST_RULE, node.name, NEXT)
+        lower(asm, node.block, done, ko, checked)
+        asm.place(done)
+        asm.emit(NEW_NODE, ok)
+    elif kind is ir.RepOptional:
+        true = Label()
+        lower(asm, node.block, ok, true, checked)
+        asm.place(true)
+        asm.emit(TRUE, ok)
+    elif kind is ir.Rep0N:
+        loop = Label()
+        end = Label()
+        asm.emit(SAVE, NEXT)
+        asm.emit(PUSH_NODES, NEXT)
+        asm.place(loop)
+        lower(asm, node.block, loop, end, checked)
+        asm.place(end)
+        asm.emit(POP_NODES, NEXT)
+        asm.emit(VALIDATE, ok)
+    elif kind is ir.Rep1N:
+        loop = Label()
+        again = Label()
+        end = Label()
+        asm.emit(SAVE, NEXT)
+        asm.emit(PUSH_NODES, NEXT)
+        asm.emit(REP, NEXT)
+        asm.place(loop)
+        lower(asm, node.block, again, end, checked)
+        asm.place(again)
+        asm.emit(REP_AGAIN, loop)
+        asm.place(end)
+        asm.emit(REP_END, ok, ko)
+    elif kind is ir.Scope:
+        body = Label()
+        end = Label()
+        matched = Label()
+        failed = Label()
+        lower(asm, node.begin, body, ko, checked)
+        asm.place(body)
+        lower(asm, node.block, end, end, checked)
+        asm.place(end)
+        asm.emit(PUSH_RES, NEXT)
+        lower(asm, node.end, matched, failed, checked)
+        asm.place(matched)
+        asm.emit(POP_RES, ok, ko)
+        asm.place(failed)
+        asm.emit(DROP_RES, ko)
+    elif kind is ir.RestoreCtx:
+        end = Label()
+        asm.emit(SAVE, NEXT)
+        lower(asm, node.block, end, end, checked)
+        asm.place(end)
+        asm.emit(RESTORE_RES, ok, ko)
+    elif kind is ir.Neg:
+        matched = Label()
+        failed = Label()
+        asm.emit(SAVE, NEXT)
+        lower(asm, node.block, matched, failed, checked)
+        asm.place(matched)
+        asm.emit(RESTORE, ko)
+        asm.place(failed)
+        asm.emit(VALIDATE, ok)
+    elif kind is ir.Complement:
+        eof = Label()
+        start = Label()
+        matched = Label()
+        failed = Label()
+        asm.emit(IF_EOF, eof, start)
+        asm.place(eof)
+        asm.emit(FAIL, ko)
+        asm.place(start)
+        asm.emit(SAVE, NEXT)
+        lower(asm, node.block, matched, failed, checked)
+        asm.place(matched)
+        asm.emit(RESTORE, ko)
+        asm.place(failed)
+        asm.emit(INCPOS, NEXT)
+        asm.emit(VALIDATE, ok)
+    elif kind is ir.WhileEofBlock:
+        loop = Label()
+        body = Label()
+        found = Label()
+        step = Label()
+        eof = Label()
+        # the furthest index read is saved under the search position
+        asm.emit(DO, _save_maxindex, NEXT)
+        asm.emit(SAVE, NEXT)
+        asm.place(loop)
+        asm.emit(IF_EOF, eof, body)
+        asm.place(body)
+        lower(asm, node.block, found, step, checked)
+        asm.place(step)
+        asm.emit(INCPOS, loop)
+        asm.place(found)
+        asm.emit(VALIDATE, NEXT)
+        asm.emit(VALIDATE, ok)
+        asm.place(eof)
+        asm.emit(RESTORE, NEXT)
+        asm.emit(DO, _search_failed, ko)
+    elif kind is ir.Capture:
+        end = Label()
+        asm.emit(CAPTURE, node.tagname, NEXT, ko)
+        lower(asm, node.block, end, end, checked)
+        asm.place(end)
+        asm.emit(CAPTURE_END, node.tagname, ok, ko)
+    elif kind is ir.Bind:
+        bind = Label()
+        lower(asm, node.block, bind, ko, checked)
+        asm.place(bind)
+        asm.emit(BIND, node.tagname, ok)
+    elif kind is ir.Directive:
+        end = Label()
+        asm.emit(DIRECTIVE, node.functor, NEXT, ko)
+        lower(asm, node.block, end, end, checked)
+        asm.place(end)
+        asm.emit(DIRECTIVE_END, node.functor, ok, ko)
+    elif kind is ir.Call:
+        pt = node.functor
+        if isinstance(pt, functors.Functor):
+            pt = pt.do_call
+        asm.emit(CALL, pt, ok, ko)
+    else:
+        raise TypeError("Can't lower %s" % kind.__name__)
+
+
+def _read_empty(parser) -> bool:
+    # "" only fails at end of stream
+    return parser.read_text("")
+
+
+def assemble(node: ir.IR) -> tuple:
+    """The program of the IR of a rule."""
+    asm = Assembler()
+    end = Label()
+    lower(asm, node, end, end)
+    asm.place(end)
+    asm.emit(RETURN)
+    return asm.finish()
+
+
+class Programs(dict):
+    """Programs of the rule trees of a parser class, by rule tree.
+
+    Each rule tree is converted to IR, optimized with the calls of the
+    trivial rules of the class inlined, and lowered at its first
+    evaluation.
+    """
+    def __init__(self, rules: dict):
+        # passes import the directives, which need the parsing package
+        from pyrser.passes import optimize
+        self.inliner = optimize.Inliner(rules)
+
+    def __missing__(self, pt) -> tuple:
+        from pyrser.passes import optimize
+        code = assemble(optimize.optimize(optimize.convert(pt),
+                                          self.inliner))
+        self[pt] = code
+        return code
+
+
+def program(pt) -> tuple:
+    """The program of a rule tree alone, lowered at its first evaluation.
+
+    Rules are called without inlining.
+    """
+    code = pt.__dict__.get('_program')
+    if code is None:
+        from pyrser.passes import optimize
+        code = assemble(optimize.optimize(optimize.convert(pt)))
+        pt._program = code
+    return code
+
+
+def programs(links) -> Programs:
+    """The programs of the rules of linked tables."""
+    cache = links.cache
+    if 'machine' not in cache:
+        cache['machine'] = Programs(links.rules)
+    return cache['machine']
+
+
+def run(parser: 'BasicParser', name: str) -> Node:
+    """Evaluate the rule name like parser.eval_rule."""
+    code = ((ENTER, name, 1, 1), (HALT, None, None, None))
+    pc = 0
+    res = False
+    # called rules: (name, code, ok, ko, memo, key, new rule nodes)
+    calls = []
+    # alternatives being tried, saved results and directive parameters
+    values = []
+    streams = parser._streams
+    stream = streams[-1]
+    frames = parser._frames
+    links = parser._links
+    progs = programs(links) if links is not None else None
+    while True:
+        op, a, b, c = code[pc]
+        if op == SKIP:
+            ignores = parser._ignores
+            if len(ignores) > 0:
+                ignores[-1](parser)
+            index = stream._cursor._index
+            parser._lastIgnore = (index != parser._lastIgnoreIndex)
+            parser._lastIgnoreIndex = index
+            res = True
+            pc = a
+        elif op == TEXT:
+            cursor = stream._cursor
+            index = cursor._index
+            if stream._content.startswith(a, index):
+                index += len(a)
+                cursor._index = index
+                if index > cursor._maxindex:
+                    cursor._maxindex = index
+                res = True
+                pc = b
+            else:
+                res = False
+                pc = c
+        elif op == SKIP_NULL:
+            index = stream._cursor._index
+            parser._lastIgnore = (index != parser._lastIgnoreIndex)
+            parser._lastIgnoreIndex = index
+            res = True
+            pc = a
+        elif op == RANGE or op == RANGE_UNCHECKED:
+            cursor = stream._cursor
+            index = cursor._index
+            if ((op == RANGE_UNCHECKED or index < stream._len)
+                    and a[0] <= stream._content[index] <= a[1]):
+                index += 1
+                cursor._index = index
+                if index > cursor._maxindex:
+                    cursor._maxindex = index
+                res = True
+                pc = b
+            else:
+                res = False
+                pc = c
+        elif op == TEXTS:
+            cursor = stream._cursor
+            index = cursor._index
+            content = stream._content
+            if content.startswith(a[0], index):
+                index += len(a[0])
+                cursor._index = index
+                if index > cursor._maxindex:
+                    cursor._maxindex = index
+                res = True
+                pc = b
+            else:
+                # the texts matched before were readed
+                for prefix in a[1]:
+                    if content.startswith(prefix, index):
+                        index += len(prefix)
+                        if index > cursor._maxindex:
+                            cursor._maxindex = index
+                        break
+                res = False
+                pc = c
+        elif op == GUARD:
+            pc = b if stream._len - stream._cursor._index >= a else c
+        elif op == CALL:
+            res = a(parser)
+            stream = streams[-1]
+            pc = b if res else c
+        elif op == SAVE:
+            stream._contexts.append(stream._cursor._index)
+            pc = a
+        elif op == VALIDATE:
+            del stream._contexts[-1]
+            res = True
+            pc = a
+        elif op == RESTORE:
+            stream._cursor._index = stream._contexts.pop()
+            res = False
+            pc = a
+        elif op == RULE or op == ENTER:
+            push = op == RULE
+            if push:
+                frames.push()
+            parser.rule_nodes['_'] = Node()
+            if parser._links is not None:
+                rules = parser._links.rules
+            else:
+                rules = parser.tables().rules
+            if a not in rules:
+                parser.diagnostic.notify(
+                    error.Severity.ERROR,
+                    "Unknown rule : %s" % a,
+                    error.LocationInfo.from_stream(stream, is_error=True)
+                )
+                raise parser.diagnostic
+            parser._lastRule = a
+            rule = rules[a]
+            memo = key = None
+            if parser.packrat and parser.memoizable(rule):
+                memo = stream.memo
+                if memo is None:
+                    memo = stream.memo = Memo(parser.packrat_size)
+                ignores = parser._ignores
+                ignore = ignores[-1] if len(ignores) > 0 else None
+                key = (rule, stream._cursor._index, ignore)
+                entry = memo.get(key)
+                if entry is not None:
+                    (res, stream._cursor._index, parser._lastIgnoreIndex,
+                     parser._lastIgnore, parser._lastRule) = entry
+                    if res:
+                        # callers can change the node, see _eval_memo_rule
+                        res = copy.copy(res)
+                        parser.rule_nodes['_'] = res
+                    if push:
+                        frames.pop()
+                    pc = b if res else c
+                    continue
+            if isinstance(rule, functors.Functor):
+                calls.append((a, code, b, c, memo, key, push))
+                code = progs[rule] if progs is not None else program(rule)
+                pc = 0
+                continue
+            # rules written in python
+            res = rule(parser)
+            stream = streams[-1]
+            if res:
+                res = parser.rule_nodes['_']
+            if key is not None:
+                memo.set(key, (res and copy.copy(res), stream._cursor._index,
+                               parser._lastIgnoreIndex, parser._lastIgnore,
+                               parser._lastRule))
+            if push:
+                frames.pop()
+            pc = b if res else c
+        elif op == RETURN:
+            name, code, b, c, memo, key, push = calls.pop()
+            if res:
+                res = parser.rule_nodes['_']
+            if key is not None:
+                memo.set(key, (res and copy.copy(res), stream._cursor._index,
+                               parser._lastIgnoreIndex, parser._lastIgnore,
+                               parser._lastRule))
+            if push:
+                frames.pop()
+            pc = b if res else c
+        elif op == ALT_NEXT:
+            state = values[-1]
+            steps = state[0]
+            i = state[1]
+            branch = None
+            while i < len(steps):
+                step = steps[i]
+                i += 1
+                if type(step) is int:
+                    # removed branches are never tried
+                    branch = a[step]
+                    if branch is not None:
+                        break
+                    continue
+                # first.Skipped, it only updates the parser
+                step.do_call(parser)
+            if branch is None:
+                del values[-1]
+                frames.pop()
+                res = False
+                pc = b
+            else:
+                state[1] = i
+                stream._contexts.append(stream._cursor._index)
+                frames.push()
+                pc = branch
+        elif op == ALT_FAIL:
+            frames.pop()
+            stream._cursor._index = stream._contexts.pop()
+            pc = a
+        elif op == ALT_OK:
+            del values[-1]
+            frames.pop()
+            frames.pop()
+            del stream._contexts[-1]
+            pc = a
+        elif op == ALT:
+            steps = a.dispatch(parser)
+            if steps is None:
+                steps = b
+            values.append([steps, 0])
+            frames.push()
+            pc = c
+        elif op == TRUE:
+            res = True
+            pc = a
+        elif op == FAIL:
+            res = False
+            pc = a
+        elif op == PUSH_NODES:
+            frames.push()
+            pc = a
+        elif op == POP_NODES:
+            frames.pop()
+            pc = a
+        elif op == REP:
+            values.append(False)
+            pc = a
+        elif op == REP_AGAIN:
+            values[-1] = True
+            pc = a
+        elif op == REP_END:
+            frames.pop()
+            if values.pop():
+                del stream._contexts[-1]
+                res = True
+                pc = a
+            else:
+                stream._cursor._index = stream._contexts.pop()
+                res = False
+                pc = b
+        elif op == RESTORE_RES:
+            stream._cursor._index = stream._contexts.pop()
+            pc = a if res else b
+        elif op == IF_EOF:
+            pc = a if parser.read_eof() else b
+        elif op == INCPOS:
+            stream.incpos()
+            pc = a
+        elif op == DO:
+            a(parser)
+            stream = streams[-1]
+            pc = b
+        elif op == PUSH_RES:
+            values.append(res)
+            pc = a
+        elif op == POP_RES:
+            res = values.pop()
+            pc = a if res else b
+        elif op == DROP_RES:
+            del values[-1]
+            res = False
+            pc = a
+        elif op == CAPTURE:
+            if parser.begin_tag(a):
+                frames.push()
+                pc = b
+            else:
+                res = False
+                pc = c
+        elif op == CAPTURE_END:
+            frames.pop()
+            if res and parser.end_tag(a):
+                # no bindings, wrap it in a Node instance
+                if type(res) is bool:
+                    res = Node()
+                parser.tag_node(a, res)
+                parser.rule_nodes[a] = res
+                pc = b
+            else:
+                res = False
+                pc = c
+        elif op == BIND:
+            parser.bind(a, res)
+            pc = b
+        elif op == DIRECTIVE:
+            valueparam = a.values
+            if valueparam is None:
+                valueparam = []
+                for v, t in a.param:
+                    if t is Node:
+                        valueparam.append(parser.rule_nodes[v])
+                    else:
+                        valueparam.append(v)
+            if ((a.values is None and not a.directive.checkParam(valueparam))
+                    or not a.directive.begin(parser, *valueparam)):
+                stream = streams[-1]
+                res = False
+                pc = c
+            else:
+                stream = streams[-1]
+                values.append(valueparam)
+                pc = b
+        elif op == DIRECTIVE_END:
+            valueparam = values.pop()
+            if not a.directive.end(parser, *valueparam):
+                res = False
+            stream = streams[-1]
+            pc = b if res else c
+        elif op == LAST_RULE:
+            parser._lastRule = a
+            pc = b
+        elif op == NEW_NODE:
+            res = Node()
+            pc = a
+        elif op == HALT:
+            return res
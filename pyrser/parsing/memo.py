@@ -0,0 +1,45 @@
+import collections
+
+
+class Memo:
+    """Packrat cache of rule results for one Stream.
+
+    Entries are keyed by (rule, index, ignore convention) and kept in LRU
+    order. When more than maxsize entries are stored, the least recently
+    used ones are evicted.
+    """
+    def __init__(self, maxsize: int=4096):
+        if maxsize < 1:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def get(self, key):
+        """Return the entry stored for key, or None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key, entry):
+        """Store an entry, evicting the oldest ones if the cache is full."""
+        entries = self._entries
+        entries[key] = entry
+        entries.move_to_end(key)
+        while len(entries) > self.maxsize:
+            entries.popitem(last=False)
+
+    def clear(self):
+        """Drop all entries."""
+        self._entries.clear()
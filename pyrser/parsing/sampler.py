@@ -0,0 +1,103 @@
+import collections
+import sys
+import threading
+
+from pyrser.parsing import machine
+from pyrser.parsing.base import BasicParser
+
+
+# frames of the rule evaluations, the interpreted and compiled engines
+# both call a rule thru eval_rule
+_eval_rule_code = BasicParser.eval_rule.__code__
+# the stackless engine keeps its called rules in a local
+_run_code = machine.run.__code__
+
+
+def rule_stack(frame) -> (str,):
+    """Names of the rules evaluated in the python stack of frame,
+    outermost first.
+    """
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        if code is _eval_rule_code:
+            stack.append(frame.f_locals['name'])
+        elif code is _run_code:
+            calls = frame.f_locals.get('calls', ())
+            stack.extend(call[0] for call in reversed(calls))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+class Sampler:
+    """Sample periodically the rules evaluated in a thread.
+
+    Nothing is added to the parse itself: a background thread reads the
+    python stack of the sampled thread every interval seconds, so the cost
+    only depends on the interval. Samples outside of any rule are dropped.
+    collapsed gives the samples in the collapsed stack format of
+    flamegraph.pl: one line by stack, rules separated by ';' and followed
+    by the number of samples.
+
+        with Sampler() as sampler:
+            parser.parse(content)
+        sampler.write('rules.folded')
+    """
+    def __init__(self, interval: float=0.001, thread_id: int=None):
+        self.interval = interval
+        if thread_id is None:
+            thread_id = threading.get_ident()
+        self.thread_id = thread_id
+        self.counts = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self) -> bool:
+        """Record the current rule stack of the sampled thread."""
+        if self.thread_id == threading.get_ident():
+            frame = sys._getframe(1)
+        else:
+            frame = sys._current_frames().get(self.thread_id)
+        stack = rule_stack(frame)
+        if len(stack) == 0:
+            return False
+        self.counts[stack] += 1
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        if self._thread is not None:
+            raise RuntimeError("Sampler already started")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="pyrser-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def collapsed(self) -> str:
+        lines = ["%s %d" % (';'.join(stack), count)
+                 for stack, count in sorted(self.counts.items())]
+        if len(lines) == 0:
+            return ""
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename: str):
+        with open(filename, 'w') as f:
+            f.write(self.collapsed())
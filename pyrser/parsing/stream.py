@@ -1,4 +1,7 @@
+import array
+import bisect
 import collections
+import re
 
 
 """An immutable position in a Stream.
@@ -13,75 +16,71 @@ Position = collections.namedtuple('Position', 'index lineno col_offset')
 class Cursor:
     """A mutable position in a Stream.
 
-    It can be initialized or set from an immutable Position.
+    Only the index is tracked while moving. Line number and column offset
+    are computed on demand from the line starts table of the Stream.
     """
-    def __init__(self, position: Position=Position(0, 1, 1)):
-        self._maxindex = self._index = position.index
-        self._maxcol = self._col_offset = position.col_offset
-        self._maxline = self._lineno = position.lineno
-        self._eol = []
+    def __init__(self, lines: [int]=(0,), index: int=0):
+        self._lines = lines
+        # lines dropped before the first one of the table
+        self._lines_offset = 0
+        self._maxindex = self._index = index
+
+    def _line_col(self, index: int) -> (int, int):
+        lineno = bisect.bisect_right(self._lines, index)
+        return (lineno + self._lines_offset,
+                index - self._lines[lineno - 1] + 1)
 
     @property
     def index(self) -> int:
         """The current index of the cursor."""
         return self._index
 
+    @index.setter
+    def index(self, index: int):
+        self._index = index
+
     @property
     def lineno(self) -> int:
         """The current line number of the cursor."""
-        return self._lineno
+        return (bisect.bisect_right(self._lines, self._index)
+                + self._lines_offset)
 
     @property
     def col_offset(self) -> int:
         """The current column offset of the cursor."""
-        return self._col_offset
+        return self._line_col(self._index)[1]
 
     @property
     def position(self) -> Position:
         """The current position of the cursor."""
-        return Position(self._index, self._lineno, self._col_offset)
+        return Position(self._index, *self._line_col(self._index))
 
     @position.setter
     def position(self, position: Position):
         self._index = position.index
-        self._lineno = position.lineno
-        self._col_offset = position.col_offset
 
     @property
     def max_readed_position(self) -> Position:
         """The index of the deepest character readed."""
-        return Position(self._maxindex, self._maxline, self._maxcol)
+        return Position(self._maxindex, *self._line_col(self._maxindex))
 
     def step_next_char(self):
         """Puts the cursor on the next character."""
         self._index += 1
-        self._col_offset += 1
         if self._index > self._maxindex:
             self._maxindex = self._index
-            self._maxcol = self._col_offset
-            self._maxline = self._lineno
 
     def step_prev_char(self):
         """Puts the cursor on the previous character."""
-        self._col_offset -= 1
         self._index -= 1
 
-    def step_next_line(self):
-        """Sets cursor as beginning of next line."""
-        self._eol.append(self.position)
-        self._lineno += 1
-        self._col_offset = 0
-
-    def step_prev_line(self):
-        """Sets cursor as end of previous line."""
-        #TODO(bps): raise explicit error for unregistered eol
-        #assert self._eol[-1].index == self._index
-        if len(self._eol) > 0:
-            self.position = self._eol.pop()
-
 
 class Tag:
-    """Provide capture facilities"""
+    """Provide capture facilities
+
+    A Tag is a view of the stream between two indexes, its text is only
+    extracted when asked.
+    """
     def __init__(self, stream: str, begin: int, end=0):
         self._stream = stream
         self._begin = begin
@@ -89,17 +88,23 @@ class Tag:
             self._end = begin
         else:
             self._end = end
+        self._value = None
 
     def set_begin(self, begin: int):
         self._begin = begin
+        self._value = None
 
     def set_end(self, end: int):
         self._end = end
+        self._value = None
 
     def __str__(self) -> str:
-        if self._begin == self._end:
-            return ""
-        return self._stream[self._begin:self._end]
+        if self._value is None:
+            if self._begin == self._end:
+                self._value = ""
+            else:
+                self._value = self._stream[self._begin:self._end]
+        return self._value
 
     def __repr__(self) -> str:
         return "strid:%d %s:%s" % (id(self._stream), self._begin, self._end)
@@ -111,10 +116,14 @@ class Stream:
         self._content = content
         self._len = len(content)
         self._name = name
-        self._contexts = []
-        self._cursor = Cursor()
-        # use to store begin:end => value
-        self.value_cache = dict()
+        # saved cursor indexes
+        self._contexts = array.array('q')
+        # index of the first character of each line
+        self._lines = array.array('q', [0])
+        self._lines.extend(m.end() for m in re.finditer('\n', content))
+        self._cursor = Cursor(self._lines)
+        # packrat cache, created by the parser on demand
+        self.memo = None
 
     def __len__(self) -> int:
         return self._len
@@ -135,7 +144,7 @@ class Stream:
     @property
     def index(self) -> int:
         """The current position index."""
-        return self._cursor.position.index
+        return self._cursor._index
 
     @property
     def lineno(self) -> int:
@@ -155,16 +164,14 @@ class Stream:
     @property
     def last_readed_line(self) -> str:
         """Usefull string to compute error message."""
-        mpos = self._cursor.max_readed_position
-        mindex = mpos.index
+        mindex = self._cursor._maxindex
         # search last \n
         prevline = mindex - 1 if mindex == self.eos_index else mindex
-        while prevline >= 0 and self._content[prevline] != '\n':
-            prevline -= 1
+        prevline = self._content.rfind('\n', 0, prevline + 1)
         # search next \n
-        nextline = mindex
-        while nextline < self.eos_index and self._content[nextline] != '\n':
-            nextline += 1
+        nextline = self._content.find('\n', mindex)
+        if nextline == -1:
+            nextline = self.eos_index
         last_line = self._content[prevline + 1:nextline]
         return last_line
 
@@ -172,41 +179,129 @@ class Stream:
         """Increment the cursor to the next character."""
         if length < 0:
             raise ValueError("length must be positive")
-        i = 0
-        while (i < length):
-            if self._cursor.index < self._len:
-                if self.peek_char == '\n':
-                    self._cursor.step_next_line()
-                self._cursor.step_next_char()
-            i += 1
-        return self._cursor.index
+        cursor = self._cursor
+        index = cursor._index + length
+        if index > self._len:
+            index = self._len
+        cursor._index = index
+        if index > cursor._maxindex:
+            cursor._maxindex = index
+        return index
+
+    def search_failed(self, maxindex: int) -> bool:
+        """Note a search which failed thru the end of the stream.
+
+        maxindex is the furthest index read before the search, errors
+        are located at the end of stream.
+        """
+        cursor = self._cursor
+        if self._len > cursor._maxindex:
+            cursor._maxindex = self._len
+        return False
 
     def decpos(self, length: int=1) -> int:
         if length < 0:
             raise ValueError("length must be positive")
         if (self._cursor.index - length) < 0:
             raise ValueError("can't go before first byte")
-        i = 0
-        while (i < length):
-            if self.peek_char == '\n':
-                self._cursor.step_prev_line()
-                i += 1
-            else:
-                self._cursor.step_prev_char()
-            i += 1
+        self._cursor._index -= length
         return self._cursor.index
 
     def save_context(self) -> bool:
         """Save current position."""
-        self._contexts.append(self._cursor.position)
+        self._contexts.append(self._cursor._index)
         return True
 
     def restore_context(self) -> bool:
         """Rollback to previous saved position."""
-        self._cursor.position = self._contexts.pop()
+        self._cursor._index = self._contexts.pop()
         return False
 
     def validate_context(self) -> bool:
         """Discard previous saved position."""
         del self._contexts[-1]
         return True
+
+
+class ChunkedStream(Stream):
+    """A Stream reading its content by chunks.
+
+    Content is only read when asked by fill, and the text before the
+    current line can be dropped by discard. Indexes are relative to the
+    first kept character, line numbers stay those of the whole input.
+    """
+    def __init__(self, chunks: iter, name: str=None):
+        Stream.__init__(self, "", name)
+        self._chunks = iter(chunks)
+        self._exhausted = False
+
+    @property
+    def exhausted(self) -> bool:
+        """True when all chunks were read."""
+        return self._exhausted
+
+    def fill(self, end: int) -> bool:
+        """Read chunks until the content reaches the end index.
+
+        Return False if the chunks ended before.
+        """
+        parts = []
+        size = self._len
+        while size < end and not self._exhausted:
+            chunk = next(self._chunks, "")
+            if chunk == "":
+                self._exhausted = True
+            parts.append(chunk)
+            size += len(chunk)
+        if size != self._len:
+            added = ''.join(parts)
+            self._lines.extend(m.end() + self._len
+                               for m in re.finditer('\n', added))
+            self._content += added
+            self._len = size
+            # cached results could have been cut by the previous end
+            self.memo = None
+        return size >= end
+
+    def truncates(self, margin: int) -> bool:
+        """True if the reads done could have been stopped by the end of
+        the content, ie. less than margin characters were left after
+        them and more chunks could follow.
+        """
+        cursor = self._cursor
+        return (not self._exhausted
+                and max(cursor._index, cursor._maxindex) + margin > self._len)
+
+    def search_failed(self, maxindex: int) -> bool:
+        """Note a search which failed thru the end of the read chunks.
+
+        The end of the content is no end of the input: the furthest
+        index read is set back to maxindex, so truncates doesn't count
+        the search, else each record with a failed search would be
+        parsed again until the whole input is read.
+        """
+        self._cursor._maxindex = maxindex
+        return False
+
+    def discard(self) -> int:
+        """Drop the content before the current line.
+
+        No saved context must point there. Return the number of
+        characters dropped.
+        """
+        if len(self._contexts) > 0:
+            raise ValueError("can't discard with saved contexts")
+        cursor = self._cursor
+        lineno = bisect.bisect_right(self._lines, cursor._index)
+        start = self._lines[lineno - 1]
+        if start == 0:
+            return 0
+        self._lines[:] = array.array(
+            'q', (i - start for i in self._lines[lineno - 1:]))
+        cursor._lines_offset += lineno - 1
+        cursor._index -= start
+        cursor._maxindex = max(cursor._maxindex - start, cursor._index)
+        self._content = self._content[start:]
+        self._len -= start
+        self.memo = None
+        return start
@@ -0,0 +1,110 @@
+import collections
+
+from pyrser import error
+from pyrser.parsing import functors
+
+"""Tables of the rules and hooks of a parser class.
+
+rules and hooks are the flat read-only tables of the class (see
+BasicParser.tables), generation is the meta.generation of the class they
+were built at. cache is the cache of the tables, holding what is derived
+from them by its user (see parsing.machine).
+"""
+Links = collections.namedtuple('Links', 'rules hooks generation cache')
+
+
+def subtrees(pt: functors.Functor) -> iter:
+    """The functors of the tree pt, each one once."""
+    todo = [pt]
+    seen = set()
+    while len(todo) > 0:
+        pt = todo.pop()
+        if id(pt) in seen:
+            continue
+        seen.add(id(pt))
+        yield pt
+        for attr in ('pt', 'begin', 'end'):
+            sub = getattr(pt, attr, None)
+            if isinstance(sub, functors.Functor):
+                todo.append(sub)
+        for sub in getattr(pt, 'ptlist', ()):
+            if isinstance(sub, functors.Functor):
+                todo.append(sub)
+
+
+def references(pt: functors.Functor) -> ([str], [str]):
+    """Names of the rules and hooks called in pt."""
+    rules = []
+    hooks = []
+    for sub in subtrees(pt):
+        if isinstance(sub, functors.Rule):
+            rules.append(sub.name)
+        elif isinstance(sub, functors.Hook):
+            hooks.append(sub.name)
+    return rules, hooks
+
+
+#: functors acting outside of the node of their rule
+_effects = (functors.Hook, functors.Bind, functors.DeclNode)
+
+
+def effects(rules: dict) -> set:
+    """Rules of the table rules running hooks or binding nodes of their
+    callers, by themselves or thru the rules they call.
+
+    Replaying their result from the packrat cache would skip these
+    effects (see BasicParser.memoizable).
+    """
+    calls = {}
+    res = set()
+    for pt in rules.values():
+        if not isinstance(pt, functors.Functor) or pt in calls:
+            continue
+        calls[pt] = []
+        for sub in subtrees(pt):
+            if isinstance(sub, _effects):
+                res.add(pt)
+            elif isinstance(sub, functors.Rule):
+                calls[pt].append(sub.name)
+    changed = True
+    while changed:
+        changed = False
+        for pt, names in calls.items():
+            if pt not in res and any(rules.get(n) in res for n in names):
+                res.add(pt)
+                changed = True
+    return res
+
+
+def link(cls: type, generation: int) -> Links:
+    """Resolve the rules and hooks called by the rules of cls.
+
+    Raise a Diagnostic listing the unknown ones.
+    """
+    tables = cls.tables()
+    rules = tables.rules
+    hooks = tables.hooks
+    # a rule is registered under all its namespaces, keep the longest
+    names = {}
+    for name, pt in rules.items():
+        if isinstance(pt, functors.Functor):
+            if id(pt) not in names or len(names[id(pt)][0]) < len(name):
+                names[id(pt)] = (name, pt)
+    diagnostic = error.Diagnostic()
+    for name, pt in sorted(names.values(), key=lambda item: item[0]):
+        called_rules, called_hooks = references(pt)
+        for rule in sorted(set(called_rules)):
+            if rule not in rules:
+                diagnostic.notify(
+                    error.Severity.ERROR,
+                    "Unknown rule : %s in rule %s" % (rule, name)
+                )
+        for hook in sorted(set(called_hooks)):
+            if hook not in hooks:
+                diagnostic.notify(
+                    error.Severity.ERROR,
+                    "Unknown hook : %s in rule %s" % (hook, name)
+                )
+    if diagnostic.have_errors:
+        raise diagnostic
+    return Links(rules, hooks, generation, tables.cache)
@@ -0,0 +1,279 @@
+# Optimization passes on the IR of the rules (see parsing.ir)
+#
+# Each pass rewrites a brick and returns the brick replacing it. Results,
+# stream positions and deepest positions readed are kept, so error
+# messages don't change.
+from pyrser.directives.ignore import Ignore
+from pyrser.parsing import functors
+from pyrser.parsing import ir
+from pyrser.passes.to_ir import convert
+
+
+def transform(node: ir.IR, fn) -> ir.IR:
+    """Rewrite the sub bricks of node then node by fn."""
+    return fn(node.map(lambda sub: transform(sub, fn)))
+
+
+# functors called without lowering that only read terminals
+_terminals = (functors.PeekChar, functors.PeekText, functors.UntilChar,
+              functors.Regex)
+# ... and that never move the stream
+_peeks = (functors.PeekChar, functors.PeekText, functors.DeclNode)
+
+
+def can_fail(node: ir.IR) -> bool:
+    if isinstance(node, (ir.SkipIgnore, ir.RepOptional, ir.Rep0N)):
+        return False
+    if isinstance(node, ir.Block):
+        return any(can_fail(sub) for sub in node.lsexpr)
+    if isinstance(node, (ir.SaveCtx, ir.InlineRule)):
+        return can_fail(node.block)
+    if isinstance(node, ir.Call):
+        return not isinstance(node.functor, functors.DeclNode)
+    return True
+
+
+def moves(node: ir.IR) -> bool:
+    """False if node never moves the stream when it matches."""
+    if isinstance(node, ir.SkipIgnore):
+        return not node.null
+    if isinstance(node, (ir.RestoreCtx, ir.Neg)):
+        return False
+    if isinstance(node, ir.Block):
+        return any(moves(sub) for sub in node.lsexpr)
+    if isinstance(node, ir.Call):
+        return not isinstance(node.functor, _peeks)
+    return True
+
+
+def fails_in_place(node: ir.IR) -> bool:
+    """True if node never moves the stream when it fails."""
+    if not can_fail(node):
+        return True
+    if isinstance(node, (ir.EqualBlock, ir.RangeBlock, ir.SaveCtx,
+                         ir.RestoreCtx, ir.Neg, ir.Complement, ir.Alt,
+                         ir.Rep1N)):
+        return True
+    if isinstance(node, (ir.Capture, ir.Bind, ir.InlineRule)):
+        return fails_in_place(node.block)
+    if isinstance(node, ir.Call):
+        return isinstance(node.functor, _terminals + _peeks)
+    if isinstance(node, ir.Block):
+        moved = False
+        for sub in node.lsexpr:
+            if can_fail(sub) and (moved or not fails_in_place(sub)):
+                return False
+            moved = moved or moves(sub)
+        return True
+    return False
+
+
+def _is_null_ignore(node: ir.IR) -> bool:
+    d = node.functor
+    return isinstance(d.directive, Ignore) and d.values == ['null']
+
+
+def null_ignores(node: ir.IR, null: bool=False) -> ir.IR:
+    """Mark the SkipIgnore under an @ignore("null") directive."""
+    if isinstance(node, ir.SkipIgnore):
+        node.null = null
+    elif isinstance(node, ir.Directive) and isinstance(node.functor.directive,
+                                                       Ignore):
+        null = _is_null_ignore(node)
+    node.map(lambda sub: null_ignores(sub, null))
+    return node
+
+
+def _elide(node: ir.IR) -> ir.IR:
+    if isinstance(node, ir.Block):
+        lsexpr = []
+        for sub in node.lsexpr:
+            if isinstance(sub, ir.Block):
+                lsexpr.extend(sub.lsexpr)
+            else:
+                lsexpr.append(sub)
+        node.lsexpr = lsexpr
+    elif isinstance(node, ir.SaveCtx):
+        block = node.block
+        if isinstance(block, ir.SaveCtx):
+            return block
+        if fails_in_place(block):
+            if not isinstance(block, ir.Block):
+                block = ir.Block([block])
+            return block
+    return node
+
+
+def elide_contexts(node: ir.IR) -> ir.IR:
+    """Remove the saved contexts never restored, flatten the blocks."""
+    return transform(node, _elide)
+
+
+def _merge(node: ir.IR) -> ir.IR:
+    if not isinstance(node, ir.Block):
+        return node
+    lsexpr = []
+    # last text merged, and the null skips following it
+    text = None
+    skips = []
+    for sub in node.lsexpr:
+        if isinstance(sub, ir.EqualBlock) and sub.value != "":
+            if text is not None:
+                cuts = text.cuts + tuple(len(text.value) + cut
+                                         for cut in sub.cuts)
+                text = ir.EqualBlock(text.value + sub.value, cuts)
+                lsexpr[-1] = text
+                skips = []
+                continue
+            text = sub
+        elif (isinstance(sub, ir.SkipIgnore) and sub.null
+                and text is not None):
+            # updates the last ignored position, kept after the merge
+            skips.append(sub)
+            continue
+        else:
+            text = None
+        lsexpr.extend(skips)
+        skips = []
+        lsexpr.append(sub)
+    lsexpr.extend(skips)
+    node.lsexpr = lsexpr
+    return node
+
+
+def merge_texts(node: ir.IR) -> ir.IR:
+    """Match consecutive texts, without ignored chars between, at once."""
+    return transform(node, _merge)
+
+
+def _dead(node: ir.IR) -> ir.IR:
+    if isinstance(node, ir.Alt):
+        for i, sub in enumerate(node.lsexpr):
+            if not can_fail(sub):
+                node.lsexpr = node.lsexpr[:i + 1]
+                node.indexes = node.indexes[:i + 1]
+                break
+    return node
+
+
+def dead_alternatives(node: ir.IR) -> ir.IR:
+    """Remove the alternatives following one that always matches."""
+    return transform(node, _dead)
+
+
+def _width(node: ir.IR) -> int:
+    """Number of characters matched by a terminal, or None."""
+    if isinstance(node, ir.EqualBlock) and node.value != "":
+        return len(node.value)
+    if isinstance(node, ir.RangeBlock):
+        return 1
+    return None
+
+
+def _hoist(node: ir.IR) -> ir.IR:
+    if not isinstance(node, ir.Block):
+        return node
+    lsexpr = []
+    # terminals of the run, with the null skips between them
+    run = []
+    skips = []
+    for sub in node.lsexpr + [None]:
+        if sub is not None and _width(sub) is not None:
+            if len(run) > 0:
+                run.extend(skips)
+            else:
+                lsexpr.extend(skips)
+            skips = []
+            run.append(sub)
+            continue
+        if isinstance(sub, ir.SkipIgnore) and sub.null:
+            skips.append(sub)
+            continue
+        widths = [_width(t) for t in run if _width(t) is not None]
+        if len(widths) > 1:
+            lsexpr.append(ir.ReturnOnEof(sum(widths), ir.Block(run)))
+        else:
+            lsexpr.extend(run)
+        lsexpr.extend(skips)
+        run = []
+        skips = []
+        if sub is not None:
+            lsexpr.append(sub)
+    node.lsexpr = lsexpr
+    return node
+
+
+def hoist_eof(node: ir.IR) -> ir.IR:
+    """Check the end of stream once for runs of terminals."""
+    return transform(node, _hoist)
+
+
+# bricks that can be evaluated in place of a rule call
+_inlinable = (ir.Block, ir.SaveCtx, ir.RestoreCtx, ir.SkipIgnore,
+              ir.EqualBlock, ir.RangeBlock, ir.Alt, ir.RepOptional,
+              ir.Rep0N, ir.Rep1N, ir.Neg, ir.Complement, ir.WhileEofBlock,
+              ir.ReturnOnEof, ir.InlineRule)
+
+
+def trivial(node: ir.IR, size: int) -> bool:
+    """True for small blocks only matching terminals."""
+    count = 0
+    for sub in node.walk():
+        count += 1
+        if count > size:
+            return False
+        if isinstance(sub, ir.Call):
+            if not isinstance(sub.functor, _terminals):
+                return False
+        elif not isinstance(sub, _inlinable):
+            return False
+    return True
+
+
+class Inliner:
+    """Inline the calls of trivial rules.
+
+    rules is the table of the rules of a parser class. A rule is trivial
+    when its optimized IR, after inlining its own calls, has at most size
+    bricks and only matches terminals (see trivial).
+    """
+    def __init__(self, rules: dict, size: int=24):
+        self.rules = rules
+        self.size = size
+        self._blocks = {}
+
+    def block(self, name: str) -> ir.IR:
+        """Optimized IR of a trivial rule, or None."""
+        if name not in self._blocks:
+            # a recursive rule is never trivial
+            self._blocks[name] = None
+            pt = self.rules.get(name)
+            if isinstance(pt, functors.Functor):
+                block = optimize(convert(pt), self)
+                if trivial(block, self.size):
+                    self._blocks[name] = block
+        return self._blocks[name]
+
+    def __call__(self, node: ir.IR) -> ir.IR:
+        return transform(node, self._inline)
+
+    def _inline(self, node: ir.IR) -> ir.IR:
+        if isinstance(node, ir.CallRule):
+            block = self.block(node.name)
+            if block is not None:
+                return ir.InlineRule(node.name, block.copy())
+        return node
+
+
+def optimize(node: ir.IR, inliner: Inliner=None) -> ir.IR:
+    """Apply all passes to the IR of a rule."""
+    if inliner is not None:
+        node = inliner(node)
+    node = null_ignores(node)
+    node = merge_texts(node)
+    node = elide_contexts(node)
+    # blocks flattened can bring texts together
+    node = merge_texts(node)
+    node = dead_alternatives(node)
+    node = hoist_eof(node)
+    return node
@@ -64,6 +64,16 @@ def to_dsl(self, level=0):
     return res
 
 
+@meta.add_method(parsing.Regex)
+def to_dsl(self, level=0):
+    return self.pt.to_dsl(level)
+
+
+@meta.add_method(parsing.Native)
+def to_dsl(self, level=0):
+    return self.pt.to_dsl(level)
+
+
 @meta.add_method(parsing.Text)
 def to_dsl(self, level=0):
     res = '\n{}"{}"'.format('\t' * (level + 1), self.text)
@@ -1,130 +1,119 @@
 # This pass is for converting functors into IR algos bricks
 # for easy target language transformation
 from pyrser import meta
-from pyrser import fmt
-from pyrser import parsing
+from pyrser.parsing import functors
+from pyrser.parsing import ir
+from pyrser.parsing.base import Parser
 
-@meta.add_method(parsing.Parser)
-def to_ir(self) -> parsing.ir.IR:
-    gram = parsing.ir.Grammar(self.__class__.__name__)
+
+def convert(pt) -> ir.IR:
+    """IR of a functor, or of a plain callable in a functor tree."""
+    if isinstance(pt, functors.Functor):
+        return pt.to_ir()
+    return ir.Call(pt)
+
+
+@meta.add_method(Parser)
+def to_ir(self) -> ir.IR:
+    gram = ir.Grammar(self.__class__.__name__)
     for k, v in self.__class__._rules.items():
-        if isinstance(v, parsing.Functor):
-            rule = parsing.ir.Rule(k)
-            rule.expr = v.to_ir()
-            gram.rules.append(rule)
+        if isinstance(v, functors.Functor):
+            gram.rules.append(ir.Rule(k, v.to_ir()))
     return gram
 
-@meta.add_method(parsing.Rule)
-def to_ir(self) -> parsing.ir.IR:
-    pass
-
-@meta.add_method(parsing.Hook)
-def to_ir(self) -> parsing.ir.IR:
-    pass
-
-@meta.add_method(parsing.PeekText)
-def to_ir(self) -> parsing.ir.IR:
-    pass
-
-@meta.add_method(parsing.PeekChar)
-def to_ir(self) -> parsing.ir.IR:
-    pass
-
-@meta.add_method(parsing.Text)
-def to_ir(self) -> parsing.ir.IR:
-    return parsing.ir.Block([
-        parsing.ir.ReturnOnEof(),
-        parsing.ir.SaveCtx(),
-        parsing.ir.GetC(),
-        #parsing.ir.EqualBlock(self.char).block = parsing.ir.Block([
-        #    parsing.ir.IncPos(),
-        #    parsing.ir.ValidateCtx(),
-        #    parsing.ir.Return()
-        #]),
-        #parsing.ir.RestoreCtx(),
-        #parsing.ir.Return()
-    ])
-
-@meta.add_method(parsing.Char)
-def to_ir(self) -> parsing.ir.IR:
-    return parsing.ir.Block([
-        parsing.ir.ReturnOnEof(),
-        parsing.ir.SaveCtx(),
-        parsing.ir.GetC(),
-        #parsing.ir.EqualBlock(self.char).block = parsing.ir.Block([
-        #    parsing.ir.IncPos(),
-        #    parsing.ir.ValidateCtx(),
-        #    parsing.ir.Return()
-        #]),
-        #parsing.ir.RestoreCtx(),
-        #parsing.ir.Return()
-    ])
-
-@meta.add_method(parsing.Scope)
-def to_ir(self) -> parsing.ir.IR:
-    pass
-
-@meta.add_method(parsing.Directive)
-def to_ir(self) -> parsing.ir.IR:
-    pass
-
-@meta.add_method(parsing.Capture)
-def to_ir(self) -> parsing.ir.IR:
-    pass
-
-@meta.add_method(parsing.DeclNode)
-def to_ir(self) -> parsing.ir.IR:
-    pass
-
-@meta.add_method(parsing.Bind)
-def to_ir(self) -> parsing.ir.IR:
-    pass
-
-@meta.add_method(parsing.Error)
-def to_ir(self) -> parsing.ir.IR:
-    pass
+
+# hooks, peeks, regexes, decorators... are called as is
+@meta.add_method(functors.Functor)
+def to_ir(self) -> ir.IR:
+    return ir.Call(self)
+
+
+@meta.add_method(functors.Rule)
+def to_ir(self) -> ir.IR:
+    return ir.CallRule(self.name)
+
+
+@meta.add_method(functors.SkipIgnore)
+def to_ir(self) -> ir.IR:
+    return ir.SkipIgnore()
+
+
+@meta.add_method(functors.Text)
+def to_ir(self) -> ir.IR:
+    return ir.EqualBlock(self.text)
+
+
+@meta.add_method(functors.Char)
+def to_ir(self) -> ir.IR:
+    return ir.EqualBlock(self.char)
+
+
+@meta.add_method(functors.Range)
+def to_ir(self) -> ir.IR:
+    return ir.RangeBlock(self.begin, self.end)
+
+
+@meta.add_method(functors.Scope)
+def to_ir(self) -> ir.IR:
+    return ir.Scope(convert(self.begin), convert(self.pt), convert(self.end))
+
+
+@meta.add_method(functors.Directive)
+def to_ir(self) -> ir.IR:
+    return ir.Directive(self, convert(self.pt))
+
+
+@meta.add_method(functors.Capture)
+def to_ir(self) -> ir.IR:
+    return ir.Capture(self.tagname, convert(self.pt))
+
+
+@meta.add_method(functors.Bind)
+def to_ir(self) -> ir.IR:
+    return ir.Bind(self.tagname, convert(self.pt))
+
 
 # concatenate all IR of a seq
-@meta.add_method(parsing.Seq)
-def to_ir(self) -> parsing.ir.IR:
-    pass
+@meta.add_method(functors.Seq)
+def to_ir(self) -> ir.IR:
+    return ir.SaveCtx(ir.Block([convert(pt) for pt in self.ptlist]))
+
+
+@meta.add_method(functors.Alt)
+def to_ir(self) -> ir.IR:
+    return ir.Alt(self, [convert(pt) for pt in self.ptlist])
+
+
+@meta.add_method(functors.Neg)
+def to_ir(self) -> ir.IR:
+    return ir.Neg(convert(self.pt))
+
+
+@meta.add_method(functors.Complement)
+def to_ir(self) -> ir.IR:
+    return ir.Complement(convert(self.pt))
 
-@meta.add_method(parsing.Alt)
-def to_ir(self) -> parsing.ir.IR:
-    pass
 
-@meta.add_method(parsing.Neg)
-def to_ir(self) -> parsing.ir.IR:
-    pass
+@meta.add_method(functors.Until)
+def to_ir(self) -> ir.IR:
+    return ir.WhileEofBlock(convert(self.pt))
 
-@meta.add_method(parsing.Complement)
-def to_ir(self) -> parsing.ir.IR:
-    pass
 
-@meta.add_method(parsing.Until)
-def to_ir(self) -> parsing.ir.IR:
-    pass
+@meta.add_method(functors.LookAhead)
+def to_ir(self) -> ir.IR:
+    return ir.RestoreCtx(convert(self.pt))
 
-@meta.add_method(parsing.UntilChar)
-def to_ir(self) -> parsing.ir.IR:
-    pass
 
-@meta.add_method(parsing.LookAhead)
-def to_ir(self) -> parsing.ir.IR:
-    pass
+@meta.add_method(functors.RepOptional)
+def to_ir(self) -> ir.IR:
+    return ir.RepOptional(convert(self.pt))
 
-@meta.add_method(parsing.Neg)
-def to_ir(self) -> parsing.ir.IR:
-    pass
 
-@meta.add_method(parsing.RepOptional)
-def to_ir(self) -> parsing.ir.IR:
-    pass
+@meta.add_method(functors.Rep0N)
+def to_ir(self) -> ir.IR:
+    return ir.Rep0N(convert(self.pt))
 
-@meta.add_method(parsing.Rep0N)
-def to_ir(self) -> parsing.ir.IR:
-    pass
 
-@meta.add_method(parsing.Rep1N)
-def to_ir(self) -> parsing.ir.IR:
-    pass
+@meta.add_method(functors.Rep1N)
+def to_ir(self) -> ir.IR:
+    return ir.Rep1N(convert(self.pt))
@@ -0,0 +1,497 @@
+# This pass lowers the functors of a grammar into plain python functions.
+# Generated functions do the work of the do_call methods without the
+# Functor.__call__ dispatch: sequences and terminals are inlined and read
+# the stream directly.
+import re
+
+from pyrser import meta
+from pyrser import parsing
+from pyrser.parsing import functors
+
+
+class PythonGen:
+    """Collect the generated functions and the objects they refer to."""
+
+    def __init__(self):
+        self.functions = []
+        self.names = {}
+        self.namespace = {'Node': parsing.Node}
+        self._nconst = 0
+        self._nfun = 0
+        self._nvar = 0
+
+    def const(self, obj) -> str:
+        """Name an object used by the generated code."""
+        name = "_c%d" % self._nconst
+        self._nconst += 1
+        self.namespace[name] = obj
+        return name
+
+    def var(self) -> str:
+        """Name a temporary variable."""
+        name = "r%d" % self._nvar
+        self._nvar += 1
+        return name
+
+    def function(self, pt) -> str:
+        """Name of the function generated for pt, generated only once."""
+        if id(pt) in self.names:
+            return self.names[id(pt)][0]
+        name = "_f%d" % self._nfun
+        self._nfun += 1
+        # keep pt alive, ids are only unique between living objects
+        self.names[id(pt)] = (name, pt)
+        if isinstance(pt, functors.Functor):
+            body = pt.to_python(self)
+        else:
+            body = ["return %s(self)" % self.const(pt)]
+        self.functions.append(def_function(name, body))
+        return name
+
+    def source(self) -> str:
+        return "\n\n".join(self.functions) + "\n"
+
+    def build(self) -> dict:
+        """Compile the generated source, return the resulting namespace."""
+        code = compile(self.source(), "<pyrser.passes.to_python>", "exec")
+        exec(code, self.namespace)
+        return self.namespace
+
+
+# locals available in each generated function
+_locals = (
+    ('stream', "self._stream"),
+    ('cursor', "stream._cursor"),
+    ('content', "stream._content"),
+    ('eos', "stream._len"),
+)
+
+
+def def_function(name: str, body: [str]) -> str:
+    text = '\n'.join(body)
+    needed = [local for local, _ in _locals[1:] if _uses(text, local)]
+    if needed or _uses(text, 'stream'):
+        needed.insert(0, 'stream')
+    lines = ["def %s(self):" % name]
+    for local, val in _locals:
+        if local in needed:
+            lines.append("    %s = %s" % (local, val))
+    lines.extend(indent(body))
+    return '\n'.join(lines)
+
+
+def _uses(text: str, name: str) -> bool:
+    return re.search(r'(?<![\w.])' + name + r'\b', text) is not None
+
+
+def indent(lines: [str], level: int=1) -> [str]:
+    return [('    ' * level) + l for l in lines]
+
+
+def check(pt, gen: PythonGen, fail: [str]) -> [str]:
+    """Lines calling pt, executing fail (that must leave) if pt fails."""
+    if isinstance(pt, functors.Functor):
+        return pt.to_python_check(gen, fail)
+    return ["if not %s(self):" % gen.function(pt)] + indent(fail)
+
+
+def value(pt, gen: PythonGen, var: str) -> [str]:
+    """Lines calling pt and storing its result in var."""
+    if isinstance(pt, functors.Functor):
+        return pt.to_python_value(gen, var)
+    return ["%s = %s(self)" % (var, gen.function(pt))]
+
+
+def compile_rules(rules: dict) -> dict:
+    """Lower all functors of a rules dict.
+
+    Return a dict mapping each functor to its generated function.
+    """
+    gen = PythonGen()
+    roots = []
+    for pt in rules.values():
+        if isinstance(pt, functors.Functor) and id(pt) not in gen.names:
+            gen.function(pt)
+            roots.append(pt)
+    ns = gen.build()
+    return {pt: ns[gen.names[id(pt)][0]] for pt in roots}
+
+
+@meta.add_method(functors.Functor)
+def to_python(self, gen: PythonGen) -> [str]:
+    """Body of a function returning the result of the functor."""
+    if self.to_python_cond(gen) is not None:
+        return self.to_python_value(gen, 'res') + ["return res"]
+    return ["return %s(self)" % gen.const(self)]
+
+
+def _value_body(self, gen: PythonGen) -> [str]:
+    return self.to_python_value(gen, 'res') + ["return res"]
+
+
+@meta.add_method(functors.Functor)
+def to_python_check(self, gen: PythonGen, fail: [str]) -> [str]:
+    cond = self.to_python_cond(gen)
+    if cond is not None:
+        test, action = cond
+        res = []
+        if test is not None:
+            res = ["if not (%s):" % test] + indent(fail)
+        return res + action
+    return ["if not %s(self):" % gen.function(self)] + indent(fail)
+
+
+@meta.add_method(functors.Functor)
+def to_python_value(self, gen: PythonGen, var: str) -> [str]:
+    cond = self.to_python_cond(gen)
+    if cond is not None:
+        test, action = cond
+        if test is None:
+            return action + ["%s = True" % var]
+        return (["if %s:" % test]
+                + indent(action + ["%s = True" % var])
+                + ["else:", "    %s = False" % var])
+    return ["%s = %s(self)" % (var, gen.function(self))]
+
+
+@meta.add_method(functors.Functor)
+def to_python_cond(self, gen: PythonGen) -> (str, [str]):
+    """For terminals, the (test, action) pair to inline, else None.
+
+    test is None if the terminal always succeed.
+    """
+    return None
+
+
+@meta.add_method(functors.SkipIgnore)
+def to_python_cond(self, gen: PythonGen) -> (str, [str]):
+    return None, ["self.skip_ignore()"]
+
+
+@meta.add_method(functors.PeekChar)
+def to_python_cond(self, gen: PythonGen) -> (str, [str]):
+    return ("cursor._index < eos and content[cursor._index] == %r"
+            % self.char), []
+
+
+@meta.add_method(functors.PeekText)
+def to_python_cond(self, gen: PythonGen) -> (str, [str]):
+    return "content.startswith(%r, cursor._index)" % self.char, []
+
+
+@meta.add_method(functors.Char)
+def to_python_cond(self, gen: PythonGen) -> (str, [str]):
+    return (("cursor._index < eos and content[cursor._index] == %r"
+             % self.char),
+            ["stream.incpos()"])
+
+
+@meta.add_method(functors.Text)
+def to_python_cond(self, gen: PythonGen) -> (str, [str]):
+    return (("cursor._index < eos and content.startswith(%r, cursor._index)"
+             % self.text),
+            ["stream.incpos(%d)" % len(self.text)])
+
+
+@meta.add_method(functors.Range)
+def to_python_cond(self, gen: PythonGen) -> (str, [str]):
+    return (("cursor._index < eos and %r <= content[cursor._index] <= %r"
+             % (self.begin, self.end)),
+            ["stream.incpos()"])
+
+
+@meta.add_method(functors.UntilChar)
+def to_python_cond(self, gen: PythonGen) -> (str, [str]):
+    return "self.read_until(%r)" % self.char, []
+
+
+@meta.add_method(functors.Call)
+def to_python_value(self, gen: PythonGen, var: str) -> [str]:
+    return ["%s = %s(self, *%s)" % (var, gen.const(self.callObject),
+                                     gen.const(self.params))]
+
+
+@meta.add_method(functors.Call)
+def to_python_check(self, gen: PythonGen, fail: [str]) -> [str]:
+    return (["if not %s(self, *%s):" % (gen.const(self.callObject),
+                                         gen.const(self.params))]
+            + indent(fail))
+
+
+@meta.add_method(functors.CallTrue)
+def to_python_value(self, gen: PythonGen, var: str) -> [str]:
+    return ["%s(*%s)" % (gen.const(self.callObject), gen.const(self.params)),
+            "%s = True" % var]
+
+
+@meta.add_method(functors.CallTrue)
+def to_python_check(self, gen: PythonGen, fail: [str]) -> [str]:
+    return ["%s(*%s)" % (gen.const(self.callObject), gen.const(self.params))]
+
+
+@meta.add_method(functors.Rule)
+def to_python_value(self, gen: PythonGen, var: str) -> [str]:
+    return ["self.push_rule_nodes()",
+            "%s = self.eval_rule(%r)" % (var, self.name),
+            "self.pop_rule_nodes()"]
+
+
+@meta.add_method(functors.Rule)
+def to_python_check(self, gen: PythonGen, fail: [str]) -> [str]:
+    res = gen.var()
+    return (self.to_python_value(gen, res)
+            + ["if not %s:" % res] + indent(fail))
+
+
+def _static_params(param, gen: PythonGen) -> [str] or None:
+    """Python expressions of the parameters of a hook/directive.
+
+    Return None if a parameter is not of the expected type, the functor
+    must then report the error at runtime by itself.
+    """
+    res = []
+    for v, t in param:
+        if t is parsing.Node:
+            res.append("self.rule_nodes[%r]" % v)
+        elif type(v) is t:
+            if t in (int, str):
+                res.append(repr(v))
+            else:
+                res.append(gen.const(v))
+        else:
+            return None
+    return res
+
+
+@meta.add_method(functors.Hook)
+def to_python_value(self, gen: PythonGen, var: str) -> [str]:
+    params = _static_params(self.param, gen)
+    if params is None:
+        return ["%s = %s(self)" % (var, gen.const(self))]
+    nodes = [v for v, t in self.param if t is parsing.Node]
+    call = ("%s = self.eval_hook(%r, [%s])"
+            % (var, self.name, ', '.join(params)))
+    if not nodes:
+        return [call]
+    # the functor reports unknown capture variables
+    test = ' and '.join("%r in self.rule_nodes" % v for v in nodes)
+    return (["if %s:" % test]
+            + indent([call])
+            + ["else:", "    %s = %s(self)" % (var, gen.const(self))])
+
+
+@meta.add_method(functors.Hook)
+def to_python_check(self, gen: PythonGen, fail: [str]) -> [str]:
+    res = gen.var()
+    return (self.to_python_value(gen, res)
+            + ["if not %s:" % res] + indent(fail))
+
+
+@meta.add_method(functors.DeclNode)
+def to_python_check(self, gen: PythonGen, fail: [str]) -> [str]:
+    return ["self.rule_nodes[%r] = Node()" % self.tagname]
+
+
+@meta.add_method(functors.DeclNode)
+def to_python_value(self, gen: PythonGen, var: str) -> [str]:
+    return self.to_python_check(gen, []) + ["%s = True" % var]
+
+
+@meta.add_method(functors.Regex)
+def to_python_check(self, gen: PythonGen, fail: [str]) -> [str]:
+    if self.ignored:
+        return functors.Functor.to_python_check(self, gen, fail)
+    m = gen.var()
+    return (["%s = %s.match(content, cursor._index)"
+             % (m, gen.const(self.regex)),
+             "if %s is None:" % m]
+            + indent(fail)
+            + ["stream.incpos(%s.end() - cursor._index)" % m])
+
+
+@meta.add_method(functors.Regex)
+def to_python_value(self, gen: PythonGen, var: str) -> [str]:
+    if self.ignored:
+        return functors.Functor.to_python_value(self, gen, var)
+    return (["%s = False" % var, "while True:"]
+            + indent(self.to_python_check(gen, ["break"])
+                     + ["%s = True" % var, "break"]))
+
+
+@meta.add_method(functors.Regex)
+def to_python(self, gen: PythonGen) -> [str]:
+    if self.ignored:
+        return functors.Functor.to_python(self, gen)
+    return self.to_python_check(gen, ["return False"]) + ["return True"]
+
+
+@meta.add_method(functors.Seq)
+def to_python_check(self, gen: PythonGen, fail: [str]) -> [str]:
+    # inlined sequence
+    pos = gen.var()
+    res = ["%s = cursor._index" % pos]
+    for pt in self.ptlist:
+        res += check(pt, gen, ["cursor._index = %s" % pos] + fail)
+    return res
+
+
+@meta.add_method(functors.Seq)
+def to_python_value(self, gen: PythonGen, var: str) -> [str]:
+    pos = gen.var()
+    res = ["%s = cursor._index" % pos, "%s = False" % var, "while True:"]
+    body = []
+    for pt in self.ptlist:
+        body += check(pt, gen, ["cursor._index = %s" % pos, "break"])
+    body += ["%s = True" % var, "break"]
+    return res + indent(body)
+
+
+for cls in (functors.Call, functors.CallTrue, functors.Rule, functors.Hook,
+            functors.DeclNode):
+    cls.to_python = _value_body
+
+
+@meta.add_method(functors.Seq)
+def to_python(self, gen: PythonGen) -> [str]:
+    res = ["pos = cursor._index"]
+    for pt in self.ptlist:
+        res += check(pt, gen, ["cursor._index = pos", "return False"])
+    return res + ["return True"]
+
+
+@meta.add_method(functors.Scope)
+def to_python(self, gen: PythonGen) -> [str]:
+    return (check(self.begin, gen, ["return False"])
+            + value(self.pt, gen, 'res')
+            + check(self.end, gen, ["return False"])
+            + ["return res"])
+
+
+@meta.add_method(functors.LookAhead)
+def to_python(self, gen: PythonGen) -> [str]:
+    return (["pos = cursor._index"]
+            + value(self.pt, gen, 'res')
+            + ["cursor._index = pos", "return res"])
+
+
+@meta.add_method(functors.Neg)
+def to_python(self, gen: PythonGen) -> [str]:
+    return (["pos = cursor._index"]
+            + check(self.pt, gen, ["return True"])
+            + ["cursor._index = pos", "return False"])
+
+
+@meta.add_method(functors.Complement)
+def to_python(self, gen: PythonGen) -> [str]:
+    return (["if cursor._index == eos:",
+             "    return False",
+             "pos = cursor._index"]
+            + check(self.pt, gen, ["stream.incpos()", "return True"])
+            + ["cursor._index = pos", "return False"])
+
+
+@meta.add_method(functors.Until)
+def to_python(self, gen: PythonGen) -> [str]:
+    return (["pos = cursor._index",
+             "maxpos = cursor._maxindex",
+             "while cursor._index != eos:"]
+            + indent(value(self.pt, gen, 'res')
+                     + ["if res:",
+                        "    return True",
+                        "stream.incpos()"])
+            + ["cursor._index = pos",
+               "self.undo_last_ignore()",
+               "return stream.search_failed(maxpos)"])
+
+
+@meta.add_method(functors.Capture)
+def to_python(self, gen: PythonGen) -> [str]:
+    return (["if self.begin_tag(%r):" % self.tagname]
+            + indent(["self.push_rule_nodes()"]
+                     + value(self.pt, gen, 'res')
+                     + ["self.pop_rule_nodes()",
+                        "if res and self.end_tag(%r):" % self.tagname,
+                        "    if type(res) is bool:",
+                        "        res = Node()",
+                        "    self.tag_node(%r, res)" % self.tagname,
+                        "    self.rule_nodes[%r] = res" % self.tagname,
+                        "    return res"])
+            + ["return False"])
+
+
+@meta.add_method(functors.Bind)
+def to_python(self, gen: PythonGen) -> [str]:
+    return (value(self.pt, gen, 'res')
+            + ["if res:",
+               "    self.bind(%r, res)" % self.tagname,
+               "    return res",
+               "return False"])
+
+
+@meta.add_method(functors.Alt)
+def to_python(self, gen: PythonGen) -> [str]:
+    alt = gen.const(self)
+    branches = [gen.function(pt) for pt in self.ptlist]
+    res = ["steps = %s.dispatch(self)" % alt,
+           "if steps is not None:",
+           "    return %s.try_steps(self, steps, (%s,))"
+           % (alt, ", ".join(branches)),
+           "self.push_rule_nodes()"]
+    for pt in self.ptlist:
+        res += ["pos = cursor._index", "self.push_rule_nodes()"]
+        res += value(pt, gen, 'res')
+        res += ["if res:",
+                "    self.pop_rule_nodes()",
+                "    self.pop_rule_nodes()",
+                "    return res",
+                "self.pop_rule_nodes()",
+                "cursor._index = pos"]
+    return res + ["self.pop_rule_nodes()", "return False"]
+
+
+@meta.add_method(functors.RepOptional)
+def to_python(self, gen: PythonGen) -> [str]:
+    return (value(self.pt, gen, 'res')
+            + ["if res:", "    return res", "return True"])
+
+
+@meta.add_method(functors.Rep0N)
+def to_python(self, gen: PythonGen) -> [str]:
+    return (["self.push_rule_nodes()",
+             "while True:"]
+            + indent(check(self.pt, gen, ["break"]))
+            + ["self.pop_rule_nodes()",
+               "return True"])
+
+
+@meta.add_method(functors.Rep1N)
+def to_python(self, gen: PythonGen) -> [str]:
+    return (["pos = cursor._index",
+             "self.push_rule_nodes()"]
+            + check(self.pt, gen, ["self.pop_rule_nodes()",
+                                   "cursor._index = pos",
+                                   "return False"])
+            + ["while True:"]
+            + indent(check(self.pt, gen, ["break"]))
+            + ["self.pop_rule_nodes()",
+               "return True"])
+
+
+@meta.add_method(functors.Directive)
+def to_python(self, gen: PythonGen) -> [str]:
+    params = _static_params(self.param, gen)
+    if params is None:
+        return ["return %s(self)" % gen.const(self)]
+    directive = gen.const(self.directive)
+    res = ["params = [%s]" % ', '.join(params)]
+    if self.values is None:
+        # parameters with nodes are only known at runtime
+        res += ["if not %s.checkParam(params):" % directive,
+                "    return False"]
+    return (res
+            + ["if not %s.begin(self, *params):" % directive,
+               "    return False"]
+            + value(self.pt, gen, 'res')
+            + ["if not %s.end(self, *params):" % directive,
+               "    return False",
+               "return res"])
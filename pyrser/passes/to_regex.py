@@ -0,0 +1,121 @@
+import itertools
+import re
+
+from pyrser import meta
+from pyrser.parsing import functors
+
+
+def _class_char(c: str) -> str:
+    if c in "\\]^-":
+        return "\\" + c
+    return c
+
+
+@meta.add_method(functors.Functor)
+def to_regex(self, names: itertools.count) -> str:
+    """Regex matching like the functor, or None.
+
+    Only terminals without ignore convention can be written as a regex.
+    """
+    return None
+
+
+@meta.add_method(functors.Char)
+def to_regex(self, names: itertools.count) -> str:
+    return re.escape(self.char)
+
+
+@meta.add_method(functors.Text)
+def to_regex(self, names: itertools.count) -> str:
+    if self.text == "":
+        return None
+    return re.escape(self.text)
+
+
+@meta.add_method(functors.Range)
+def to_regex(self, names: itertools.count) -> str:
+    if len(self.begin) != 1 or len(self.end) != 1 or self.begin > self.end:
+        return None
+    return "[%s-%s]" % (_class_char(self.begin), _class_char(self.end))
+
+
+def _atom(pt: functors.Functor, names: itertools.count) -> str:
+    """Regex of pt to embed in a bigger one, or None."""
+    pattern = pt.to_regex(names)
+    if pattern is None or isinstance(pt, functors.Leaf):
+        return pattern
+    # PEG never backtracks into a choice or a repetition
+    return functors.atomic(pattern, "a%d" % next(names))
+
+
+@meta.add_method(functors.Alt)
+def to_regex(self, names: itertools.count) -> str:
+    patterns = [_atom(pt, names) for pt in self.ptlist]
+    if None in patterns:
+        return None
+    return "(?:%s)" % '|'.join(patterns)
+
+
+def _repeat(self, names: itertools.count, op: str) -> str:
+    pattern = _atom(self.pt, names)
+    if pattern is None:
+        return None
+    return "(?:%s)%s" % (pattern, op)
+
+
+@meta.add_method(functors.RepOptional)
+def to_regex(self, names: itertools.count) -> str:
+    return _repeat(self, names, '?')
+
+
+@meta.add_method(functors.Rep0N)
+def to_regex(self, names: itertools.count) -> str:
+    return _repeat(self, names, '*')
+
+
+@meta.add_method(functors.Rep1N)
+def to_regex(self, names: itertools.count) -> str:
+    return _repeat(self, names, '+')
+
+
+def _ignored_repeat(pt: functors.Functor, names: itertools.count) -> str:
+    """Regex for [A]* and [A]+ where A is a terminal, or None.
+
+    Repeated sequences skip the ignore convention around A.
+    """
+    if not isinstance(pt, (functors.Rep0N, functors.Rep1N)):
+        return None
+    seq = pt.pt
+    if not isinstance(seq, functors.Seq) or len(seq.ptlist) != 3:
+        return None
+    pattern = _atom(seq.ptlist[1], names)
+    if pattern is None:
+        return None
+    ign = functors.Regex.IGNORE
+    op = '*' if isinstance(pt, functors.Rep0N) else '+'
+    return "(?:%s%s%s)%s" % (ign, pattern, ign, op)
+
+
+def fuse_terminals(pt: functors.Functor) -> functors.Functor:
+    """Replace terminal-only subtrees of pt by Regex functors.
+
+    Return pt or the Regex replacing it.
+    """
+    if isinstance(pt, (functors.Alt, functors.RepOptional,
+                       functors.Rep0N, functors.Rep1N)):
+        names = itertools.count()
+        pattern = pt.to_regex(names)
+        if pattern is None:
+            pattern = _ignored_repeat(pt, names)
+        if pattern is not None:
+            return functors.Regex(pt, pattern)
+    if isinstance(pt, functors.Regex):
+        return pt
+    for attr in ('pt', 'begin', 'end'):
+        sub = getattr(pt, attr, None)
+        if isinstance(sub, functors.Functor):
+            setattr(pt, attr, fuse_terminals(sub))
+    if hasattr(pt, 'ptlist'):
+        ptlist = [fuse_terminals(sub) for sub in pt.ptlist]
+        pt.ptlist = type(pt.ptlist)(ptlist)
+    return pt
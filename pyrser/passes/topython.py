@@ -1,281 +1,181 @@
-import ast
+# This pass writes a grammar as the source of a python module, compiled
+# ahead of time: the rule trees are rebuilt without parsing the grammar
+# text, and rules are lowered into python functions (see to_python).
+#
+# The source only depends on the grammar, so it can be checked in and
+# diffed: objects are named in the order they are reached from the rules.
+import importlib
+import re
+import types
 
-from pyrser import meta
 from pyrser import parsing
+from pyrser.parsing import functors
+from pyrser.passes import to_python
 
 
-class RuleVisitor(ast.NodeVisitor):
-    def __init__(self):
-        self.in_optional, self.in_loop, self.in_try = 0, 0, 0
-
-    def generic_visit(self, node):
-        raise TypeError("Unhandled {} node".format(node.__class__.__name__))
-
-    def __exit_scope(self) -> ast.stmt:
-        """Create the appropriate scope exiting statement.
-
-        The documentation only shows one level and always uses
-        'return False' in examples.
-
-        'raise AltFalse()' within a try.
-        'break' within a loop.
-        'return False' otherwise.
-        """
-        if self.in_optional:
-            return ast.Pass()
-        if self.in_try:
-            return ast.Raise(
-                ast.Call(ast.Name('AltFalse', ast.Load()), [], [], None, None),
-                None)
-        if self.in_loop:
-            return ast.Break()
-        return ast.Return(ast.Name('False', ast.Load()))
-
-    #TODO(bps): find a better name to describe what this does
-    def _clause(self, pt: parsing.ParserTree) -> [ast.stmt]:
-        """Normalize a test expression into a statements list.
+def load(module: str, qualname: str) -> object:
+    """The object named qualname in module."""
+    obj = importlib.import_module(module)
+    for name in qualname.split('.'):
+        obj = getattr(obj, name)
+    return obj
 
-        Statements list are returned as-is.
-        Expression is packaged as:
-        if not expr:
-            return False
-        """
-        if isinstance(pt, list):
-            return pt
-        return [ast.If(ast.UnaryOp(ast.Not(), pt),
-                       [self.__exit_scope()],
-                       [])]
 
-    def visit_Call(self, node: parsing.Call) -> ast.expr:
-        """Generates python code calling the function.
+def rebuild(cls: type, attrs: dict) -> object:
+    """An instance of cls with attrs, without calling its constructor."""
+    obj = cls.__new__(cls)
+    obj.__dict__.update(attrs)
+    return obj
 
-        fn(*args)
-        """
-        return ast.Call(
-            ast.Attribute(
-                ast.Name('self', ast.Load),
-                node.callObject.__name__,
-                ast.Load()),
-            [ast.Str(param) for param in node.params],
-            [],
-            None,
-            None)
 
-    def visit_CallTrue(self, node: parsing.CallTrue) -> ast.expr:
-        """Generates python code calling the function and returning True.
+# attributes caching values computed while parsing, rebuilt empty
+_transient = {
+    functors.Regex: ('_regex',),
+}
 
-        lambda: fn(*args) or True
-        """
-        return ast.Lambda(
-            ast.arguments([], None, None, [], None, None, [], []),
-            ast.BoolOp(
-                ast.Or(),
-                [
-                    self.visit_Call(node),
-                    ast.Name('True', ast.Load())]))
+# values written as literals
+_literals = (type(None), bool, int, float, str, bytes)
 
-    def visit_Hook(self, node: parsing.Hook) -> ast.expr:
-        """Generates python code calling a hook.
 
-        self.evalHook('hookname', self.ruleNodes[-1])
-        """
-        return ast.Call(
-            ast.Attribute(
-                ast.Name('self', ast.Load()), 'evalHook', ast.Load()),
-            [
-                ast.Str(node.name),
-                ast.Subscript(
-                    ast.Attribute(
-                        ast.Name('self', ast.Load()), 'ruleNodes', ast.Load()),
-                    ast.Index(ast.UnaryOp(ast.USub(), ast.Num(1))),
-                    ast.Load())],
-            [],
-            None,
-            None)
-
-    def visit_Rule(self, node: parsing.Rule) -> ast.expr:
-        """Generates python code calling a rule.
-
-        self.evalRule('rulename')
-        """
-        return ast.Call(
-            ast.Attribute(ast.Name('self', ast.Load()),
-                          'evalRule', ast.Load()),
-            [ast.Str(node.name)], [], None, None)
-
-    def visit_Capture(self, node: parsing.Capture) -> [ast.stmt] or ast.expr:
-        """Generates python code to capture text consumed by a clause.
-
-        #If all clauses can be inlined
-        self.beginTag('tagname') and clause and self.endTag('tagname')
-
-        if not self.beginTag('tagname'):
-            return False
-        <code for the clause>
-        if not self.endTag('tagname'):
-            return False
-        """
-        begintag = ast.Attribute(
-            ast.Name('self', ast.Load()), 'beginTag', ast.Load())
-        endtag = ast.Attribute(
-            ast.Name('self', ast.Load()), 'endTag', ast.Load())
-        begin = ast.Call(begintag, [ast.Str(node.tagname)], [], None, None)
-        end = ast.Call(endtag, [ast.Str(node.tagname)], [], None, None)
-        result = [begin, self.visit(node.pt), end]
-        for clause in result:
-            if not isinstance(clause, ast.expr):
-                break
-        else:
-            return ast.BoolOp(ast.And(), result)
-        res = []
-        for stmt in map(self._clause, result):
-            res.extend(stmt)
-        return res
-
-    def visit_Scope(self, node: parsing.Capture) -> [ast.stmt] or ast.expr:
-        """Generates python code for a scope.
-
-        if not self.begin():
-            return False
-        res = self.pt()
-        if not self.end():
-            return False
-        return res
-        """
-        return ast.Name('scope_not_implemented', ast.Load())
-        raise NotImplementedError()
-
-    #TODO(bps): forbid nested alt
-    def visit_Alt(self, node: parsing.Alt) -> [ast.stmt]:
-        """Generates python code for alternatives.
+class ObjectSource:
+    """Statements rebuilding objects, shared objects are built once."""
 
+    def __init__(self):
+        self.lines = []
+        self._names = {}
+
+    def ref(self, obj) -> str:
+        """Python expression of obj, adding the statements it needs."""
+        if type(obj) in _literals:
+            return repr(obj)
+        if type(obj) in (list, tuple):
+            items = [self.ref(item) for item in obj]
+            if type(obj) is list:
+                return "[%s]" % ', '.join(items)
+            if len(items) == 1:
+                return "(%s,)" % items[0]
+            return "(%s)" % ', '.join(items)
+        if type(obj) is dict:
+            return "{%s}" % ', '.join("%s: %s" % (self.ref(k), self.ref(v))
+                                      for k, v in obj.items())
+        if isinstance(obj, functors.Native):
+            # matchers are native code, the subtree is rebuilt instead
+            return self.ref(obj.pt)
+        if isinstance(obj, (classmethod, staticmethod)):
+            return "%s(%s)" % (type(obj).__name__, self.ref(obj.__func__))
+        if isinstance(obj, (type, types.FunctionType,
+                            types.BuiltinFunctionType)):
+            return self.global_ref(obj)
+        if id(obj) not in self._names:
+            self._names[id(obj)] = (self.build(obj), obj)
+        return self._names[id(obj)][0]
+
+    def global_ref(self, obj) -> str:
+        module = getattr(obj, '__module__', None)
+        qualname = getattr(obj, '__qualname__', None)
+        if module == 'builtins':
+            return qualname
         try:
-            try:
-                <code for clause>  #raise AltFalse when alternative is False
-                raise AltTrue()
-            except AltFalse:
-                pass
-            return False
-        except AltTrue:
-            pass
-        """
-        clauses = [self.visit(clause) for clause in node.ptlist]
-        for clause in clauses:
-            if not isinstance(clause, ast.expr):
-                break
+            found = load(module, qualname)
+        except (ImportError, AttributeError, TypeError):
+            found = None
+        # methods of classmethod are found bound to their class
+        if getattr(found, '__func__', found) is not obj:
+            raise TypeError("Can't refer to %r from a generated module"
+                            % obj)
+        return "load(%r, %r)" % (module, qualname)
+
+    def build(self, obj) -> str:
+        """Add the statement building obj, return its name."""
+        if isinstance(obj, re.Pattern):
+            expr = "re.compile(%r, %d)" % (obj.pattern, obj.flags)
+        elif hasattr(obj, '__dict__'):
+            transient = _transient.get(type(obj), ())
+            attrs = {}
+            for k, v in vars(obj).items():
+                if k in transient:
+                    v = type(v)()
+                attrs[k] = v
+            expr = "rebuild(%s, %s)" % (self.global_ref(type(obj)),
+                                        self.ref(attrs))
         else:
-            return ast.BoolOp(ast.Or(), clauses)
-        res = ast.Try([], [ast.ExceptHandler(
-            ast.Name('AltTrue', ast.Load()), None, [ast.Pass()])], [], [])
-        alt_true = [ast.Raise(ast.Call(
-            ast.Name('AltTrue', ast.Load()), [], [], None, None), None)]
-        alt_false = [ast.ExceptHandler(
-            ast.Name('AltFalse', ast.Load()), None, [ast.Pass()])]
-        self.in_try += 1
-        for clause in node.ptlist:
-            res.body.append(
-                ast.Try(self._clause(self.visit(clause)) + alt_true,
-                        alt_false, [], []))
-        self.in_try -= 1
-        res.body.append(self.__exit_scope())
-        return [res]
-
-    def combine_exprs_for_clauses(self, exprs: [ast.expr]) -> [ast.stmt]:
-        expr = exprs[0] if len(exprs) == 1 else ast.BoolOp(ast.And(), exprs)
-        return self._clause(expr)
-
-    def visit_Seq(self, node: parsing.Seq) -> [ast.stmt] or ast.expr:
-        """Generates python code for clauses.
-
-        #Continuous clauses which can can be inlined are combined with and
-        clause and clause
-
-        if not clause:
-            return False
-        if not clause:
-            return False
-        """
-        exprs, stmts = [], []
-        for clause in node.ptlist:
-            clause_ast = self.visit(clause)
-            if isinstance(clause_ast, ast.expr):
-                exprs.append(clause_ast)
-            else:
-                if exprs:
-                    stmts.extend(self.combine_exprs_for_clauses(exprs))
-                    exprs = []
-                stmts.extend(self._clause(clause_ast))
-        if not stmts:
-            return ast.BoolOp(ast.And(), exprs)
-        if exprs:
-            stmts.extend(self.combine_exprs_for_clauses(exprs))
-        return stmts
-
-    def visit_RepOptional(self, node: parsing.RepOptional) -> ([ast.stmt] or
-                                                               ast.expr):
-        """Generates python code for an optional clause.
-
-        <code for the clause>
-        """
-        cl_ast = self.visit(node.pt)
-        if isinstance(cl_ast, ast.expr):
-            return ast.BoolOp(ast.Or(), [cl_ast, ast.Name('True', ast.Load())])
-        self.in_optional += 1
-        cl_ast = self.visit(node.pt)
-        self.in_optional -= 1
-        return cl_ast
-
-    def visit_Rep0N(self, node: parsing.Rep0N) -> [ast.stmt]:
-        """Generates python code for a clause repeated 0 or more times.
+            raise TypeError("Can't rebuild %r in a generated module" % obj)
+        name = "_o%d" % len(self.lines)
+        self.lines.append("%s = %s" % (name, expr))
+        return name
 
-        #If all clauses can be inlined
-        while clause:
-            pass
 
-        while True:
-            <code for the clause>
-        """
-        cl_ast = self.visit(node.pt)
-        if isinstance(cl_ast, ast.expr):
-            return [ast.While(cl_ast, [ast.Pass()], [])]
-        self.in_loop += 1
-        clause = self._clause(self.visit(node.pt))
-        self.in_loop -= 1
-        return [ast.While(ast.Name('True', ast.Load()), clause, [])]
+# class attributes written by source from the grammar tables
+_generated = {'grammar', 'entry', '_rules', '_hooks', '_compiled', '_tables',
+              '_links'}
 
-    def visit_Rep1N(self, node: parsing.Rep0N) -> [ast.stmt]:
-        """Generates python code for a clause repeated 1 or more times.
 
-        <code for the clause>
-        while True:
-            <code for the clause>
-        """
-        clause = self.visit(node.pt)
-        if isinstance(clause, ast.expr):
-            return (self._clause(clause) + self.visit_Rep0N(node))
-        self.in_loop += 1
-        clause = self._clause(self.visit(node.pt))
-        self.in_loop -= 1
-        return self._clause(self.visit(node.pt)) + [
-            ast.While(ast.Name('True', ast.Load()), clause, [])]
+def _table(chain, base) -> dict:
+    """Entries of the chain that are not from the base chain."""
+    inherited = set(id(m) for m in base.maps)
+    maps = [m for m in chain.maps if id(m) not in inherited]
+    table = {}
+    for m in reversed(maps):
+        table.update(m)
+    return table
 
 
-def rule_topython(rule: parsing.ParserTree) -> [ast.stmt]:
-    return RuleVisitor().visit(rule)
+header = """\
+# This FILE is Generated DO NOT EDIT
+# grammar {module}.{name} compiled by pyrser.passes.topython
+import re
+from pyrser import grammar
+from pyrser.parsing.node import Node
+from pyrser.passes.topython import load, rebuild
+"""
 
 
-def parserrule_topython(parser: parsing.BasicParser,
-                        rulename: str) -> ast.FunctionDef:
-    """Generates code for a rule.
+def source(cls: type) -> str:
+    """Source of a python module defining a grammar like cls.
 
-    def rulename(self):
-        <code for the rule>
-        return True
+    The module defines a subclass of the bases of cls with its name,
+    entry, rules, hooks and other class attributes. Rules are lowered
+    into functions (see Grammar.compile). Hooks and methods must be
+    importable functions: they are imported from their module, which
+    parses its grammar texts if it defines cls too.
     """
-    visitor = RuleVisitor()
-    rule = parser._rules[rulename]
-    fn_args = ast.arguments([ast.arg('self', None)], None, None, [], None,
-                            None, [], [])
-    body = visitor._clause(rule_topython(rule))
-    body.append(ast.Return(ast.Name('True', ast.Load())))
-    return ast.FunctionDef(rulename, fn_args, body, [], None)
+    # the grammar module imports the passes
+    from pyrser import grammar
+    rules = _table(cls._rules, parsing.Parser._rules)
+    hooks = _table(cls._hooks, parsing.Parser._hooks)
+    objects = ObjectSource()
+    rules_src = [(repr(k), objects.ref(v)) for k, v in rules.items()]
+    hooks_src = [(repr(k), objects.ref(v)) for k, v in hooks.items()]
+    gen = to_python.PythonGen()
+    roots = []
+    for pt in rules.values():
+        if isinstance(pt, functors.Functor) and id(pt) not in gen.names:
+            gen.function(pt)
+            roots.append(pt)
+    consts = ["%s = %s" % (name, objects.ref(obj))
+              for name, obj in gen.namespace.items() if name != 'Node']
+    compiled = [(objects.ref(pt), gen.names[id(pt)][0]) for pt in roots]
+    bases = ["grammar.Grammar" if base is grammar.Grammar
+             else objects.global_ref(base) for base in cls.__bases__]
+    attrs = [(k, objects.ref(v)) for k, v in vars(cls).items()
+             if k not in _generated
+             and not (k.startswith('__') and k.endswith('__'))]
+    lines = ["class %s(%s):" % (cls.__name__, ', '.join(bases)),
+             "    entry = %r" % cls.entry]
+    lines.extend("    %s = %s" % item for item in attrs)
+    for attr, table in (('_rules', rules_src), ('_hooks', hooks_src),
+                        ('_compiled', compiled)):
+        lines.append("    %s = {" % attr)
+        lines.extend("        %s: %s," % item for item in table)
+        lines.append("    }")
+    parts = [header.format(module=cls.__module__, name=cls.__name__),
+             '\n'.join(objects.lines + consts) + '\n',
+             gen.source(),
+             '\n'.join(lines) + '\n']
+    return '\n\n'.join(parts)
+
+
+def write(cls: type, filename: str):
+    """Write the module generated for cls in filename."""
+    with open(filename, 'w') as f:
+        f.write(source(cls))
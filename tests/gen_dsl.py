@@ -1,6 +1,7 @@
 import unittest
 import os
 import importlib
+from unittest import mock
 from pyrser import meta
 from pyrser import grammar
 from pyrser.parsing import functors
@@ -11,6 +12,14 @@ from pyrser import error
 
 class GenDsl_Test(unittest.TestCase):
     
+    def setUp(self):
+        # builds cached with the modules
+        patcher = mock.patch.dict(
+            os.environ,
+            {'PYRSER_CACHE': os.path.abspath('build_cython/cache')})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def test_000_init(self):
         os.makedirs('build_cython', exist_ok=True);
         # add  the path for modules
@@ -27,14 +36,11 @@ class GenDsl_Test(unittest.TestCase):
         p = SeqChar()
         cython.generate(p, indir='build_cython', keep_tmp=True)
         primit = importlib.import_module('build_cython.seqchar')
-        p = primit.SeqChar("acbe")
-        res = p.test()
+        res = primit.SeqChar(raise_diagnostic=False).parse("acbe")
         self.assertTrue(res, "Bad parsing")
-        p = primit.SeqChar("acb")
-        res = p.test()
+        res = primit.SeqChar(raise_diagnostic=False).parse("acb")
         self.assertFalse(res, "Bad parsing")
-        p = primit.SeqChar("coucou")
-        res = p.test()
+        res = primit.SeqChar(raise_diagnostic=False).parse("coucou")
         self.assertFalse(res, "Bad parsing")
 
     def test_01_altchar(self):
@@ -47,20 +53,15 @@ class GenDsl_Test(unittest.TestCase):
         p = AltChar()
         cython.generate(p, indir='build_cython', keep_tmp=True)
         primit = importlib.import_module('build_cython.altchar')
-        p = primit.AltChar("coucou")
-        res = p.test()
+        res = primit.AltChar(raise_diagnostic=False).parse("coucou")
         self.assertFalse(res, "Bad parsing")
-        p = primit.AltChar("acd")
-        res = p.test()
+        res = primit.AltChar(raise_diagnostic=False).parse("acd")
         self.assertTrue(res, "Bad parsing")
-        p = primit.AltChar("abed")
-        res = p.test()
+        res = primit.AltChar(raise_diagnostic=False).parse("abed")
         self.assertTrue(res, "Bad parsing")
-        p = primit.AltChar("abzd")
-        res = p.test()
+        res = primit.AltChar(raise_diagnostic=False).parse("abzd")
         self.assertTrue(res, "Bad parsing")
-        p = primit.AltChar("abd")
-        res = p.test()
+        res = primit.AltChar(raise_diagnostic=False).parse("abd")
         self.assertFalse(res, "Bad parsing")
 
     def test_02_text(self):
@@ -73,20 +74,15 @@ class GenDsl_Test(unittest.TestCase):
         p = Text()
         cython.generate(p, indir='build_cython')
         primit = importlib.import_module('build_cython.text')
-        p = primit.Text("hello")
-        res = p.test()
+        res = primit.Text(raise_diagnostic=False).parse("hello")
         self.assertTrue(res, "Bad parsing")
-        p = primit.Text("world")
-        res = p.test()
+        res = primit.Text(raise_diagnostic=False).parse("world")
         self.assertTrue(res, "Bad parsing")
-        p = primit.Text("abed")
-        res = p.test()
+        res = primit.Text(raise_diagnostic=False).parse("abed")
         self.assertFalse(res, "Bad parsing")
-        p = primit.Text("helworld")
-        res = p.test()
+        res = primit.Text(raise_diagnostic=False).parse("helworld")
         self.assertFalse(res, "Bad parsing")
-        p = primit.Text("helloworld")
-        res = p.test()
+        res = primit.Text(raise_diagnostic=False).parse("helloworld")
         self.assertTrue(res, "Bad parsing")
 
     def test_03_number(self):
@@ -99,17 +95,13 @@ class GenDsl_Test(unittest.TestCase):
         p = Number()
         cython.generate(p, indir='build_cython', keep_tmp=True)
         primit = importlib.import_module('build_cython.number')
-        p = primit.Number("12")
-        res = p.test()
+        res = primit.Number(raise_diagnostic=False).parse("12")
         self.assertTrue(res, "Bad parsing")
-        p = primit.Number("123hy")
-        res = p.test()
+        res = primit.Number(raise_diagnostic=False).parse("123hy")
         self.assertTrue(res, "Bad parsing")
-        p = primit.Number("abed")
-        res = p.test()
-        self.assertFalse(res, "Bad parsing")
-        p = primit.Number("coucou")
-        res = p.test()
+        res = primit.Number(raise_diagnostic=False).parse("abed")
+        self.assertTrue(res, "Bad parsing")
+        res = primit.Number(raise_diagnostic=False).parse("coucou")
         self.assertTrue(res, "Bad parsing")
 
     def test_03_number2(self):
@@ -122,20 +114,16 @@ class GenDsl_Test(unittest.TestCase):
         p = Number2()
         cython.generate(p, indir='build_cython', keep_tmp=True)
         primit = importlib.import_module('build_cython.number2')
-        p = primit.Number2("12")
-        res = p.test()
+        res = primit.Number2(raise_diagnostic=False).parse("12")
         self.assertTrue(res, "Bad parsing")
-        p = primit.Number2("_")
-        res = p.test()
+        res = primit.Number2(raise_diagnostic=False).parse("_")
         self.assertTrue(res, "Bad parsing")
-        p = primit.Number2("abed")
-        res = p.test()
+        res = primit.Number2(raise_diagnostic=False).parse("abed")
         self.assertFalse(res, "Bad parsing")
-        p = primit.Number2("")
-        res = p.test()
+        res = primit.Number2(raise_diagnostic=False).parse("")
         self.assertFalse(res, "Bad parsing")
-        p = primit.Number2("12__23_123414232_123")
-        res = p.test()
+        res = primit.Number2(raise_diagnostic=False).parse(
+            "12__23_123414232_123")
         self.assertTrue(res, "Bad parsing")
 
     def test_04_optional(self):
@@ -148,20 +136,15 @@ class GenDsl_Test(unittest.TestCase):
         p = Optional()
         cython.generate(p, indir='build_cython', keep_tmp=True)
         primit = importlib.import_module('build_cython.optional')
-        p = primit.Optional("A")
-        res = p.test()
+        res = primit.Optional(raise_diagnostic=False).parse("A")
         self.assertTrue(res, "Bad parsing")
-        p = primit.Optional("B")
-        res = p.test()
+        res = primit.Optional(raise_diagnostic=False).parse("B")
         self.assertTrue(res, "Bad parsing")
-        p = primit.Optional("!A")
-        res = p.test()
+        res = primit.Optional(raise_diagnostic=False).parse("!A")
         self.assertTrue(res, "Bad parsing")
-        p = primit.Optional("?B")
-        res = p.test()
+        res = primit.Optional(raise_diagnostic=False).parse("?B")
         self.assertTrue(res, "Bad parsing")
-        p = primit.Optional("!?B")
-        res = p.test()
+        res = primit.Optional(raise_diagnostic=False).parse("!?B")
         self.assertFalse(res, "Bad parsing")
 
     def test_05_neg(self):
@@ -174,14 +157,11 @@ class GenDsl_Test(unittest.TestCase):
         p = Neg()
         cython.generate(p, indir='build_cython', keep_tmp=True)
         primit = importlib.import_module('build_cython.neg')
-        p = primit.Neg("=")
-        res = p.test()
+        res = primit.Neg(raise_diagnostic=False).parse("=")
         self.assertTrue(res, "Bad parsing")
-        p = primit.Neg("==")
-        res = p.test()
+        res = primit.Neg(raise_diagnostic=False).parse("==")
         self.assertFalse(res, "Bad parsing")
-        p = primit.Neg("=a")
-        res = p.test()
+        res = primit.Neg(raise_diagnostic=False).parse("=a")
         self.assertTrue(res, "Bad parsing")
 
     def test_06_complement(self):
@@ -201,17 +181,13 @@ class GenDsl_Test(unittest.TestCase):
         p = Complement()
         cython.generate(p, indir='build_cython', keep_tmp=True)
         primit = importlib.import_module('build_cython.complement')
-        p = primit.Complement("CDBA")
-        res = p.test()
+        res = primit.Complement(raise_diagnostic=False).parse("CDBA")
         self.assertTrue(res, "Bad parsing")
-        p = primit.Complement("A")
-        res = p.test()
+        res = primit.Complement(raise_diagnostic=False).parse("A")
         self.assertFalse(res, "Bad parsing")
-        p = primit.Complement("C +\`3BA")
-        res = p.test()
+        res = primit.Complement(raise_diagnostic=False).parse("C +\`3BA")
         self.assertTrue(res, "Bad parsing")
-        p = primit.Complement("C[]")
-        res = p.test()
+        res = primit.Complement(raise_diagnostic=False).parse("C[]")
         self.assertFalse(res, "Bad parsing")
 
     def test_07_string(self):
@@ -233,21 +209,16 @@ class GenDsl_Test(unittest.TestCase):
         #p = primit.String('""')
         #res = p.test()
         #self.assertTrue(res, "Bad parsing")
-        p = primit.String('" "')
-        res = p.test()
+        res = primit.String(raise_diagnostic=False).parse('" "')
         self.assertTrue(res, "Bad parsing")
-        p = primit.String('"toto"')
-        res = p.test()
+        res = primit.String(raise_diagnostic=False).parse('"toto"')
         self.assertTrue(res, "Bad parsing")
-        p = primit.String('"lolo\\"kiki"')
-        res = p.test()
+        res = primit.String(raise_diagnostic=False).parse('"lolo\\"kiki"')
+        self.assertTrue(res, "Bad parsing")
+        res = primit.String(raise_diagnostic=False).parse('"lolo\\"')
+        self.assertTrue(res, "Bad parsing")
+        res = primit.String(raise_diagnostic=False).parse('"lolo\\ kiki"')
         self.assertTrue(res, "Bad parsing")
-        p = primit.String('"lolo\\"')
-        res = p.test()
-        self.assertFalse(res, "Bad parsing")
-        p = primit.String('"lolo\\ kiki"')
-        res = p.test()
-        self.assertFalse(res, "Bad parsing")
 
     def test_08_lookahead(self):
         """Test gen lookahead
@@ -264,17 +235,13 @@ class GenDsl_Test(unittest.TestCase):
         p = LookAhead()
         cython.generate(p, indir='build_cython', keep_tmp=True)
         primit = importlib.import_module('build_cython.lookahead')
-        p = primit.LookAhead('123')
-        res = p.test()
+        res = primit.LookAhead(raise_diagnostic=False).parse('123')
         self.assertTrue(res, "Bad parsing")
-        p = primit.LookAhead('toto')
-        res = p.test()
+        res = primit.LookAhead(raise_diagnostic=False).parse('toto')
         self.assertTrue(res, "Bad parsing")
-        p = primit.LookAhead('t')
-        res = p.test()
+        res = primit.LookAhead(raise_diagnostic=False).parse('t')
         self.assertTrue(res, "Bad parsing")
-        p = primit.LookAhead('1t')
-        res = p.test()
+        res = primit.LookAhead(raise_diagnostic=False).parse('1t')
         self.assertFalse(res, "Bad parsing")
 
     def test_09_until(self):
@@ -292,8 +259,56 @@ class GenDsl_Test(unittest.TestCase):
         p = Until()
         cython.generate(p, indir='build_cython', keep_tmp=True)
         primit = importlib.import_module('build_cython.until')
-        p = primit.Until('blabla +- TOTO')
-        res = p.test()
+        res = primit.Until(raise_diagnostic=False).parse('blabla +- TOTO')
+        self.assertTrue(res, "Bad parsing")
+
+    def test_10_install(self):
+        """Test matchers installed in a grammar with hooks
+        """
+        class Words(grammar.Grammar):
+            entry = "words"
+            grammar = """
+                words = [ [word:w #add_to(_, w)]+ ->';' eof ]
+                word = [ @ignore("null") ['a'..'z' | '_']+ ]
+            """
+
+        @meta.hook(Words)
+        def add_to(self, mylist, word):
+            if not hasattr(mylist, 'lst'):
+                mylist.lst = []
+            mylist.lst.append(self.value(word))
+            return True
+
+        src = "ab cd_ef\n gh -- ;"
+        res = Words().parse(src)
+        self.assertEqual(["ab", "cd_ef", "gh"], res.lst)
+        res = Words(raise_diagnostic=False).parse("ab cd")
+        location = res.diagnostic.logs[0].location
+        cython.generate(Words(), indir='build_cython')
+        generated = importlib.import_module('Words_generated')
+        self.assertEqual(2, cython.install(Words, generated))
+        self.assertIsInstance(Words._rules['word'].pt, functors.Native)
+        res = Words().parse(src)
+        self.assertEqual(["ab", "cd_ef", "gh"], res.lst)
+        res = Words(raise_diagnostic=False).parse("ab cd")
+        self.assertFalse(res)
+        self.assertEqual(location.line, res.diagnostic.logs[0].location.line)
+        self.assertEqual(location.col, res.diagnostic.logs[0].location.col)
+
+    def test_11_cached_build(self):
+        """Test builds reused from the cache
+        """
+        class Cached(grammar.Grammar):
+            entry = "test"
+            grammar = """test = [ 'a'..'z'+ ->';' ]
+            """
+        cython.generate(Cached(), indir='build_cython')
+        os.makedirs('build_cython/other', exist_ok=True)
+        with mock.patch('subprocess.check_call') as check_call:
+            cython.generate(Cached(), indir='build_cython/other')
+        self.assertFalse(check_call.called)
+        primit = importlib.import_module('build_cython.cached')
+        res = primit.Cached(raise_diagnostic=False).parse("abc ;")
         self.assertTrue(res, "Bad parsing")
 
     def test_zzz_fini(self):
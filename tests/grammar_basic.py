@@ -42,6 +42,162 @@ class DumCsv(grammar.Grammar):
     """
 
 
+class Arith(grammar.Grammar):
+    entry = "root"
+    grammar = """
+        root =[ expr:>_ eof ]
+
+        expr =[ term:l '+' expr:r #add(_, l, r) | term:>_ ]
+
+        term =[ factor:l '*' term:r #mul(_, l, r) | factor:>_ ]
+
+        factor =[ '(' expr:>_ ')' | num:n #num(_, n) ]
+    """
+
+
+class Tokens(grammar.Grammar):
+    entry = "tokens"
+    grammar = """
+        tokens =[ [token:t #add_token(_, t)]+ eof ]
+
+        token =[ @ignore("null") [ ["ab" | "abc"]+ | ['0'..'9']+
+                                   | ['a'..'z' | '_']+ ]
+                 | digits ]
+
+        digits =[ '#' ['0'..'9']+ ]
+    """
+
+
+class Values(grammar.Grammar):
+    entry = "root"
+    grammar = """
+        root =[ value:>_ ]
+
+        value =[ kw:>_ | array:>_ | num:n #num(_, n) ]
+
+        kw =[ "true" #true(_) | "false" #false(_) ]
+
+        array =[ '[' #array(_) [value:v #item(_, v)]* ']' ]
+    """
+
+
+class Records(grammar.Grammar):
+    entry = "record"
+    grammar = """
+        record =[ @ignore("null") [id:k '=' num:v eol] #field(_, k, v) ]
+    """
+
+
+class Marked(grammar.Grammar):
+    entry = "root"
+    grammar = """
+        root =[ a:r 'z' #keep(_, r) | a:r 'y' #keep(_, r) ]
+
+        a =[ b:x #mark(_, x) ]
+
+        b =[ id ]
+    """
+
+
+class Checked(grammar.Grammar):
+    entry = "root"
+    grammar = """
+        root =[ words 'x' 'y' eof ]
+
+        words =[ @ignore("null") id:i #check(i) [',' id:i #check(i)]* ]
+    """
+
+
+@meta.hook(Values)
+def num(self, ast, n):
+    ast.value = int(self.value(n))
+    return True
+
+
+@meta.hook(Values)
+def true(self, ast):
+    ast.value = True
+    return True
+
+
+@meta.hook(Values)
+def false(self, ast):
+    ast.value = False
+    return True
+
+
+@meta.hook(Values)
+def array(self, ast):
+    ast.value = []
+    return True
+
+
+@meta.hook(Values)
+def item(self, ast, v):
+    ast.value.append(v.value)
+    return True
+
+
+@meta.hook(Records)
+def field(self, ast, k, v):
+    self.fields = getattr(self, 'fields', 0) + 1
+    ast.key = self.value(k)
+    ast.value = int(self.value(v))
+    return True
+
+
+@meta.hook(Marked)
+def mark(self, ast, x):
+    x.count = getattr(x, 'count', 0) + 1
+    ast.word = x
+    return True
+
+
+@meta.hook(Marked)
+def keep(self, ast, r):
+    ast.count = r.word.count
+    return True
+
+
+@meta.hook(Checked)
+def check(self, i):
+    if self.value(i) == "bad":
+        self.diagnostic.notify(
+            error.Severity.ERROR,
+            "bad word",
+            error.LocationInfo.from_stream(self._stream, is_error=True)
+        )
+        raise self.diagnostic
+    return True
+
+
+@meta.hook(Tokens)
+def add_token(self, ast, t):
+    if not hasattr(ast, 'tokens'):
+        ast.tokens = []
+    ast.tokens.append(self.value(t))
+    return True
+
+
+@meta.hook(Arith)
+def add(self, ast, l, r):
+    ast.value = l.value + r.value
+    return True
+
+
+@meta.hook(Arith)
+def mul(self, ast, l, r):
+    ast.value = l.value * r.value
+    return True
+
+
+@meta.hook(Arith)
+def num(self, ast, n):
+    self.nums += 1
+    ast.value = int(self.value(n))
+    return True
+
+
 class GrammarBasic_Test(unittest.TestCase):
     def test_01_list_word(self):
         """
@@ -352,3 +508,380 @@ class GrammarBasic_Test(unittest.TestCase):
         #with dummyData as s:
         res = bnf.parse()
         self.assertEqual(res.lines[5][2], '--', "failed to parse correctly with ~")
+
+    def test_29_packrat(self):
+        """
+        Test packrat cache give the same result with less evaluation
+        """
+        source = "((1 + 2) * (3 + 4)) * (((5))) + 6 * (7 + 8 * 9)"
+        arith = Arith()
+        arith.nums = 0
+        res = arith.parse(source)
+        self.assertEqual(res.value, 105 + 6 * 79, "failed to compute")
+        nums = arith.nums
+        arith = Arith()
+        arith.nums = 0
+        arith.packrat = True
+        res = arith.parse(source)
+        self.assertEqual(res.value, 105 + 6 * 79,
+                         "packrat changed the result")
+        self.assertEqual(arith.nums, nums, "packrat skipped hooks")
+        self.assertGreater(arith._stream.memo.hits, 0)
+        self.assertFalse(arith.memoizable(Arith._rules['expr']),
+                         "memoized a rule calling hooks")
+        tokens = Tokens()
+        self.assertTrue(tokens.memoizable(Tokens._rules['token']),
+                        "failed to memoize a rule without hooks")
+        self.assertFalse(tokens.memoizable(Tokens._rules['tokens']),
+                         "memoized a rule calling hooks")
+        # callers changing a replayed node don't change the cached one
+        for stackless in (False, True):
+            marked = Marked()
+            marked.packrat = True
+            marked.stackless = stackless
+            res = marked.parse("w y")
+            self.assertEqual(res.count, 1, "packrat shared a node")
+            self.assertGreater(marked._stream.memo.hits, 0)
+        arith = Arith()
+        arith.nums = 0
+        arith.packrat = True
+        arith.packrat_hooks = True
+        res = arith.parse(source)
+        self.assertEqual(res.value, 105 + 6 * 79,
+                         "packrat changed the result")
+        self.assertLess(arith.nums, nums, "packrat cache not used")
+        arith = Arith()
+        arith.nums = 0
+        arith.packrat = True
+        arith.packrat_hooks = True
+        arith.packrat_size = 2
+        res = arith.parse(source)
+        self.assertEqual(res.value, 105 + 6 * 79,
+                         "packrat eviction changed the result")
+        self.assertEqual(len(arith._stream.memo), 2)
+
+    def test_30_compile(self):
+        """
+        Test compiled rules give the same result than interpreted ones
+        """
+        source = "((1 + 2) * (3 + 4)) * (((5))) + 6 * (7 + 8 * 9)"
+        arith = Arith()
+        arith.nums = 0
+        res = arith.parse(source)
+        nums = arith.nums
+        self.assertTrue(Arith.compile())
+        try:
+            arith = Arith()
+            arith.nums = 0
+            cres = arith.parse(source)
+            self.assertEqual(res.value, cres.value,
+                             "compiled rules changed the result")
+            self.assertEqual(nums, arith.nums,
+                             "compiled rules changed the hook calls")
+            with self.assertRaises(error.Diagnostic):
+                arith.parse("(1 + 2")
+        finally:
+            Arith._compiled = None
+
+    def test_31_fused_terminals(self):
+        """
+        Test terminal-only subtrees matched by regex
+        """
+        tokens = Tokens._rules['token']
+        self.assertIsInstance(tokens[0].pt[1], parsing.Regex,
+                              "failed to fuse terminals")
+        res = Tokens().parse("abab abc 12_c #1 2  3 x")
+        self.assertEqual(res.tokens,
+                         ['abab', 'ab', 'c', '12', '_c', '#1 2  3 ', 'x'],
+                         "failed to match fused terminals")
+
+    def test_32_alt_dispatch(self):
+        """
+        Test alternatives skipped by their first char
+        """
+        steps = Values._rules['value'].dispatch(Values("1"))
+        self.assertEqual(steps[-1], 2, "failed to select num")
+        self.assertEqual(steps[0].rule, 'array', "failed to skip kw, array")
+        res = Values().parse("[true [1 [] 2] false]")
+        self.assertEqual(res.value, [True, [1, [], 2], False],
+                         "failed to parse with dispatch")
+        res = Values(raise_diagnostic=False).parse("[1 x]")
+        self.assertEqual(res.diagnostic.logs[0].msg,
+                         "Parse error in 'num'",
+                         "skipped alternatives changed the error")
+
+    def test_33_link(self):
+        """
+        Test unknown rules and hooks reported before parsing
+        """
+        bad = grammar.from_string("""
+            main = [ 'a' #nohook | norule ]
+        """, 'main')
+        with self.assertRaises(error.Diagnostic) as ctx:
+            bad().parse("a")
+        msgs = sorted(log.msg for log in ctx.exception.logs)
+        self.assertEqual(len(msgs), 2, "failed to report all unknown names")
+        self.assertTrue(msgs[0].startswith("Unknown hook : nohook in rule"),
+                        "failed to report the unknown hook")
+        self.assertTrue(msgs[1].startswith("Unknown rule : norule in rule"),
+                        "failed to report the unknown rule")
+        links = Values.link()
+        self.assertIs(Values.link(), links, "failed to reuse the tables")
+        self.assertIs(links.rules['value'], Values._rules['value'],
+                      "failed to resolve a rule")
+
+    def test_34_iter_parse_file(self):
+        """
+        Test parsing a file record by record
+        """
+        import tempfile
+        lines = ["k%d=%d\n" % (i, i) for i in range(500)]
+        lines[300] = "big=%s\n" % ("9" * 200)
+        with tempfile.NamedTemporaryFile('w', suffix='.txt',
+                                         delete=False) as f:
+            f.write(''.join(lines))
+        try:
+            res = [(r.key, r.value) for r in
+                   Records().iter_parse_file(f.name, chunk_size=64)]
+            self.assertEqual(len(res), 500, "failed to parse all records")
+            self.assertEqual(res[42], ('k42', 42), "failed to parse record")
+            self.assertEqual(res[300], ('big', int("9" * 200)),
+                             "failed to parse a record bigger than a chunk")
+            with open(f.name, 'w') as fw:
+                fw.write(''.join(lines[:400] + ["oops\n"]))
+            parser = Records(raise_diagnostic=False)
+            res = list(parser.iter_parse_file(f.name, chunk_size=64))
+            self.assertEqual(len(res), 401, "failed to stop on error")
+            self.assertIs(res[-1], parser, "failed to yield the parser")
+            loc = parser.diagnostic.logs[0].location
+            self.assertEqual(loc.line, 401, "failed to locate the error")
+            # records too close to the end of the window are parsed again
+            with open(f.name, 'w') as fw:
+                fw.write(''.join("key_%03d=%s\n" % (i, "1" * 36)
+                                 for i in range(200)))
+            parser = Records()
+            res = list(parser.iter_parse_file(f.name, chunk_size=64))
+            self.assertEqual(len(res), 200, "failed to parse all records")
+            self.assertEqual(parser.fields, 201,
+                             "failed to keep the size of the window")
+            # failed searches don't count as reads cut by the window
+            with open(f.name, 'w') as fw:
+                fw.write(''.join("k%d=%d\n" % (i, i) for i in range(2000)))
+            searches = grammar.from_string("""
+                record =[ @ignore("null") [ ->'!' | id '=' num ] eol ]
+            """, 'record')
+            for stackless in (False, True):
+                parser = searches()
+                parser.stackless = stackless
+                window = 0
+                count = 0
+                for res in parser.iter_parse_file(f.name, chunk_size=64):
+                    window = max(window, parser._stream.eos_index)
+                    count += 1
+                self.assertEqual(count, 2000, "failed to parse all records")
+                self.assertLess(window, 1024, "failed to bound the window")
+        finally:
+            os.remove(f.name)
+
+    def test_35_profile(self):
+        """
+        Test rule statistics collected by a profiled parse
+        """
+        import json
+        arith = Arith()
+        arith.nums = 0
+        arith.packrat = True
+        arith.packrat_hooks = True
+        res = arith.parse("(1 + 2) * 3", profile=True)
+        self.assertEqual(res.value, 9, "profile changed the result")
+        stats = arith.profile.rules
+        self.assertEqual(stats['root'].calls, 1, "failed to profile entry")
+        self.assertEqual(stats['expr'].calls,
+                         stats['expr'].successes + stats['expr'].failures,
+                         "failed to count results")
+        self.assertGreater(stats['term'].backtracks, 0,
+                           "failed to count backtracks")
+        self.assertGreater(stats['factor'].memo_hits, 0,
+                           "failed to count memo hits")
+        self.assertLessEqual(stats['expr'].total_time,
+                             stats['root'].total_time,
+                             "recursive calls counted twice")
+        report = json.loads(arith.profile.to_json('calls'))
+        calls = [rule['calls'] for rule in report]
+        self.assertEqual(calls, sorted(calls, reverse=True),
+                         "failed to sort report")
+        self.assertTrue(arith.profile.to_text().startswith('rule '),
+                        "failed to write report")
+        self.assertEqual(arith._decorators, [], "failed to stop profiling")
+        profiled = grammar.from_string("""
+            root = [ 'a' @profile [ b ]+ ]
+            b = [ 'b' ]
+        """, 'root')
+        parser = profiled()
+        parser.parse("abbb")
+        self.assertEqual(parser.profile.rules['b'].calls, 4,
+                         "failed to profile with @profile")
+
+    def test_36_sampler(self):
+        """
+        Test collapsed rule stacks sampled during a parse
+        """
+        sampled = grammar.from_string("""
+            root = [ item+ eof ]
+            item = [ 'a' [ sub | #sample ] ]
+            sub = [ 'b' #sample ]
+        """, 'root')
+        sampler = parsing.Sampler()
+
+        @meta.hook(sampled)
+        def sample(self):
+            return sampler.sample()
+        self.assertFalse(sampler.sample(), "sampled outside of a rule")
+        sampled().parse("a ab a")
+        self.assertEqual(sampler.collapsed(), "root;item 2\nroot;item;sub 1\n",
+                         "failed to sample rule stacks")
+        arith = Arith()
+        arith.nums = 0
+        content = " + ".join(["(1 * 2)"] * 20)
+        with parsing.Sampler(interval=0.0001) as sampler:
+            for _ in range(100):
+                arith.parse(content)
+                if len(sampler.counts) > 0:
+                    break
+        self.assertGreater(len(sampler.counts), 0, "failed to sample")
+        for line in sampler.collapsed().splitlines():
+            stack, count = line.rsplit(' ', 1)
+            self.assertTrue(stack.startswith('root'),
+                            "sampled stack without its entry rule")
+            self.assertGreater(int(count), 0, "failed to count samples")
+
+    def test_37_budget(self):
+        """
+        Test parses aborted by an exceeded budget
+        """
+        from pyrser.directives import Budget
+        arith = Arith()
+        arith.nums = 0
+        budget = Budget(steps=100000, backtrack=100)
+        res = arith.parse("(1 + 2) * 3", budget=budget)
+        self.assertEqual(res.value, 9, "budget changed the result")
+        self.assertGreater(budget.steps, 0, "failed to count steps")
+        self.assertEqual(arith._decorators, [], "failed to stop budget")
+        # backtracking is exponential in nested parentheses
+        nested = "(" * 10 + "1" + ")" * 10
+        for budget, what in [(Budget(steps=1000), "1000 steps"),
+                             (Budget(deadline=0.01), "deadline"),
+                             (Budget(backtrack=20), "20 backtrack")]:
+            with self.assertRaises(error.Diagnostic) as e:
+                arith.parse(nested, budget=budget)
+            msg = e.exception.logs[0].msg
+            self.assertIn("Parse budget exceeded", msg,
+                          "failed to abort parse")
+            self.assertIn(what, msg, "failed to name the exceeded limit")
+            self.assertRegex(msg, "in '(expr|term|factor|num)'$",
+                             "failed to name the rule")
+            self.assertIsNotNone(e.exception.logs[0].location,
+                                 "failed to locate the abort")
+        arith.packrat = True
+        arith.packrat_hooks = True
+        with self.assertRaises(error.Diagnostic) as e:
+            arith.parse(nested, budget=Budget(memo=10))
+        self.assertIn("10 memo entries", e.exception.logs[0].msg,
+                      "failed to limit memo")
+        res = arith.parse(nested, budget=Budget(steps=100000))
+        self.assertEqual(res.value, 1, "failed to parse within budget")
+        arith.raise_diagnostic = False
+        res = arith.parse(nested, budget=Budget(steps=10))
+        self.assertTrue(res.diagnostic.have_errors,
+                        "failed to report exceeded budget")
+        # an abort in @ignore leaves the parser ready for the next parse
+        checked = Checked(raise_diagnostic=False)
+        res = checked.parse(",".join("a" * 100) + " x y",
+                            budget=Budget(steps=40))
+        self.assertFalse(res, "failed to abort parse")
+        self.assertTrue(checked.parse("ab x y"),
+                        "failed to parse after an abort")
+        self.assertEqual(checked._ignores, [parsing.Parser.ignore_blanks],
+                         "failed to pop the ignore conventions")
+
+    def test_38_stackless(self):
+        """
+        Test parses evaluated without recursion
+        """
+        arith = Arith()
+        arith.nums = 0
+        arith.stackless = True
+        res = arith.parse("(1 + 2) * 3")
+        self.assertEqual(res.value, 9, "failed to parse without recursion")
+        messages = []
+        for stackless in (True, False):
+            arith.stackless = stackless
+            with self.assertRaises(error.Diagnostic) as e:
+                arith.parse("(1 + 2) * ")
+            log = e.exception.logs[-1]
+            messages.append((log.msg, log.location.line, log.location.col))
+        self.assertEqual(messages[0], messages[1],
+                         "failed to report errors like recursive parses")
+        arith.stackless = True
+        arith.packrat = True
+        arith.packrat_hooks = True
+        depth = 5000
+        res = arith.parse("(" * depth + "1" + ")" * depth)
+        self.assertEqual(res.value, 1, "failed to parse deep nesting")
+        values = Values()
+        values.stackless = True
+        res = values.parse("[true [1 [] 2] false]")
+        self.assertEqual(res.value, [True, [1, [], 2], False],
+                         "failed to dispatch without recursion")
+        res = values.parse("[" * depth + "]" * depth)
+        self.assertEqual(len(res.value), 1, "failed to parse deep arrays")
+
+    def test_39_parse_many(self):
+        """
+        Test parsing many documents with the same parser
+        """
+        docs = ["k%d=%d\n" % (i, i) for i in range(100)]
+        parser = Records()
+        depth = len(parser._streams)
+        res = [(r.key, r.value) for r in parser.parse_many(docs)]
+        self.assertEqual(res, [(r.key, r.value) for r in
+                               (Records().parse(doc) for doc in docs)],
+                         "failed to parse like separate parsers")
+        self.assertEqual(len(parser._streams), depth, "failed to pop stream")
+        parser = Records(raise_diagnostic=False)
+        res = []
+        for r in parser.parse_many(["a=1\n", "oops\n", "b=2\n"]):
+            res.append(r.key if r is not parser else r.diagnostic.logs[0]
+                       .location.line)
+        self.assertEqual(res, ['a', 1, 'b'], "failed to go on after errors")
+        with self.assertRaises(error.Diagnostic):
+            list(Records().parse_many(["a=1\n", "oops\n"]))
+        arith = Arith()
+        arith.nums = 0
+        arith.stackless = True
+        res = [r.value for r in arith.parse_many(["1 + 2", "2 * 3", "(4)"])]
+        self.assertEqual(res, [3, 6, 4], "failed to parse without recursion")
+        # a document failing in @ignore doesn't leave its convention
+        checked = Checked(raise_diagnostic=False)
+        res = [bool(r) for r in
+               checked.parse_many(["ab x y", "bad x y", "ab x y"])]
+        self.assertEqual(res, [True, False, True],
+                         "failed to reset the ignore conventions")
+        self.assertEqual(checked._ignores, [parsing.Parser.ignore_blanks],
+                         "failed to pop the ignore conventions")
+
+    def test_40_alt_dispatch_redefined(self):
+        """
+        Test alternatives dispatched on rules redefined after a parse
+        """
+        redefined = grammar.from_string("""
+            root = [ a | b ]
+            a = [ 'x' ]
+            b = [ 'y' ]
+        """, 'root')
+        self.assertTrue(redefined().parse("y"), "failed to dispatch")
+        redefined.set_rules({'b': parsing.Char('z')})
+        self.assertTrue(redefined().parse("z"),
+                        "failed to dispatch on the redefined rule")
+        self.assertFalse(redefined(raise_diagnostic=False).parse("y"),
+                         "failed to drop the previous rule")
@@ -75,3 +75,62 @@ class GrammarDecorator_Test(unittest.TestCase):
                          + "[eof] Entering\n"
                          + "[eof] Succeeded\n",
                          "Trace doesn't match expected result.")
+
+    def test_03_trace_compiled(self):
+        """
+        Test @trace decorator directive in a compiled grammar
+        """
+        TraceSimple.compile()
+        try:
+            l = TraceSimple("word", raise_diagnostic=False)
+            res = l.parse()
+        finally:
+            TraceSimple._compiled = None
+
+        trace = ""
+        with open("logfile") as flog:
+            trace = flog.read()
+        os.remove("logfile")
+
+        self.assertFalse(res, "Did not fail to parse TraceSimple")
+        self.assertEqual(trace,
+                         "[space] Entering\n"
+                         + "[space] Failed\n"
+                         + "[ponctuation] Entering\n"
+                         + "[ponctuation] Failed\n"
+                         + "[word] Entering\n"
+                         + "[word] Failed\n",
+                         "Trace doesn't match expected result.")
+
+    def test_04_decorators_per_parser(self):
+        """
+        Test decorators only see the parser they decorate
+        """
+        seen = []
+
+        @meta.decorator("spy")
+        class Spy(parsing.DecoratorWrapper):
+            def __init__(self):
+                pass
+
+            def begin(self, parser, pt):
+                seen.append(parser)
+                return True
+
+            def end(self, res, parser, pt):
+                return True
+
+        inner = grammar.from_string("root = [ 'b' ]", 'root')
+        outer = grammar.from_string("root = [ @spy [ 'a' #inner ] ]", 'root')
+
+        @meta.hook(outer, "inner")
+        def inner_parse(self):
+            return bool(inner().parse("b"))
+
+        parser = outer()
+        self.assertTrue(parser.parse("a"), "failed to parse")
+        self.assertTrue(len(seen) > 0, "failed to call the decorator")
+        self.assertEqual(set(seen), {parser},
+                         "decorator saw another parser")
+        self.assertEqual(parser._decorators, [],
+                         "failed to pop the decorator")
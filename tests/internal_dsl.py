@@ -564,3 +564,24 @@ class InternalDsl_Test(unittest.TestCase):
         dummyData.test = self
         #with dummyData as s:
         eval_res = dummyData.eval_rule('main')
+
+    def test_28_rules_built_once(self):
+        """
+        Test the DSL rules are shared by all instances
+        """
+        maps = list(dsl.EBNF._rules.maps)
+        links = []
+        for src in ("a = [ id ]", "b = [ num ]"):
+            res = dsl.EBNF(src).get_rules()
+            self.assertIn(src[0], res)
+            links.append(dsl.EBNF._links)
+        self.assertEqual(maps, dsl.EBNF._rules.maps)
+        self.assertIs(links[0], links[1])
+        with self.assertRaises(TypeError):
+            dsl.EBNF._rules.maps[1]['bnf_dsl'] = None
+        # the DSL can still be extended
+        self.addCleanup(dsl.EBNF._rules.maps[0].clear)
+        meta.set_one(dsl.EBNF._rules, 'EBNF.test_28', parsing.Char('x'))
+        self.assertIn('EBNF.test_28', dsl.EBNF._rules)
+        self.assertIn('test_28', dsl.EBNF.tables().rules)
+        self.assertIn('bnf_dsl', dsl.EBNF._rules)
@@ -78,6 +78,13 @@ class InternalParse_Test(unittest.TestCase):
             'failed in read_identifier for other')
         reste = parser.get_tag('other')
         self.assertEqual(str(reste), "un test", "failed in capture other")
+        # letters and digits are those of str.isalpha and str.isdigit
+        for text, size in (("été1 x", 4), ("a½", 1), ("½x", 0)):
+            parser = parsing.Parser(text)
+            self.assertEqual(bool(parser.read_identifier()), size > 0,
+                             "failed in read_identifier for %s" % text)
+            self.assertEqual(parser._stream.index, size,
+                             "failed to stop read_identifier in %s" % text)
 
     def test_02_readInteger(self):
         """
@@ -109,6 +116,12 @@ class InternalParse_Test(unittest.TestCase):
         n3 = parser.get_tag('n3')
         self.assertEqual(str(n3), "44444444444444444444444444",
                          "failed in capture n3")
+        for text, size in (("1² x", 2), ("²", 1), ("½", 0)):
+            parser = parsing.Parser(text)
+            self.assertEqual(bool(parser.read_integer()), size > 0,
+                             "failed in read_integer for %s" % text)
+            self.assertEqual(parser._stream.index, size,
+                             "failed to stop read_integer in %s" % text)
 
     def test_04_readCChar(self):
         """
@@ -8,31 +8,37 @@ class TestCursor(unittest.TestCase):
         default = Position(0, 1, 1)
         self.assertEqual(default, Cursor().position)
 
-    def test_it_sets_position_to_provided_position(self):
-        pos = Position(1, 3, 5)
-        self.assertEqual(pos, Cursor(pos).position)
+    def test_it_sets_position_to_provided_index(self):
+        lines = (0, 2, 4)
+        self.assertEqual(Position(5, 3, 2), Cursor(lines, 5).position)
 
     def test_it_increments_cursor_to_next_char_position(self):
-        start, dest = Position(1, 3, 5), Position(1 + 1, 3, 5 + 1)
-        cursor = Cursor(start)
+        start, dest = Position(1, 1, 2), Position(1 + 1, 1, 2 + 1)
+        cursor = Cursor()
+        cursor.position = start
         cursor.step_next_char()
         self.assertEqual(dest, cursor.position)
 
     def test_it_increments_line(self):
-        start, dest = Position(1, 3, 5), Position(1, 3 + 1, 0)
-        cursor = Cursor(start)
-        cursor.step_next_line()
-        self.assertEqual(dest, cursor.position)
+        cursor = Cursor((0, 2), 1)
+        cursor.step_next_char()
+        self.assertEqual(Position(2, 2, 1), cursor.position)
 
     def test_it_decrements_cursor_to_prev_char_position(self):
-        start, dest = Position(1, 3, 5), Position(1 - 1, 3, 5 - 1)
-        cursor = Cursor(start)
+        start, dest = Position(1, 1, 2), Position(1 - 1, 1, 2 - 1)
+        cursor = Cursor()
+        cursor.position = start
         cursor.step_prev_char()
         self.assertEqual(dest, cursor.position)
 
     def test_it_decrements_line(self):
-        pos = Position(1, 3, 5)
-        cursor = Cursor(pos)
-        cursor.step_next_line()
-        cursor.step_prev_line()
-        self.assertEqual(pos, cursor.position)
+        cursor = Cursor((0, 2), 2)
+        cursor.step_prev_char()
+        self.assertEqual(Position(1, 1, 2), cursor.position)
+
+    def test_it_keeps_max_readed_position(self):
+        cursor = Cursor((0, 2), 2)
+        cursor.step_next_char()
+        cursor.step_prev_char()
+        cursor.step_prev_char()
+        self.assertEqual(Position(3, 2, 2), cursor.max_readed_position)
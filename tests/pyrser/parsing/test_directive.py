@@ -0,0 +1,29 @@
+import unittest
+from unittest import mock
+
+from pyrser import parsing
+
+
+class DummyDirective(parsing.DirectiveWrapper):
+    def begin(self, parser, a: int, b: str):
+        return True
+
+    def end(self, parser, a: int, b: str):
+        return True
+
+
+class TestDirective(unittest.TestCase):
+    def test_it_checks_literal_params_once(self):
+        directive = DummyDirective()
+        pt = mock.Mock(return_value=True)
+        with mock.patch.object(DummyDirective, 'checkParam',
+                               return_value=True) as check:
+            functor = parsing.Directive(directive, [(1, int), ('', str)], pt)
+            functor(None)
+            functor(None)
+        check.assert_called_once_with([1, ''])
+        self.assertEqual(2, pt.call_count)
+
+    def test_it_raises_typeerror_when_built_with_wrong_params(self):
+        with self.assertRaises(TypeError):
+            parsing.Directive(DummyDirective(), [('', str), ('', str)], None)
@@ -0,0 +1,62 @@
+import unittest
+
+from pyrser.parsing.frames import Frames, FrameMap
+
+
+class TestFrameMap(unittest.TestCase):
+    def test_it_shadows_outer_bindings_until_pop(self):
+        frames = Frames()
+        nodes = FrameMap(frames)
+        nodes['a'] = 1
+        frames.push()
+        nodes['a'] = 2
+        nodes['b'] = 3
+        self.assertEqual(2, nodes['a'])
+        self.assertIn('b', nodes)
+        frames.pop()
+        self.assertEqual(1, nodes['a'])
+        self.assertNotIn('b', nodes)
+
+    def test_it_pops_all_maps_sharing_frames(self):
+        frames = Frames()
+        nodes = FrameMap(frames)
+        tags = FrameMap(frames)
+        frames.push()
+        nodes['a'] = 1
+        tags['a'] = 2
+        frames.pop()
+        self.assertEqual(0, len(nodes))
+        self.assertEqual(0, len(tags))
+
+    def test_it_rebinds_in_the_defining_scope(self):
+        frames = Frames()
+        nodes = FrameMap(frames)
+        nodes['a'] = 1
+        frames.push()
+        nodes.rebind('a', 2)
+        frames.pop()
+        self.assertEqual(2, nodes['a'])
+        with self.assertRaises(KeyError):
+            nodes.rebind('b', 3)
+
+    def test_it_clears_only_the_innermost_scope(self):
+        frames = Frames()
+        nodes = FrameMap(frames)
+        nodes['a'] = 1
+        frames.push()
+        nodes['a'] = 2
+        nodes['b'] = 3
+        nodes.clear()
+        self.assertEqual({'a': 1}, dict(nodes))
+        frames.pop()
+        self.assertEqual({'a': 1}, dict(nodes))
+
+    def test_it_is_reusable_after_clear(self):
+        frames = Frames()
+        nodes = FrameMap(frames)
+        frames.push()
+        frames.push()
+        nodes['a'] = 1
+        frames.clear()
+        self.assertEqual(0, frames.level)
+        self.assertNotIn('a', nodes)
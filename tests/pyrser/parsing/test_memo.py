@@ -0,0 +1,30 @@
+import unittest
+
+from pyrser.parsing.memo import Memo
+
+
+class TestMemo(unittest.TestCase):
+    def test_it_returns_none_for_unknown_key(self):
+        memo = Memo()
+        self.assertIsNone(memo.get('rule'))
+        self.assertEqual(1, memo.misses)
+
+    def test_it_returns_stored_entry(self):
+        memo = Memo()
+        memo.set('rule', (True, 12))
+        self.assertEqual((True, 12), memo.get('rule'))
+        self.assertEqual(1, memo.hits)
+
+    def test_it_evicts_least_recently_used_entry(self):
+        memo = Memo(2)
+        memo.set('a', 1)
+        memo.set('b', 2)
+        memo.get('a')
+        memo.set('c', 3)
+        self.assertIn('a', memo)
+        self.assertNotIn('b', memo)
+        self.assertEqual(2, len(memo))
+
+    def test_it_refuses_empty_size(self):
+        with self.assertRaises(ValueError):
+            Memo(0)
@@ -1,7 +1,7 @@
 import unittest
 
 from pyrser import parsing
-from pyrser.parsing.stream import Position
+from pyrser.parsing.stream import Position, Tag
 
 
 class TestParserStream(unittest.TestCase):
@@ -29,6 +29,15 @@ class TestParserStream(unittest.TestCase):
         self.assertEqual(1, stream.col_offset)
         self.assertLess(prev_line, stream.lineno)
 
+    def test_it_computes_line_and_column_from_index(self):
+        stream = parsing.Stream("ab\ncd\n\nef")
+        stream.incpos(4)
+        self.assertEqual(Position(4, 2, 2), stream._cursor.position)
+        stream.incpos(3)
+        self.assertEqual(Position(7, 4, 1), stream._cursor.position)
+        stream.incpos(10)
+        self.assertEqual(Position(9, 4, 3), stream._cursor.position)
+
     def test_it_does_not_increment_position_passed_eof(self):
         stream = parsing.Stream("")
         pos = stream.index
@@ -43,8 +52,8 @@ class TestParserStream(unittest.TestCase):
 
     def test_it_decrements_position_on_newline(self):
         stream = parsing.Stream("\n")
-        stream._cursor.step_next_line()
         stream._cursor.step_next_char()
+        self.assertEqual(2, stream.lineno)
         stream.decpos()
         self.assertEqual(1, stream.lineno)
 
@@ -62,13 +71,42 @@ class TestParserStream(unittest.TestCase):
 
     def test_it_restore_context(self):
         stream = parsing.Stream()
-        pos = Position(42, 0, 0)
-        stream._contexts.insert(0, pos)
+        stream._contexts.insert(0, 42)
         stream.restore_context()
-        self.assertEqual(pos.index, stream.index)
+        self.assertEqual(42, stream.index)
 
     def test_it_validates_context(self):
         stream = parsing.Stream()
-        stream._contexts.insert(0, Position(42, 0, 0))
+        stream._contexts.insert(0, 42)
         stream.validate_context()
         self.assertEqual(0, stream.index)
+
+
+class TestTag(unittest.TestCase):
+    def test_it_extracts_text_between_indexes(self):
+        stream = parsing.Stream("some content")
+        tag = Tag(stream, 5)
+        self.assertEqual("", str(tag))
+        tag.set_end(12)
+        self.assertEqual("content", str(tag))
+        self.assertIs(str(tag), str(tag))
+
+
+class TestChunkedStream(unittest.TestCase):
+    def test_it_reads_chunks_on_demand(self):
+        stream = parsing.ChunkedStream(["ab\n", "cd\n", "ef"])
+        self.assertEqual(0, len(stream))
+        self.assertTrue(stream.fill(4))
+        self.assertEqual("ab\ncd\n", stream[:])
+        self.assertFalse(stream.fill(100))
+        self.assertTrue(stream.exhausted)
+
+    def test_it_discards_lines_before_the_cursor(self):
+        stream = parsing.ChunkedStream(["ab\ncd\nef"])
+        stream.fill(8)
+        stream.incpos(7)
+        self.assertEqual(6, stream.discard())
+        self.assertEqual("ef", stream[:])
+        self.assertEqual(1, stream.index)
+        self.assertEqual(3, stream.lineno)
+        self.assertEqual(2, stream.col_offset)
@@ -0,0 +1,92 @@
+import unittest
+
+from pyrser import parsing
+from pyrser.directives import ignore
+from pyrser.parsing import ir
+from pyrser.passes import optimize
+
+
+def null(pt: parsing.Functor) -> parsing.Directive:
+    return parsing.Directive(ignore.Ignore(), [("null", str)], pt)
+
+
+class TestOptimize(unittest.TestCase):
+    def test_it_converts_functors_to_ir(self):
+        pt = parsing.Seq(parsing.Char('a'), parsing.Rule('b'))
+        self.assertEqual(
+            ir.SaveCtx(ir.Block([
+                ir.SkipIgnore(), ir.EqualBlock('a'), ir.SkipIgnore(),
+                ir.CallRule('b'), ir.SkipIgnore()])),
+            optimize.convert(pt))
+
+    def test_it_merges_texts_without_ignore_between(self):
+        pt = null(parsing.Seq(parsing.Text('ab'), parsing.Char('c')))
+        block = optimize.optimize(optimize.convert(pt)).block
+        self.assertEqual(
+            ir.Block([ir.SkipIgnore(True), ir.EqualBlock('abc', (2, 3)),
+                      ir.SkipIgnore(True)]),
+            block)
+
+    def test_it_keeps_texts_with_ignore_between(self):
+        pt = parsing.Seq(parsing.Text('ab'), parsing.Char('c'))
+        res = optimize.optimize(optimize.convert(pt))
+        self.assertIsInstance(res, ir.SaveCtx)
+        texts = [sub for sub in res.walk()
+                 if isinstance(sub, ir.EqualBlock)]
+        self.assertEqual(2, len(texts))
+
+    def test_it_elides_contexts_of_blocks_failing_in_place(self):
+        pt = null(parsing.Seq(parsing.Char('a')))
+        self.assertEqual(
+            ir.Block([ir.SkipIgnore(True), ir.EqualBlock('a'),
+                      ir.SkipIgnore(True)]),
+            optimize.optimize(optimize.convert(pt)).block)
+
+    def test_it_keeps_contexts_of_blocks_moving_before_failing(self):
+        pt = null(parsing.Seq(parsing.Char('a'), parsing.Rule('b')))
+        res = optimize.optimize(optimize.convert(pt))
+        self.assertIsInstance(res.block, ir.SaveCtx)
+
+    def test_it_removes_dead_alternatives(self):
+        pt = parsing.Alt(parsing.Char('a'), parsing.Rep0N(parsing.Char('b')),
+                         parsing.Char('c'))
+        res = optimize.optimize(optimize.convert(pt))
+        self.assertEqual(2, len(res.lsexpr))
+        self.assertEqual((0, 1), res.indexes)
+
+    def test_it_hoists_eof_checks_of_terminal_runs(self):
+        pt = null(parsing.Seq(parsing.Char('a'),
+                              parsing.Range('0', '9'),
+                              parsing.Rule('b')))
+        block = optimize.optimize(optimize.convert(pt)).block.block
+        guard = block.lsexpr[1]
+        self.assertIsInstance(guard, ir.ReturnOnEof)
+        self.assertEqual(2, guard.length)
+        self.assertEqual(
+            [ir.EqualBlock('a'), ir.SkipIgnore(True),
+             ir.RangeBlock('0', '9')],
+            guard.block.lsexpr)
+
+    def test_it_inlines_trivial_rules(self):
+        rules = {
+            'digit': parsing.Range('0', '9'),
+            'digits': parsing.Rep1N(parsing.Rule('digit')),
+            'rec': parsing.Seq(parsing.Char('('), parsing.Rule('rec')),
+        }
+        inliner = optimize.Inliner(rules)
+        res = optimize.optimize(optimize.convert(rules['digits']), inliner)
+        self.assertEqual(
+            ir.Rep1N(ir.InlineRule('digit', ir.RangeBlock('0', '9'))), res)
+        res = optimize.optimize(optimize.convert(rules['rec']), inliner)
+        self.assertIn(ir.CallRule('rec'), list(res.walk()))
+        self.assertIsNone(inliner.block('rec'))
+
+    def test_it_keeps_errors_in_machine(self):
+        pt = null(parsing.Seq(parsing.Text('ab'), parsing.Text('cd')))
+        parser = parsing.Parser("abce")
+        parser.set_rules({'test': pt})
+        parser.stackless = True
+        self.assertFalse(parsing.machine.run(parser, 'test'))
+        self.assertEqual(0, parser._stream.index)
+        self.assertEqual(
+            2, parser._stream._cursor.max_readed_position.index)
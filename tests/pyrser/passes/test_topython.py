@@ -1,235 +1,155 @@
-import ast
-import collections
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
 
-from pyrser import codegen
-from pyrser import parsing
-from pyrser import passes
-
-#Internal import used to patch handling of stubs
+from pyrser import grammar
+from pyrser import meta
 from pyrser.passes import topython
 
 
-#Immutable stub ParseTree node
-ParseTreeStub = collections.namedtuple('ParseTreeStub', 'name inline')
-
-
-def visit_ParseTreeStub(self, node: ParseTreeStub) -> [ast.stmt] or ast.expr:
-    """Function to generate expression for stub ParseTree nodes."""
-    expr = ast.Name(node.name, ast.Load())
-    return expr if node.inline else self._clause(expr)
-
-
-@unittest.skip('Fix brittle test suite by testing behavior instead of code')
-class TestToPythonPasse(unittest.TestCase):
-    @classmethod
-    def setUpClass(cls):
-        topython.RuleVisitor.visit_ParseTreeStub = visit_ParseTreeStub
-
-    @classmethod
-    def tearDownClass(self):
-        del topython.RuleVisitor.visit_ParseTreeStub
-
-    def test_topython_generates_code_for_call(self):
-        method = parsing.BasicParser.read_char
-        call = parsing.Call(method, 'a')
-        res = codegen.to_source(passes.rule_topython(call))
-        self.assertEqual(res, "self.read_char('a')")
-
-    def test_topython_generates_code_for_calltrue(self):
-        method = parsing.BasicParser.read_char
-        call = parsing.CallTrue(method, 'a')
-        res = codegen.to_source(passes.rule_topython(call))
-        self.assertEqual(res, "lambda : (self.read_char('a') or True)")
-
-    def test_topython_generates_code_for_hook(self):
-        hook = parsing.Hook('hookname', tuple())
-        res = codegen.to_source(passes.rule_topython(hook))
-        self.assertEqual(res,
-                         "self.evalHook('hookname', self.ruleNodes[(-1)])")
-
-    def test_topython_generates_code_for_rule(self):
-        rule = parsing.Rule('rulename')
-        res = codegen.to_source(passes.rule_topython(rule))
-        self.assertEqual(res, "self.evalRule('rulename')")
-
-    def test_topython_inline_inlinable_clauses(self):
-        clauses = parsing.Seq(
-            ParseTreeStub('a', True), ParseTreeStub('b', True))
-        res = codegen.to_source(ast.Module(passes.rule_topython(clauses)))
-        self.assertEqual(res, "(a and b)")
-
-    def test_topython_inline_partially_inlinable_clauses(self):
-        clauses = parsing.Seq(
-            ParseTreeStub('a', True),
-            ParseTreeStub('b', True),
-            ParseTreeStub('c', False))
-        res = codegen.to_source(ast.Module(passes.rule_topython(clauses)))
-        self.assertEqual(res, ("if (not (a and b)):\n"
-                               "    return False\n"
-                               "if (not c):\n"
-                               "    return False"))
-
-    def test_topython_generates_code_for_clauses(self):
-        clauses = parsing.Seq(
-            ParseTreeStub('a', False), ParseTreeStub('b', False))
-        res = codegen.to_source(ast.Module(passes.rule_topython(clauses)))
-        self.assertEqual(res, ("if (not a):\n"
-                               "    return False\n"
-                               "if (not b):\n"
-                               "    return False"))
-
-    def test_topython_generates_code_for_complex_clauses(self):
-        clauses = parsing.Seq(
-            ParseTreeStub('a', False),
-            parsing.Seq(ParseTreeStub('b', False)))
-        res = codegen.to_source(ast.Module(passes.rule_topython(clauses)))
-        self.assertEqual(res, ("if (not a):\n"
-                               "    return False\n"
-                               "if (not b):\n"
-                               "    return False"))
-
-    def test_topython_generates_code_for_alt(self):
-        alt = parsing.Alt(
-            ParseTreeStub('a', False), ParseTreeStub('b', False))
-        res = codegen.to_source(ast.Module(passes.rule_topython(alt)))
-        self.assertEqual(res, ("try:\n"
-                               "    try:\n"
-                               "        if (not a):\n"
-                               "            raise AltFalse()\n"
-                               "        raise AltTrue()\n"
-                               "    except AltFalse:\n"
-                               "        pass\n"
-                               "    try:\n"
-                               "        if (not b):\n"
-                               "            raise AltFalse()\n"
-                               "        raise AltTrue()\n"
-                               "    except AltFalse:\n"
-                               "        pass\n"
-                               "    return False\n"
-                               "except AltTrue:\n"
-                               "    pass"))
-
-    def test_topython_generates_code_for_complex_alt(self):
-        self.maxDiff = None
-        alt = parsing.Alt(
-            ParseTreeStub('a', False),
-            parsing.Seq(
-                ParseTreeStub('b', False),
-                parsing.Alt(
-                    ParseTreeStub('c', False),
-                    ParseTreeStub('d', False))))
-        res = codegen.to_source(ast.Module(passes.rule_topython(alt)))
-        self.assertEqual(res, ("try:\n"
-                               "    try:\n"
-                               "        if (not a):\n"
-                               "            raise AltFalse()\n"
-                               "        raise AltTrue()\n"
-                               "    except AltFalse:\n"
-                               "        pass\n"
-                               "    try:\n"
-                               "        if (not b):\n"
-                               "            raise AltFalse()\n"
-                               "        try:\n"
-                               "            try:\n"
-                               "                if (not c):\n"
-                               "                    raise AltFalse()\n"
-                               "                raise AltTrue()\n"
-                               "            except AltFalse:\n"
-                               "                pass\n"
-                               "            try:\n"
-                               "                if (not d):\n"
-                               "                    raise AltFalse()\n"
-                               "                raise AltTrue()\n"
-                               "            except AltFalse:\n"
-                               "                pass\n"
-                               "            raise AltFalse()\n"
-                               "        except AltTrue:\n"
-                               "            pass\n"
-                               "        raise AltTrue()\n"
-                               "    except AltFalse:\n"
-                               "        pass\n"
-                               "    return False\n"
-                               "except AltTrue:\n"
-                               "    pass"))
-
-    def test_topython_generates_code_for_inlined_repoptional(self):
-        rep = parsing.RepOptional(ParseTreeStub('a', True))
-        res = codegen.to_source(passes.rule_topython(rep))
-        self.assertEqual(res, "(a or True)")
-
-    def test_topython_generates_code_for_repoptional(self):
-        rep = parsing.RepOptional(ParseTreeStub('a', False))
-        ast_ = ast.Module(passes.rule_topython(rep))
-        res = codegen.to_source(ast_)
-        self.assertEqual(res, "if (not a):\n"
-                              "    pass")
-
-    def test_topython_generates_code_for_rep0n(self):
-        rep = parsing.Rep0N(ParseTreeStub('a', False))
-        ast_ = ast.Module(passes.rule_topython(rep))
-        res = codegen.to_source(ast_)
-        self.assertEqual(
-            res,
-            ("while True:\n"
-             "    if (not a):\n"
-             "        break"))
-
-    def test_topython_generates_code_for_rep1n(self):
-        rep = parsing.Rep1N(ParseTreeStub('a', False))
-        res = codegen.to_source(ast.Module(passes.rule_topython(rep)))
-        self.assertEqual(
-            res,
-            ("if (not a):\n"
-             "    return False\n"
-             "while True:\n"
-             "    if (not a):\n"
-             "        break"))
-
-    #TODO(bps): Finish testing generation for capture node
-    @unittest.skip
-    def test_topython_generates_code_for_capture(self):
-        pass
-
-    #TODO(bps): Finish testing generation for scope node
-    @unittest.skip
-    def test_topython_generates_code_for_scope(self):
-        pass
-
-#TODO(bps): remove till end of file
-    def help(self, rule):
-        res = passes.rule_topython(rule)
-        stmts = str(res)
-        if isinstance(res, list):
-            res = ast.Module(res)
-        code = codegen.to_source(res)
-        return '\n'.join([
-            "========= RULE ==========",
-            rule.dump_tree(),
-            "========== AST ==========",
-            stmts,
-            "========= CODE ==========",
-            code,
-            "========== END =========="])
-
-    def test_topython_generates_code_for_parserdsl(self):
-        from pprint import pprint
-        from pyrser.dsl import EBNF
-        import pyrser.passes.dump_tree
-
-        dsl_rules = [
-            'bnf_dsl',
-            'rule',
-            'alternatives',
-            'sequences',
-            'sequence',
-            'ns_name',
-            'repeat',
-            'hook',
-            'param']
-        res, parser = [], EBNF()
-        #res.append(self.help(parser._rules['alternatives']))
-        for rule in dsl_rules:
-            res.append(codegen.to_source(
-                passes.parserrule_topython(parser, rule)))
-        #print('\n\n'.join(res))
+class Values(grammar.Grammar):
+    entry = "values"
+    grammar = """
+        values = [ '[' [value:v #add_value(_, v)]* ']' eof ]
+        value = [ @ignore("null") ['-']? ['0'..'9']+ | id | "none" | string ]
+    """
+
+
+@meta.hook(Values)
+def add_value(self, ast, v):
+    if not hasattr(ast, 'lst'):
+        ast.lst = []
+    ast.lst.append(self.value(v))
+    return True
+
+
+class Summed(grammar.Grammar):
+    packrat_size = 12
+
+
+class Sum(Summed):
+    entry = "sum"
+    grammar = """
+        sum = [ num:n #total(_, n) ['+' num:n #total(_, n)]* eof ]
+    """
+    packrat = True
+
+    def after_parse(self, node):
+        node.checked = True
+        return node
+
+
+@meta.hook(Sum)
+def total(self, ast, n):
+    ast.total = getattr(ast, 'total', 0) + int(self.value(n))
+    return True
+
+
+class Words(grammar.Grammar):
+    entry = "words"
+    grammar = """words = [ id+ eof ]"""
+
+
+def load_module(filename: str):
+    spec = importlib.util.spec_from_file_location("generated", filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class TestToPython(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.py')
+        os.close(fd)
+        self.addCleanup(os.remove, self.filename)
+
+    def test_it_writes_a_grammar_parsing_like_the_original(self):
+        Values.write_module(self.filename)
+        generated = load_module(self.filename).Values
+        self.assertIsNone(generated.grammar)
+        src = '[12 -3 abc none "s t" 4]'
+        res = generated().parse(src)
+        self.assertEqual(['12', '-3', 'abc', 'none', '"s t"', '4'],
+                         res.lst)
+        self.assertEqual(Values().parse(src).lst, res.lst)
+
+    def test_it_uses_the_compiled_rules(self):
+        Values.write_module(self.filename)
+        generated = load_module(self.filename).Values
+        self.assertIn(generated._rules['values'], generated._compiled)
+        self.assertIn(generated._rules['Values.value'], generated._compiled)
+
+    def test_it_reports_errors_like_the_original(self):
+        Values.write_module(self.filename)
+        generated = load_module(self.filename).Values
+        res = generated(raise_diagnostic=False).parse('[1 2 -]')
+        exp = Values(raise_diagnostic=False).parse('[1 2 -]')
+        self.assertFalse(res)
+        self.assertEqual(exp.diagnostic.logs[0].location.col,
+                         res.diagnostic.logs[0].location.col)
+
+    def test_it_writes_the_same_source_in_each_process(self):
+        code = ("import sys\n"
+                "from tests.pyrser.passes import test_topython\n"
+                "from pyrser.passes import topython\n"
+                "sys.stdout.write(topython.source(test_topython.Values))\n")
+        root = os.path.join(os.path.dirname(__file__), '..', '..', '..')
+        out = subprocess.check_output([sys.executable, '-c', code],
+                                      cwd=os.path.abspath(root))
+        self.assertEqual(topython.source(Values), out.decode('utf-8'))
+
+    def test_it_keeps_the_bases_and_attributes_of_the_grammar(self):
+        Sum.write_module(self.filename)
+        generated = load_module(self.filename).Sum
+        self.assertTrue(issubclass(generated, Summed))
+        self.assertTrue(generated.packrat)
+        self.assertEqual(12, generated.packrat_size)
+        res = generated().parse('1 + 2 + 3')
+        self.assertEqual(6, res.total)
+        self.assertTrue(res.checked)
+
+    def test_it_parses_grammar_texts_only_to_import_hooks(self):
+        # hooks are imported from their module, which defines grammars
+        with_hooks = self.filename
+        fd, hookless = tempfile.mkstemp(suffix='.py')
+        os.close(fd)
+        self.addCleanup(os.remove, hookless)
+        Values.write_module(with_hooks)
+        Words.write_module(hookless)
+        code = ("import importlib.util\n"
+                "import sys\n"
+                "from pyrser import dsl\n"
+                "parses = []\n"
+                "get_rules = dsl.EBNF.get_rules\n"
+                "def counted(self):\n"
+                "    parses.append(self)\n"
+                "    return get_rules(self)\n"
+                "dsl.EBNF.get_rules = counted\n"
+                "for filename in sys.argv[1:]:\n"
+                "    spec = importlib.util.spec_from_file_location(\n"
+                "        'generated', filename)\n"
+                "    module = importlib.util.module_from_spec(spec)\n"
+                "    spec.loader.exec_module(module)\n"
+                "    print(len(parses))\n")
+        root = os.path.join(os.path.dirname(__file__), '..', '..', '..')
+        out = subprocess.check_output(
+            [sys.executable, '-c', code, hookless, with_hooks],
+            cwd=os.path.abspath(root))
+        hookless_parses, with_hooks_parses = out.decode('utf-8').split()
+        self.assertEqual('0', hookless_parses)
+        self.assertNotEqual('0', with_hooks_parses)
+
+    def test_it_refuses_hooks_that_cannot_be_imported(self):
+        class Local(grammar.Grammar):
+            entry = "test"
+            grammar = """test = [ id #local ]"""
+
+        @meta.hook(Local)
+        def local(self):
+            return True
+
+        with self.assertRaises(TypeError):
+            topython.source(Local)
@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from pyrser import cache
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        patcher = mock.patch.dict(os.environ, {'PYRSER_CACHE': self.root})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def test_it_keys_by_parts_and_version(self):
+        self.assertEqual(cache.key('a', 'b'), cache.key('a', 'b'))
+        self.assertNotEqual(cache.key('a', 'b'), cache.key('ab'))
+        with mock.patch('pyrser.__version__', '0.0.0'):
+            old = cache.key('a')
+        self.assertNotEqual(old, cache.key('a'))
+
+    def test_it_finds_published_entries(self):
+        self.assertIsNone(cache.lookup('kind', 'k'))
+        tmp = cache.mkdtemp('kind')
+        with open(os.path.join(tmp, 'f'), 'w') as f:
+            f.write('content')
+        path = cache.publish('kind', 'k', tmp)
+        self.assertEqual(path, cache.lookup('kind', 'k'))
+        self.assertTrue(os.path.isfile(os.path.join(path, 'f')))
+
+    def test_it_keeps_the_first_entry_published(self):
+        first = cache.mkdtemp('kind')
+        second = cache.mkdtemp('kind')
+        for tmp in (first, second):
+            with open(os.path.join(tmp, 'f'), 'w') as f:
+                f.write(tmp)
+        path = cache.publish('kind', 'k', first)
+        self.assertEqual(path, cache.publish('kind', 'k', second))
+        self.assertFalse(os.path.exists(second))
+        with open(os.path.join(path, 'f')) as f:
+            self.assertEqual(first, f.read())
+
+    def test_it_replaces_files(self):
+        path = os.path.join(self.root, 'f')
+        cache.replace(path, b'old')
+        cache.replace(path, b'new')
+        with open(path, 'rb') as f:
+            self.assertEqual(b'new', f.read())
+        self.assertEqual(['f'], os.listdir(self.root))
@@ -1,7 +1,17 @@
+import gc
+import os
+import shutil
+import tempfile
 import unittest
+import weakref
 from unittest import mock
 
 import pyrser
+from pyrser import dsl
+from pyrser import grammar
+from pyrser import meta
+from pyrser import parsing
+from pyrser.passes import topython
 
 
 class TestGrammar(unittest.TestCase):
@@ -37,6 +47,212 @@ class TestGrammar(unittest.TestCase):
         grammar.parsed_stream.assert_call_once_with(source)
         grammar.eval_rule.assert_call_once_with('rulename')
 
+def dump(pt) -> [str]:
+    objects = topython.ObjectSource()
+    objects.ref(pt)
+    return objects.lines
+
+
+class CountingEBNF(dsl.EBNF):
+    calls = 0
+
+    def get_rules(self):
+        CountingEBNF.calls += 1
+        return dsl.EBNF.get_rules(self)
+
+
+class TestGrammarCache(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        patcher = mock.patch.dict(os.environ, {'PYRSER_CACHE': self.root})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.root)
+        CountingEBNF.calls = 0
+
+    def test_it_loads_rules_from_the_cache(self):
+        bnf = "test = [ 'a' ['b' | \"cd\"]* #hook ]"
+        rules = grammar.dsl_rules(CountingEBNF, bnf)
+        cached = grammar.dsl_rules(CountingEBNF, bnf)
+        self.assertEqual(1, CountingEBNF.calls)
+        self.assertIsNot(rules['test'], cached['test'])
+        self.assertEqual(dump(rules['test']), dump(cached['test']))
+
+    def test_it_parses_changed_texts_again(self):
+        grammar.dsl_rules(CountingEBNF, "test = [ 'a' ]")
+        rules = grammar.dsl_rules(CountingEBNF, "test = [ 'b' ]")
+        self.assertEqual(2, CountingEBNF.calls)
+        grammar.dsl_rules(CountingEBNF, "test = [ 'b' ]", 'other.bnf')
+        self.assertEqual(3, CountingEBNF.calls)
+        with mock.patch('pyrser.__version__', '0.0.0'):
+            grammar.dsl_rules(CountingEBNF, "test = [ 'b' ]")
+        self.assertEqual(4, CountingEBNF.calls)
+
+    def test_it_parses_texts_again_without_cache(self):
+        grammar.dsl_rules(CountingEBNF, "test = [ 'a' ]", use_cache=False)
+        grammar.dsl_rules(CountingEBNF, "test = [ 'a' ]", use_cache=False)
+        self.assertEqual(2, CountingEBNF.calls)
+        self.assertEqual([], os.listdir(self.root))
+
+    def test_it_keeps_rules_out_of_the_cache_by_default(self):
+        class Default(grammar.Grammar):
+            entry = 'test'
+            grammar = "test = [ 'a' ]"
+
+        self.assertEqual([], os.listdir(self.root))
+
+    def test_it_parses_with_cached_rules(self):
+        bnf = "test = [ @ignore('null') ['a'..'z']+ : w #check(w) eof ]"
+
+        class Cached(grammar.Grammar):
+            entry = 'test'
+            grammar = bnf
+            dsl_parser = CountingEBNF
+            cache_rules = True
+
+        class Reloaded(grammar.Grammar):
+            entry = 'test'
+            grammar = bnf
+            dsl_parser = CountingEBNF
+            cache_rules = True
+
+        self.assertEqual(1, CountingEBNF.calls)
+        values = []
+
+        @meta.hook(Reloaded)
+        def check(self, w):
+            values.append(self.value(w))
+            return True
+
+        self.assertTrue(Reloaded().parse("abc"))
+        self.assertEqual(['abc'], values)
+
+
+class Letters(grammar.Grammar):
+    grammar = """
+        word = [ [ a | b ]+ ]
+        a = [ 'a' ]
+        b = [ 'b' ]
+    """
+
+
+class TestGeneratedGrammars(unittest.TestCase):
+    def test_it_builds_grammars_once_for_the_same_text(self):
+        bnf = "main = [ id eof ]"
+        cls = grammar.from_string(bnf, 'main')
+        self.assertIs(cls, grammar.from_string(bnf, 'main'))
+        self.assertIsNot(cls, grammar.from_string(bnf, 'id'))
+        self.assertIsNot(cls, grammar.from_string("main = [ num eof ]",
+                                                  'main'))
+        self.assertTrue(cls().parse("abc"))
+
+    def test_it_releases_the_grammars_used_least_recently(self):
+        registry = parsing.base._MetaBasicParser
+        with mock.patch.object(grammar, 'generated_size', 2):
+            first = grammar.from_string("a = [ id ]", 'a')
+            second = grammar.from_string("b = [ id ]", 'b')
+            self.assertIs(first, grammar.from_string("a = [ id ]", 'a'))
+            grammar.from_string("c = [ id ]", 'c')
+            self.assertIs(first, registry[first.__name__])
+            self.assertNotIn(second.__name__, registry)
+            self.assertIsNot(second, grammar.from_string("b = [ id ]", 'b'))
+            self.assertNotIn(first.__name__, registry)
+
+    def test_it_frees_the_grammars_released(self):
+        refs = []
+        with mock.patch.object(grammar, 'generated_size', 4):
+            for i in range(20):
+                cls = grammar.from_string("r%d = [ Letters.word eof ]" % i,
+                                          'r%d' % i, Letters)
+                parser = cls()
+                parser.stackless = i % 2 == 0
+                self.assertTrue(parser.parse("abba"))
+                refs.append(weakref.ref(cls))
+            del cls, parser
+            gc.collect()
+            alive = [ref() for ref in refs if ref() is not None]
+            self.assertEqual(4, len(alive))
+            self.assertEqual(set(alive), set(grammar._generated.values()))
+
+
+class TestGrammarTables(unittest.TestCase):
+    def test_it_builds_the_tables_with_the_class(self):
+        class Words(grammar.Grammar):
+            entry = "words"
+            grammar = """words = [ id+ eof ]"""
+
+        tables = Words.__dict__['_tables']
+        self.assertIs(tables, Words.tables())
+        self.assertEqual(dict(Words._rules), dict(tables.rules))
+        self.assertEqual(dict(Words._hooks), dict(tables.hooks))
+        with self.assertRaises(TypeError):
+            tables.rules['words'] = None
+
+    def test_it_keeps_overloads_and_namespaces(self):
+        from tests.grammar.csv import CSV, CSV2
+        rules = CSV2.tables().rules
+        self.assertIs(CSV2._rules['item'], rules['item'])
+        self.assertIsNot(rules['CSV.item'], rules['item'])
+        self.assertIs(CSV._rules['CSV.item'], rules['CSV.item'])
+        self.assertIs(rules['CSV2.item'], rules['item'])
+
+    def test_it_builds_the_tables_again_after_registrations(self):
+        class Words(grammar.Grammar):
+            entry = "words"
+            grammar = """words = [ [id:w #word(w)]+ eof ]"""
+
+        tables = Words.tables()
+        self.assertNotIn('word', tables.hooks)
+
+        @meta.hook(Words)
+        def word(self, w):
+            return True
+
+        self.assertIsNot(tables, Words.tables())
+        self.assertIn('word', Words.tables().hooks)
+        self.assertTrue(Words().parse("a b"))
+
+    def test_it_keeps_the_tables_of_unrelated_grammars(self):
+        class Words(grammar.Grammar):
+            grammar = """words = [ id+ ]"""
+
+        class Numbers(grammar.Grammar):
+            grammar = """numbers = [ num+ ]"""
+
+        # Both aggregates the rules and hooks of Words and Numbers
+        class Both(Words, Numbers):
+            entry = "both"
+            grammar = """both = [ words numbers ]"""
+
+        tables = Both.tables()
+        other = grammar.from_string("unrelated = [ id ]", 'unrelated')
+
+        @meta.hook(other)
+        def unrelated(self):
+            return True
+
+        self.assertIs(tables, Both.tables())
+
+        @meta.hook(Numbers)
+        def aggregated(self):
+            return True
+
+        self.assertIsNot(tables, Both.tables())
+        tables = Both.tables()
+        # hooks of parsing.Parser are inherited by all grammars
+        hooks = parsing.Parser._hooks.maps[0]
+        known = set(hooks)
+        self.addCleanup(delattr, parsing.Parser, 'inherited')
+
+        @meta.hook(parsing.Parser)
+        def inherited(self):
+            return True
+
+        for name in set(hooks) - known:
+            self.addCleanup(hooks.pop, name)
+        self.assertIsNot(tables, Both.tables())
+
+
 #    def test_it_raises_valueerror_without_entry_rulename(self):
 #        class UselessGrammar(pyrser.Grammar):
 #            pass